@@ -1,21 +1,37 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncConnection
 from service.jwttoken import create_access_token
 from service.oauth import get_current_user
-from service.hashing import Hash
-from database import conn
-from schemas import User, UserResponse
+from service.hashing import hash_password, verify_password
+from service.tracing import record, span
+from database import async_engine, get_async_conn
+from schemas import User, UserResponse, UserPage
 from models import Users
 
 from cryptography.fernet import Fernet
 
-import dotenv, os
+import dotenv, hashlib, hmac, os
+from typing import Optional
 
 dotenv.load_dotenv()
 ENCRYPTION_KEY = os.getenv("ENCRYPTION_KEY")
 
 cipher_suite = Fernet(ENCRYPTION_KEY)
 
+# Key for the email blind index. Falls back to one derived from ENCRYPTION_KEY;
+# changing it requires re-running python -m db.migrate_users_indexes --rebuild
+EMAIL_INDEX_KEY = (os.getenv("EMAIL_INDEX_KEY") or
+                   hmac.new(ENCRYPTION_KEY.encode(), b"email-blind-index", hashlib.sha256).hexdigest()).encode()
+
+USERS_PAGE_SIZE = int(os.getenv("USERS_PAGE_SIZE", "50"))
+USERS_MAX_PAGE_SIZE = int(os.getenv("USERS_MAX_PAGE_SIZE", "500"))
+
+# Everything but the password hash, in UserResponse order
+USER_COLUMNS = {column.name: column for column in (Users.c.id, Users.c.username, Users.c.email, Users.c.is_superuser)}
+
 auth = APIRouter()
 
 def encrypt_email(email: str) -> str:
@@ -24,6 +40,21 @@ def encrypt_email(email: str) -> str:
 def decrypt_email(encrypted_email: str) -> str:
     return cipher_suite.decrypt(encrypted_email.encode()).decode()
 
+def email_blind_index(email: str) -> str:
+    # Deterministic, unlike the Fernet ciphertext, so it can be indexed and compared
+    return hmac.new(EMAIL_INDEX_KEY, email.strip().lower().encode(), hashlib.sha256).hexdigest()
+
+async def ensure_unique(conn: AsyncConnection, username: str, email_index: str, exclude_id: int = None):
+    # Both columns have unique indexes, so this is two index lookups
+    query = Users.select().with_only_columns(Users.c.username, Users.c.email_index).where(
+        or_(Users.c.username == username, Users.c.email_index == email_index))
+    if exclude_id is not None:
+        query = query.where(Users.c.id != exclude_id)
+    existing = (await conn.execute(query.limit(1))).fetchone()
+    if existing:
+        field = "username" if existing.username == username else "email"
+        raise HTTPException(status_code=409, detail=f"A user with this {field} already exists")
+
 def decrypt_user_data(user: dict) -> dict:
     if "email" in user and user["email"]:
         try:
@@ -41,71 +72,140 @@ def superuser_required(current_user: User = Depends(get_current_user)):
         )
     return current_user
 
-@auth.get("/users", response_model=list[UserResponse])
-async def retrieve_all_user(current_user: User = Depends(get_current_user)):
+@auth.get("/users", response_model=UserPage)
+async def retrieve_all_user(
+    after_id: int = 0,
+    limit: int = Query(USERS_PAGE_SIZE, ge=1, le=USERS_MAX_PAGE_SIZE),
+    fields: Optional[str] = Query(None, description="Comma separated subset of id,username,email,is_superuser"),
+    current_user: User = Depends(get_current_user),
+    conn: AsyncConnection = Depends(get_async_conn),
+):
     # If you want to restrict this endpoint as well, include superuser_required.
-    users = conn.execute(Users.select()).fetchall()
-    return [decrypt_user_data(dict(user._mapping)) for user in users]
+    names = [name.strip() for name in fields.split(",")] if fields else list(USER_COLUMNS)
+    unknown = set(names) - set(USER_COLUMNS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    # id is always read for the cursor; email is only decrypted when asked for
+    columns = [Users.c.id] + [USER_COLUMNS[name] for name in names if name != "id"]
+    rows = (await conn.execute(
+        Users.select().with_only_columns(*columns).where(Users.c.id > after_id).order_by(Users.c.id).limit(limit)
+    )).fetchall()
+
+    items = []
+    for row in rows:
+        user = decrypt_user_data(dict(row._mapping))
+        items.append({name: user[name] for name in names})
+    next_after_id = rows[-1].id if len(rows) == limit else None
+    return {"items": items, "next_after_id": next_after_id}
+
+@auth.get("/user/by_email", response_model=UserResponse)
+async def retrieve_user_by_email(email: str, current_user: User = Depends(superuser_required), conn: AsyncConnection = Depends(get_async_conn)):
+    user = (await conn.execute(
+        Users.select().with_only_columns(*USER_COLUMNS.values()).where(Users.c.email_index == email_blind_index(email))
+    )).fetchone()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return decrypt_user_data(dict(user._mapping))
 
 @auth.get("/user/{id}", response_model=UserResponse)
-async def retrieve_one_user(id: int, current_user: User = Depends(superuser_required)):
-    user = conn.execute(Users.select().where(Users.c.id == id)).fetchone()
+async def retrieve_one_user(id: int, current_user: User = Depends(superuser_required), conn: AsyncConnection = Depends(get_async_conn)):
+    user = (await conn.execute(Users.select().with_only_columns(*USER_COLUMNS.values()).where(Users.c.id == id))).fetchone()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return decrypt_user_data(dict(user._mapping))
 
-@auth.patch("/user/{id}", response_model=list[UserResponse])
-async def update_user_data(id: int, req: User, current_user: User = Depends(superuser_required)):
-    conn.execute(
-        Users.update().values(
-            username=req.username,
-            email=encrypt_email(req.email),
-        ).where(Users.c.id == id)
-    )
-    users = conn.execute(Users.select()).fetchall()
-    return [decrypt_user_data(dict(user._mapping)) for user in users]
-
-@auth.delete("/user/{id}", response_model=list[UserResponse])
-async def delete_user_data(id: int, current_user: User = Depends(superuser_required)):
-    conn.execute(Users.delete().where(Users.c.id == id))
-    users = conn.execute(Users.select()).fetchall()
-    return [decrypt_user_data(dict(user._mapping)) for user in users]
-
-@auth.post('/register', response_model=list[UserResponse])
-def create_user(req: User):
-    conn.execute(
-        Users.insert().values(
-            username=req.username,
-            email=encrypt_email(req.email),
-            is_superuser=req.is_superuser,
-            password=Hash.bcrypt(req.password)
-        )
-    )
-    users = conn.execute(Users.select()).fetchall()
-    return [decrypt_user_data(dict(user._mapping)) for user in users]
+@auth.patch("/user/{id}", response_model=UserResponse)
+async def update_user_data(id: int, req: User, current_user: User = Depends(superuser_required), conn: AsyncConnection = Depends(get_async_conn)):
+    email_index = email_blind_index(req.email)
+    await ensure_unique(conn, req.username, email_index, exclude_id=id)
+    try:
+        user = (await conn.execute(
+            Users.update().values(
+                username=req.username,
+                email=encrypt_email(req.email),
+                email_index=email_index,
+            ).where(Users.c.id == id).returning(*USER_COLUMNS.values())
+        )).fetchone()
+    except IntegrityError:
+        raise HTTPException(status_code=409, detail="A user with this username or email already exists")
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return decrypt_user_data(dict(user._mapping))
+
+@auth.delete("/user/{id}", response_model=UserResponse)
+async def delete_user_data(id: int, current_user: User = Depends(superuser_required), conn: AsyncConnection = Depends(get_async_conn)):
+    user = (await conn.execute(Users.delete().where(Users.c.id == id).returning(*USER_COLUMNS.values()))).fetchone()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return decrypt_user_data(dict(user._mapping))
+
+# /register and /login hold no pooled connection while bcrypt runs: a burst of
+# them is shed by the hashing pool (503) instead of exhausting the database
+# pool and timing out (500). Each database step gets its own short connection.
+
+@auth.post('/register', response_model=UserResponse)
+async def create_user(req: User):
+    email_index = email_blind_index(req.email)
+    # Checked before hashing so duplicates do not cost a bcrypt round
+    async with async_engine.connect() as conn:
+        await ensure_unique(conn, req.username, email_index)
+    # bcrypt is slow on purpose; it runs in the bounded hashing pool
+    hashed_password, timing = await hash_password(req.password)
+    record("hash_queue", timing["queue_ms"])
+    record("hash", timing["hash_ms"])
+    try:
+        with span("db"):
+            async with async_engine.begin() as conn:
+                user = (await conn.execute(
+                    Users.insert().values(
+                        username=req.username,
+                        email=encrypt_email(req.email),
+                        email_index=email_index,
+                        is_superuser=req.is_superuser,
+                        password=hashed_password
+                    ).returning(*USER_COLUMNS.values())
+                )).fetchone()
+    except IntegrityError:
+        # Lost a race with a concurrent registration
+        raise HTTPException(status_code=409, detail="A user with this username or email already exists")
+    # The caller already has the plaintext email; no need to decrypt it again
+    return {**user._mapping, "email": req.email}
 
 @auth.post('/login')
-def login(req: OAuth2PasswordRequestForm = Depends()):
-    user = conn.execute(Users.select().where(Users.c.username == req.username)).fetchone()
+async def login(req: OAuth2PasswordRequestForm = Depends()):
+    with span("db"):
+        async with async_engine.connect() as conn:
+            user = (await conn.execute(Users.select().where(Users.c.username == req.username))).fetchone()
     if not user:
         raise HTTPException(status_code=404, detail=f"No user found with the username {req.username}")
-    if not Hash.verify(user[-1], req.password):
+    valid, new_hash, timing = await verify_password(user.password, req.password)
+    # Hashing time is reported apart from the rest of the request (Server-Timing)
+    record("hash_queue", timing["queue_ms"])
+    record("hash", timing["hash_ms"])
+    if not valid:
         raise HTTPException(status_code=401, detail="Wrong username or password")
-    decrypted_email = decrypt_email(user[2])
-    access_token = create_access_token(
-        data={"username": user[1], "email": decrypted_email, "is_superuser": user[3]}
-    )
-    return {"access_token": access_token, "token_type": "bearer", "id": user[0]}
+    if new_hash:
+        # Stored with an outdated bcrypt cost; upgrade it now that we have the password
+        with span("db"):
+            async with async_engine.begin() as conn:
+                await conn.execute(Users.update().values(password=new_hash).where(Users.c.id == user.id))
+    with span("token"):
+        decrypted_email = decrypt_email(user.email)
+        access_token = create_access_token(
+            data={"username": user.username, "email": decrypted_email, "is_superuser": user.is_superuser}
+        )
+    return {"access_token": access_token, "token_type": "bearer", "id": user.id}
 
 @auth.get("/verify_token")
 def read_root(current_user: User = Depends(get_current_user)):
     return current_user
 
-@auth.patch("/change_superuser/{id}", response_model=list[UserResponse])
-def change_superuser(id: int, req: User, current_user: User = Depends(superuser_required)):
-    if req.is_superuser:
-        conn.execute(Users.update().values(is_superuser=False).where(Users.c.id == id))
-    else:
-        conn.execute(Users.update().values(is_superuser=True).where(Users.c.id == id))
-    users = conn.execute(Users.select()).fetchall()
-    return [decrypt_user_data(dict(user._mapping)) for user in users]
+@auth.patch("/change_superuser/{id}", response_model=UserResponse)
+async def change_superuser(id: int, req: User, current_user: User = Depends(superuser_required), conn: AsyncConnection = Depends(get_async_conn)):
+    user = (await conn.execute(
+        Users.update().values(is_superuser=not req.is_superuser).where(Users.c.id == id)
+        .returning(*USER_COLUMNS.values())
+    )).fetchone()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return decrypt_user_data(dict(user._mapping))
@@ -0,0 +1,79 @@
+"""
+Latency and throughput of the bias classifier on each inference backend.
+
+    python -m benchmarks.bias_backends --batch-sizes 1 8 32 --iterations 100
+
+Every backend is first checked against the fp32 model on the parity texts,
+then timed on the same inputs. ONNX is skipped when onnxruntime is missing.
+"""
+import argparse
+import time
+
+import torch
+from transformers import AutoModelForSequenceClassification
+
+from neutralize.reinforced.backends import BACKENDS, PARITY_TEXTS, create_backend, parity_report, probabilities
+from neutralize.reinforced.nlp_model import MODEL_NAME, TOKENIZER_NAME
+from neutralize.tokenization import load_fast_tokenizer
+
+SAMPLE_TEXT = (
+    "Lawmakers debated the proposed budget late into the night, with supporters calling it a "
+    "responsible plan to reduce the deficit and critics warning that the cuts would fall hardest "
+    "on working families who rely on public services. "
+)
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+def time_backend(backend, tokenizer, texts, iterations, warmup):
+    inputs = dict(tokenizer(texts, return_tensors="pt", padding=True, truncation=True, max_length=512))
+    for _ in range(warmup):
+        backend(inputs)
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        backend(inputs)
+        latencies.append(time.perf_counter() - start)
+    return {
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "texts_per_s": len(texts) * iterations / sum(latencies),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--text-repeat", type=int, default=3, help="Copies of the sample paragraph per text")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=None, help="torch.set_num_threads for the torch backends")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    tokenizer = load_fast_tokenizer(TOKENIZER_NAME)
+    model = AutoModelForSequenceClassification.from_pretrained(MODEL_NAME).eval()
+    device = torch.device("cpu")
+    reference = probabilities(create_backend("torch", model, tokenizer, MODEL_NAME, device), tokenizer, PARITY_TEXTS)
+
+    print(f"{'backend':<8} {'batch':>5} {'p50 ms':>9} {'p99 ms':>9} {'texts/s':>9}  parity")
+    for name in args.backends:
+        try:
+            backend = create_backend(name, model, tokenizer, MODEL_NAME, device)
+        except RuntimeError as e:
+            print(f"{name:<8} skipped: {e}")
+            continue
+        parity = parity_report(reference, probabilities(backend, tokenizer, PARITY_TEXTS))
+        for batch_size in args.batch_sizes:
+            result = time_backend(backend, tokenizer, [SAMPLE_TEXT * args.text_repeat] * batch_size,
+                                  args.iterations, args.warmup)
+            print(f"{name:<8} {batch_size:>5} {result['p50_ms']:>9.2f} {result['p99_ms']:>9.2f} "
+                  f"{result['texts_per_s']:>9.1f}  max diff {parity['max_abs_diff']}, "
+                  f"agreement {parity['label_agreement']:.2f}")
+
+
+if __name__ == "__main__":
+    main()
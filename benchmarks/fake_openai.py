@@ -0,0 +1,141 @@
+"""
+Local stand-in for the OpenAI chat completions API, for load tests.
+
+    python -m benchmarks.fake_openai --port 8100 --latency lognormal:800,0.5 --error-rate 0.01
+    OPENAI_BASE_URL=http://localhost:8100/v1 OPENAI_API_KEY=fake uvicorn server:app
+
+Answers POST /v1/chat/completions, streamed or not, after a latency drawn
+from --latency (time to the first token). The answer is then sent at
+--tokens-per-second. Prompts that ask for JSON get the JSON that GPT_ana
+expects. --error-rate requests fail with 500 and --rate-limit-rate with 429.
+GET /stats returns the request and error counts.
+
+Latency distributions, in milliseconds:
+    fixed:MS   uniform:LO,HI   normal:MEAN,STD   lognormal:MEDIAN,SIGMA
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+WORDS = ("the text presents the policy in a balanced way while noting that supporters and critics "
+         "disagree about its costs benefits and the evidence behind them").split()
+
+
+def parse_latency(spec):
+    """Return a function drawing one latency in seconds from a 'kind:params' spec."""
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",") if v]
+    if kind == "fixed" and len(values) == 1:
+        return lambda rng: values[0] / 1000
+    if kind == "uniform" and len(values) == 2:
+        return lambda rng: rng.uniform(*values) / 1000
+    if kind == "normal" and len(values) == 2:
+        return lambda rng: max(0.0, rng.gauss(*values)) / 1000
+    if kind == "lognormal" and len(values) == 2:
+        return lambda rng: rng.lognormvariate(math.log(values[0]), values[1]) / 1000
+    raise argparse.ArgumentTypeError(f"Bad latency spec '{spec}', see --help")
+
+
+def completion_text(messages, tokens, rng):
+    prompt = messages[-1].get("content", "") if messages else ""
+    if "JSON" in prompt:
+        return json.dumps({"bias": rng.choice(["Left", "Middle", "Right"]),
+                           "explanation": " ".join(rng.choices(WORDS, k=tokens))})
+    return " ".join(rng.choices(WORDS, k=tokens))
+
+
+def create_app(latency, error_rate=0.0, rate_limit_rate=0.0, completion_tokens=120, tokens_per_second=50.0, seed=None):
+    app = FastAPI()
+    rng = random.Random(seed)
+    counts = {"requests": 0, "streamed": 0, "errors": 0, "rate_limited": 0}
+
+    def chunk(completion_id, model, created, delta=None, finish_reason=None, usage=None):
+        choices = [] if usage else [{"index": 0, "delta": delta or {}, "finish_reason": finish_reason}]
+        body = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": choices}
+        if usage:
+            body["usage"] = usage
+        return f"data: {json.dumps(body)}\n\n"
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        counts["requests"] += 1
+        model = body.get("model", "gpt-3.5-turbo")
+        max_tokens = body.get("max_tokens") or completion_tokens
+        tokens = min(completion_tokens, max_tokens)
+
+        await asyncio.sleep(latency(rng))
+        roll = rng.random()
+        if roll < rate_limit_rate:
+            counts["rate_limited"] += 1
+            return JSONResponse(status_code=429, headers={"retry-after": "1"},
+                                content={"error": {"message": "Rate limit reached", "type": "rate_limit_error"}})
+        if roll < rate_limit_rate + error_rate:
+            counts["errors"] += 1
+            return JSONResponse(status_code=500, content={"error": {"message": "Injected failure", "type": "server_error"}})
+
+        text = completion_text(body.get("messages", []), tokens, rng)
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in body.get("messages", [])) // 4
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": tokens, "total_tokens": prompt_tokens + tokens}
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+
+        if not body.get("stream"):
+            await asyncio.sleep(tokens / tokens_per_second)
+            return {
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": usage,
+            }
+
+        counts["streamed"] += 1
+        include_usage = (body.get("stream_options") or {}).get("include_usage")
+
+        async def events():
+            yield chunk(completion_id, model, created, {"role": "assistant", "content": ""})
+            for i, word in enumerate(text.split(" ")):
+                await asyncio.sleep(1 / tokens_per_second)
+                yield chunk(completion_id, model, created, {"content": word if i == 0 else " " + word})
+            yield chunk(completion_id, model, created, finish_reason="stop")
+            if include_usage:
+                yield chunk(completion_id, model, created, usage=usage)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    async def stats():
+        return counts
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency", type=parse_latency, default="lognormal:800,0.5",
+                        help="Time to first token distribution (default lognormal:800,0.5)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests failing with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Share of requests failing with 429")
+    parser.add_argument("--completion-tokens", type=int, default=120)
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    app = create_app(args.latency, args.error_rate, args.rate_limit_rate, args.completion_tokens,
+                     args.tokens_per_second, args.seed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
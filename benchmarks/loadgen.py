@@ -0,0 +1,245 @@
+"""
+Load generator replaying a mix of API traffic against a running server.
+
+    python -m benchmarks.fake_openai --port 8100 &
+    OPENAI_BASE_URL=http://localhost:8100/v1 OPENAI_API_KEY=fake RATE_LIMIT_PER_SECOND=1000 \\
+        DEFAULT_CREDITS=1000000 uvicorn server:app --port 8000 &
+    python -m benchmarks.loadgen --url http://localhost:8000 --duration 60 --concurrency 32
+
+Test users (loadtest-0, loadtest-1, ...) are registered and logged in first.
+Each request then picks an endpoint by --mix weight, a text from a pool of
+--unique-texts articles (so repeats hit the caches like real traffic does)
+and, for reduce_bias, an image from a pool of --unique-images. Without
+--rate, --concurrency workers send back to back (closed loop). With --rate,
+requests arrive as a Poisson process at that many per second (open loop,
+still at most --concurrency in flight). Open loop latencies count from when
+a request was due, not when it was sent, so waiting for a free slot shows up
+in them; arrivals that had to wait are reported as delayed.
+
+Reports throughput, p50/p90/p99/max latency, delayed arrivals and errors by
+status code per endpoint, and writes them as JSON with --output.
+"""
+import argparse
+import asyncio
+import io
+import json
+import random
+import time
+from collections import Counter
+
+import httpx
+from PIL import Image
+
+ENDPOINTS = ("analyze", "analyze_mult", "reduce_bias", "reduce_bias_txt", "login")
+DEFAULT_MIX = "analyze=55,analyze_mult=15,reduce_bias=10,login=20"
+PASSWORD = "loadtest-password"
+
+SENTENCES = [
+    "Lawmakers debated the proposed budget late into the night.",
+    "Supporters called it a responsible plan to reduce the deficit.",
+    "Critics warned that the cuts would fall hardest on working families.",
+    "The governor signed the bill after months of negotiations.",
+    "Opponents say the new rules will stifle small businesses.",
+    "Advocates argue the measure finally protects vulnerable communities.",
+    "The city council met on Tuesday to discuss public transit funding.",
+    "Border security must come first before any immigration reform.",
+    "Climate change demands immediate action and a move away from fossil fuels.",
+    "Lower taxes and less regulation are the best way to grow the economy.",
+    "Both parties claimed victory after the election results were announced.",
+    "Analysts expect the court ruling to reshape the debate over voting rights.",
+]
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+def text_pool(size, rng):
+    return [" ".join(rng.choices(SENTENCES, k=rng.randint(2, 8))) + f" ({i})" for i in range(size)]
+
+def image_pool(size, rng):
+    images = []
+    for _ in range(size):
+        image = Image.new("RGB", (8, 6))
+        image.putdata([tuple(rng.randrange(256) for _ in range(3)) for _ in range(48)])
+        buf = io.BytesIO()
+        image.resize((640, 480), Image.NEAREST).save(buf, "PNG")
+        images.append(buf.getvalue())
+    return images
+
+
+class Workload:
+    """Builds requests for each endpoint of the mix and records their outcomes."""
+
+    def __init__(self, client, users, texts, images, image_fraction, rng):
+        self.client = client
+        self.users = users
+        self.texts = texts
+        self.images = images
+        self.image_fraction = image_fraction
+        self.rng = rng
+        self.latencies = {}
+        self.statuses = {}
+        self.delays = {}
+
+    def _auth(self):
+        return {"Authorization": f"Bearer {self.rng.choice(list(self.users.values()))}"}
+
+    async def analyze(self):
+        return await self.client.post("/api/analyze/", json={"text": self.rng.choice(self.texts)}, headers=self._auth())
+
+    async def analyze_mult(self):
+        return await self.client.post("/api/analyze_mult/", json={"text": self.rng.choice(self.texts)},
+                                      headers=self._auth())
+
+    async def reduce_bias_txt(self):
+        return await self.client.post("/api/reduce_bias_txt", json={"text": self.rng.choice(self.texts)},
+                                      headers=self._auth())
+
+    async def reduce_bias(self):
+        files = None
+        if self.images and self.rng.random() < self.image_fraction:
+            files = {"image": ("photo.png", self.rng.choice(self.images), "image/png")}
+        return await self.client.post("/api/reduce_bias", data={"text": self.rng.choice(self.texts)}, files=files,
+                                      headers=self._auth())
+
+    async def login(self):
+        return await self.client.post("/api/login", data={"username": self.rng.choice(list(self.users)),
+                                                          "password": PASSWORD})
+
+    async def run(self, name, scheduled=None):
+        """Send one request. With `scheduled` (open loop) its latency counts from then."""
+        start = time.perf_counter() if scheduled is None else scheduled
+        try:
+            status = (await getattr(self, name)()).status_code
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        self.latencies.setdefault(name, []).append(time.perf_counter() - start)
+        self.statuses.setdefault(name, Counter())[str(status)] += 1
+
+    def report(self, elapsed):
+        endpoints = {}
+        for name, latencies in sorted(self.latencies.items()):
+            statuses = self.statuses[name]
+            errors = sum(count for status, count in statuses.items() if not status.startswith("2"))
+            delays = self.delays.get(name, [])
+            endpoints[name] = {
+                "requests": len(latencies),
+                "throughput_rps": round(len(latencies) / elapsed, 2),
+                "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+                "p90_ms": round(percentile(latencies, 90) * 1000, 1),
+                "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+                "max_ms": round(max(latencies) * 1000, 1),
+                "delayed": len(delays),
+                "max_delay_ms": round(max(delays, default=0) * 1000, 1),
+                "error_rate": round(errors / len(latencies), 4),
+                "statuses": dict(statuses),
+            }
+        total = sum(e["requests"] for e in endpoints.values())
+        return {"elapsed_s": round(elapsed, 2), "requests": total, "throughput_rps": round(total / elapsed, 2),
+                "delayed": sum(e["delayed"] for e in endpoints.values()), "endpoints": endpoints}
+
+
+async def setup_users(client, count):
+    """Register (or reuse) the test users and return {username: access_token}."""
+    users = {}
+    for i in range(count):
+        username = f"loadtest-{i}"
+        await client.post("/api/register", json={"username": username, "email": f"{username}@example.com",
+                                                 "password": PASSWORD, "is_superuser": False})
+        response = await client.post("/api/login", data={"username": username, "password": PASSWORD})
+        response.raise_for_status()
+        users[username] = response.json()["access_token"]
+    return users
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"Unknown endpoint '{name}' in --mix, expected one of {ENDPOINTS}")
+        mix[name] = float(weight or 1)
+    return mix
+
+async def generate(args):
+    rng = random.Random(args.seed)
+    mix = args.mix
+    names, weights = list(mix), list(mix.values())
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        users = await setup_users(client, args.users)
+        workload = Workload(client, users, text_pool(args.unique_texts, rng), image_pool(args.unique_images, rng),
+                            args.image_fraction, rng)
+        start = time.perf_counter()
+        deadline = start + args.duration
+        sent = 0
+
+        def more():
+            return time.perf_counter() < deadline and (args.requests is None or sent < args.requests)
+
+        if args.rate is None:
+            async def worker():
+                nonlocal sent
+                while more():
+                    sent += 1
+                    await workload.run(rng.choices(names, weights)[0])
+            await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        else:
+            in_flight = asyncio.Semaphore(args.concurrency)
+            tasks = set()
+
+            async def one(name, scheduled):
+                waited = in_flight.locked()
+                async with in_flight:
+                    if waited:
+                        workload.delays.setdefault(name, []).append(time.perf_counter() - scheduled)
+                    await workload.run(name, scheduled)
+
+            # Arrivals follow their own timeline, however late the loop wakes up
+            arrival = time.perf_counter()
+            while more():
+                sent += 1
+                task = asyncio.create_task(one(rng.choices(names, weights)[0], arrival))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                arrival += rng.expovariate(args.rate)
+                await asyncio.sleep(max(0.0, arrival - time.perf_counter()))
+            await asyncio.gather(*tasks)
+
+        return workload.report(time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                        help=f"endpoint=weight pairs out of {', '.join(ENDPOINTS)} (default {DEFAULT_MIX})")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds to send requests for")
+    parser.add_argument("--requests", type=int, default=None, help="Stop after this many requests")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--rate", type=float, default=None, help="Open loop: mean arrivals per second")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--unique-texts", type=int, default=200)
+    parser.add_argument("--unique-images", type=int, default=20)
+    parser.add_argument("--image-fraction", type=float, default=0.5, help="Share of reduce_bias requests with an image")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the report as JSON here")
+    args = parser.parse_args()
+
+    report = asyncio.run(generate(args))
+    print(f"{report['requests']} requests in {report['elapsed_s']} s, {report['throughput_rps']} req/s, "
+          f"{report['delayed']} delayed at the concurrency limit\n")
+    print(f"{'endpoint':<16} {'requests':>8} {'req/s':>8} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9} "
+          f"{'delayed':>8} {'errors':>7}  statuses")
+    for name, e in report["endpoints"].items():
+        print(f"{name:<16} {e['requests']:>8} {e['throughput_rps']:>8.1f} {e['p50_ms']:>9.1f} {e['p90_ms']:>9.1f} "
+              f"{e['p99_ms']:>9.1f} {e['max_ms']:>9.1f} {e['delayed']:>8} {e['error_rate']:>7.1%}  {e['statuses']}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+"""
+Micro-benchmarks for every model and LLM stage, runnable offline.
+
+    python -m benchmarks.suite --output benchmarks/results/latest.json
+    python -m benchmarks.suite --baseline benchmarks/baseline.json --threshold 0.2
+
+Profiles:
+    tiny        small randomly initialized models and a tokenizer trained on
+                the spot (default; fast, for spotting library regressions)
+    base        randomly initialized models with the production architectures
+                (BERT-base, CLIP ViT-L/14, GPT-2), still offline
+    pretrained  the real models from the registry (needs the hub or its cache)
+
+OpenAI is always replaced by an in-process stub, so the LLM stages measure
+prompt construction and client-side overhead only. With --baseline, every
+case whose p50 is more than --threshold slower than in the baseline file is
+reported and the exit code is 1.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from dotenv import load_dotenv
+
+# Modules that build API clients or ciphers at import time need these set;
+# the values are never used for anything real here
+load_dotenv()
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+if not os.getenv("ENCRYPTION_KEY"):
+    from cryptography.fernet import Fernet
+    os.environ["ENCRYPTION_KEY"] = Fernet.generate_key().decode()
+
+import numpy as np
+import tokenizers
+import torch
+import transformers
+from PIL import Image
+from transformers import (BertConfig, BertForSequenceClassification, CLIPConfig, CLIPImageProcessor, CLIPModel,
+                          GPT2Config, GPT2LMHeadModel, PreTrainedTokenizerFast)
+
+from benchmarks.bias_backends import SAMPLE_TEXT, percentile
+from neutralize.NLP import multimo
+from neutralize.NLP.image_context import dhash
+from neutralize.NLP.prompting import fit_prompt
+from neutralize.NLP.prompt_bank import PromptBank, load_prompts
+from neutralize.reinforced import nlp_model
+from neutralize.reinforced.backends import PARITY_TEXTS, TorchBackend
+from neutralize.registry import registry
+from neutralize.tokenization import CachedTokenizer
+
+PROFILES = ("tiny", "base", "pretrained")
+BATCH_SIZES = (1, 8, 32)
+# Approximate text lengths in words; "long" is truncated at 512 tokens
+TEXT_LENGTHS = {"short": 16, "medium": 128, "long": 600}
+BIAS_LEVEL = {"Left": 0.2, "Middle": 0.5, "Right": 0.3}
+
+
+def sample_text(words):
+    base = SAMPLE_TEXT.split()
+    return " ".join(base[i % len(base)] for i in range(words))
+
+def sample_image(seed=0, size=(640, 480)):
+    rng = np.random.default_rng(seed)
+    return Image.fromarray((rng.random((size[1], size[0], 3)) * 255).astype("uint8"))
+
+
+# Offline stand-ins
+
+def standin_tokenizer(vocab_size=4000):
+    """A fast WordPiece tokenizer trained on the benchmark texts, with the BERT special tokens."""
+    from tokenizers import Tokenizer, models, normalizers, pre_tokenizers, processors, trainers
+    tokenizer = Tokenizer(models.WordPiece(unk_token="[UNK]"))
+    tokenizer.normalizer = normalizers.BertNormalizer(lowercase=False)
+    tokenizer.pre_tokenizer = pre_tokenizers.BertPreTokenizer()
+    trainer = trainers.WordPieceTrainer(
+        vocab_size=vocab_size, special_tokens=["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"],
+        initial_alphabet=[chr(c) for c in range(32, 127)],
+    )
+    tokenizer.train_from_iterator([SAMPLE_TEXT, *PARITY_TEXTS, *load_prompts()], trainer)
+    tokenizer.post_processor = processors.TemplateProcessing(
+        single="[CLS] $A [SEP]", pair="[CLS] $A [SEP] $B:1 [SEP]:1",
+        special_tokens=[("[CLS]", tokenizer.token_to_id("[CLS]")), ("[SEP]", tokenizer.token_to_id("[SEP]"))],
+    )
+    return PreTrainedTokenizerFast(tokenizer_object=tokenizer, unk_token="[UNK]", pad_token="[PAD]",
+                                   cls_token="[CLS]", sep_token="[SEP]", mask_token="[MASK]",
+                                   eos_token="[SEP]", model_max_length=512)
+
+
+class StandInClipProcessor:
+    """CLIPProcessor look-alike: the real CLIP image preprocessing with the stand-in tokenizer for text."""
+
+    def __init__(self, tokenizer):
+        self.image_processor = CLIPImageProcessor()
+        self.tokenizer = tokenizer
+
+    def __call__(self, text=None, images=None, return_tensors="pt", padding=True):
+        if images is not None:
+            return self.image_processor(images=images, return_tensors=return_tensors)
+        return self.tokenizer(text, return_tensors=return_tensors, padding=padding, truncation=True,
+                              max_length=77, return_token_type_ids=False)
+
+
+def standin_models(profile, tokenizer):
+    """Randomly initialized classifier, CLIP and GPT-2 for the tiny or base profile."""
+    torch.manual_seed(0)
+    vocab_size = len(tokenizer)
+    if profile == "tiny":
+        bert = BertConfig(vocab_size=vocab_size, hidden_size=128, num_hidden_layers=2, num_attention_heads=2,
+                          intermediate_size=512, num_labels=3)
+        clip = CLIPConfig(
+            text_config={"vocab_size": vocab_size, "hidden_size": 64, "intermediate_size": 256,
+                         "num_hidden_layers": 2, "num_attention_heads": 2},
+            vision_config={"hidden_size": 64, "intermediate_size": 256, "num_hidden_layers": 2,
+                           "num_attention_heads": 2, "patch_size": 32},
+            projection_dim=64,
+        )
+        gpt2 = GPT2Config(vocab_size=vocab_size, n_embd=64, n_layer=2, n_head=2, n_positions=512)
+    else:
+        bert = BertConfig(vocab_size=28996, num_labels=3)
+        clip = CLIPConfig(
+            text_config={"vocab_size": 49408, "hidden_size": 768, "intermediate_size": 3072,
+                         "num_hidden_layers": 12, "num_attention_heads": 12},
+            vision_config={"hidden_size": 1024, "intermediate_size": 4096, "num_hidden_layers": 24,
+                           "num_attention_heads": 16, "patch_size": 14},
+            projection_dim=768,
+        )
+        gpt2 = GPT2Config()
+    return (BertForSequenceClassification(bert).eval(), CLIPModel(clip).eval(), GPT2LMHeadModel(gpt2).eval())
+
+
+def install_standins(profile):
+    """Swap the stand-in models into the shared registry, so the suite runs the production code paths."""
+    tokenizer = standin_tokenizer()
+    classifier, clip_model, gpt_model = standin_models(profile, tokenizer)
+    cpu = torch.device("cpu")
+    registry.swap("bias_classifier", (CachedTokenizer(tokenizer, f"benchmark-{profile}"), TorchBackend(classifier, cpu)))
+    registry.swap("clip", (clip_model, StandInClipProcessor(tokenizer)))
+    registry.swap("gpt2", (tokenizer, gpt_model))
+    prompts = load_prompts()
+    embeddings = multimo.encode_clip_text(prompts).float()
+    registry.swap("clip_prompts", PromptBank(prompts, embeddings / embeddings.norm(dim=-1, keepdim=True)))
+
+
+class StubCompletions:
+    """Stands in for client.chat.completions; answers instantly with a fixed completion."""
+
+    response = SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=" A neutral rewrite of the text. "))],
+        usage=SimpleNamespace(prompt_tokens=200, completion_tokens=40, total_tokens=240),
+    )
+
+    def create(self, **kwargs):
+        return self.response
+
+
+class AsyncStubCompletions(StubCompletions):
+    async def create(self, **kwargs):
+        return self.response
+
+
+def install_stub_openai():
+    multimo.client = SimpleNamespace(chat=SimpleNamespace(completions=StubCompletions()))
+    multimo.async_client = SimpleNamespace(chat=SimpleNamespace(completions=AsyncStubCompletions()))
+
+
+# Cases
+
+def build_cases(args):
+    """Return [(name, fn, items, max_iterations)]; fn runs one iteration over `items` inputs."""
+    from CRUD.authen import decrypt_email, email_blind_index, encrypt_email
+    from service.hashing import _verify, pwd_cxt
+
+    tokenizer, backend = registry.get("bias_classifier")
+    cases = []
+
+    for length, words in TEXT_LENGTHS.items():
+        texts = [f"{i} {sample_text(words)}" for i in range(8)]
+        cases.append((f"tokenize.cold.{length}.b8",
+                      lambda texts=texts: tokenizer.tokenizer(texts, truncation=True, max_length=tokenizer.max_length),
+                      len(texts), None))
+        tokenizer.encode(texts)
+        cases.append((f"tokenize.cached.{length}.b8", lambda texts=texts: tokenizer.encode_batch(texts), len(texts), None))
+
+    for length, words in TEXT_LENGTHS.items():
+        for batch_size in args.batch_sizes:
+            inputs = tokenizer.encode_batch([f"{i} {sample_text(words)}" for i in range(batch_size)])
+            cases.append((f"classifier.forward.{length}.b{batch_size}", lambda inputs=inputs: backend(inputs),
+                          batch_size, None))
+    cases.append(("classifier.nlp_ana.short", lambda: nlp_model.NLP_ana(sample_text(TEXT_LENGTHS["short"])), 1, None))
+    long_text = sample_text(2000)
+    cases.append(("classifier.nlp_ana_long", lambda: nlp_model.NLP_ana_long(long_text), 1, None))
+
+    image = sample_image()
+    rgb = image.convert("RGB")
+    prompts = load_prompts()
+    cases.append(("image.dhash", lambda: dhash(image), 1, None))
+    cases.append(("clip.image_encode", lambda: multimo.encode_clip_image(rgb), 1, None))
+    cases.append(("clip.text_encode", lambda: multimo.encode_clip_text(prompts), len(prompts), None))
+    # Uncached on purpose: describe_image is what a cache miss costs
+    cases.append(("caption.describe_image", lambda: multimo.describe_image(rgb), 1, args.slow_iterations))
+
+    text = sample_text(TEXT_LENGTHS["medium"])
+    context = multimo.describe_image(rgb)
+    cases.append(("llm.reduce_bias_prompt", lambda: multimo.reduce_bias_prompt(text, BIAS_LEVEL, context), 1, None))
+    cases.append(("llm.multicon_prompt", lambda: multimo.multicon_prompt(text, BIAS_LEVEL, context), 1, None))
+    # An article well over the gpt-4 input budget, so paragraphs get scored and dropped
+    article = "\n\n".join(f"{i} {sample_text(120)}" for i in range(80))
+    cases.append(("llm.fit_prompt.long", lambda: fit_prompt(multimo.reduce_bias_prompt, article, "gpt-4",
+                                                           multimo.SYSTEM_PROMPT, BIAS_LEVEL, context), 1, None))
+    cases.append(("llm.reduce_bias", lambda: multimo.reduce_bias(text, BIAS_LEVEL), 1, None))
+    cases.append(("llm.chat_completion_async",
+                  lambda: asyncio.run(multimo.chat_completion_async(multimo.reduce_bias_prompt(text, BIAS_LEVEL, context),
+                                                                    "gpt-3.5-turbo")),
+                  1, None))
+
+    email = "reader@example.com"
+    encrypted = encrypt_email(email)
+    hashed = pwd_cxt.hash("correct horse battery staple")
+    cases.append(("auth.fernet_encrypt", lambda: encrypt_email(email), 1, None))
+    cases.append(("auth.fernet_decrypt", lambda: decrypt_email(encrypted), 1, None))
+    cases.append(("auth.email_blind_index", lambda: email_blind_index(email), 1, None))
+    cases.append(("auth.bcrypt_hash", lambda: pwd_cxt.hash("correct horse battery staple"), 1, args.slow_iterations))
+    cases.append(("auth.bcrypt_verify", lambda: _verify(hashed, "correct horse battery staple"), 1, args.slow_iterations))
+
+    if args.only:
+        cases = [case for case in cases if case[0].startswith(tuple(args.only))]
+    return cases
+
+
+def run_case(fn, items, iterations, warmup):
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+    return {
+        "iterations": iterations,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 4),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 4),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 4),
+        "items_per_s": round(items * iterations / sum(latencies), 2),
+    }
+
+
+def compare(results, baseline, threshold, min_delta_ms):
+    """Cases whose p50 grew by more than `threshold` (relative) and `min_delta_ms` (absolute)."""
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get("results", {}).get(name)
+        if before is None:
+            continue
+        ratio = result["p50_ms"] / before["p50_ms"] if before["p50_ms"] else 1.0
+        result["baseline_p50_ms"] = before["p50_ms"]
+        result["change"] = round(ratio - 1, 4)
+        if ratio > 1 + threshold and result["p50_ms"] - before["p50_ms"] > min_delta_ms:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profile", choices=PROFILES, default="tiny")
+    parser.add_argument("--output", default="benchmarks/results/latest.json", help="Where to write the JSON results")
+    parser.add_argument("--baseline", help="Results file of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed relative p50 slowdown, 0.2 = 20%%")
+    parser.add_argument("--min-delta-ms", type=float, default=0.05,
+                        help="Ignore slowdowns smaller than this, they are timer noise")
+    parser.add_argument("--only", nargs="+", help="Only run cases whose name starts with one of these prefixes")
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=list(BATCH_SIZES))
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--slow-iterations", type=int, default=5, help="Iterations for bcrypt and captioning")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=None, help="torch.set_num_threads")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    if args.profile != "pretrained":
+        install_standins(args.profile)
+    install_stub_openai()
+
+    results = {}
+    print(f"{'case':<36} {'p50 ms':>10} {'p95 ms':>10} {'items/s':>10}")
+    for name, fn, items, max_iterations in build_cases(args):
+        iterations = min(args.iterations, max_iterations) if max_iterations else args.iterations
+        results[name] = run_case(fn, items, iterations, min(args.warmup, iterations))
+        print(f"{name:<36} {results[name]['p50_ms']:>10.3f} {results[name]['p95_ms']:>10.3f} "
+              f"{results[name]['items_per_s']:>10.1f}")
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("meta", {}).get("profile") != args.profile:
+            print(f"warning: baseline was recorded with profile {baseline.get('meta', {}).get('profile')}")
+        regressions = compare(results, baseline, args.threshold, args.min_delta_ms)
+
+    report = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "profile": args.profile,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "torch": torch.__version__,
+            "transformers": transformers.__version__,
+            "tokenizers": tokenizers.__version__,
+            "torch_threads": torch.get_num_threads(),
+        },
+        "results": results,
+        "regressions": regressions,
+    }
+    if os.path.dirname(args.output):
+        os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        for name in regressions:
+            print(f"REGRESSION {name}: p50 {results[name]['baseline_p50_ms']:.3f} -> {results[name]['p50_ms']:.3f} ms "
+                  f"({results[name]['change']:+.0%})")
+        print(f"{len(regressions)} regression(s) beyond {args.threshold:.0%}")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
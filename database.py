@@ -1,10 +1,62 @@
+import os
+
 import sqlalchemy as _sql
 import sqlalchemy.orm as _orm
+from dotenv import load_dotenv
+from sqlalchemy.ext.asyncio import create_async_engine
+
+load_dotenv()
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///db/SQLite.db")
+# Async driver for the same database, used by the auth routes. Defaults to
+# aiosqlite for SQLite and asyncpg for PostgreSQL.
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or (
+    DATABASE_URL.replace("sqlite://", "sqlite+aiosqlite://", 1) if DATABASE_URL.startswith("sqlite://")
+    else DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
+)
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# How long a SQLite connection waits for another writer before "database is locked"
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+is_sqlite = DATABASE_URL.startswith("sqlite")
 
-DATABASE_URL = "sqlite:///db/SQLite.db"
+pool_options = {
+    "pool_size": DB_POOL_SIZE,
+    "max_overflow": DB_MAX_OVERFLOW,
+    "pool_timeout": DB_POOL_TIMEOUT,
+    "pool_recycle": DB_POOL_RECYCLE,
+    "pool_pre_ping": True,
+}
 
-engine = _sql.create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets readers run alongside the single writer; busy_timeout makes
+    # writers wait for the lock instead of failing immediately
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+engine = _sql.create_engine(
+    DATABASE_URL,
+    connect_args={"check_same_thread": False} if is_sqlite else {},
+    **pool_options,
+)
 
 SessionLocal = _orm.sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-conn = engine.connect()
\ No newline at end of file
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **pool_options)
+
+if is_sqlite:
+    _sql.event.listen(engine, "connect", set_sqlite_pragmas)
+    _sql.event.listen(async_engine.sync_engine, "connect", set_sqlite_pragmas)
+
+
+async def get_async_conn():
+    """Per-request connection for async routes; the transaction commits when the request ends."""
+    async with async_engine.begin() as conn:
+        yield conn
@@ -0,0 +1,296 @@
+import asyncio
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import time
+
+from dotenv import load_dotenv
+from sqlalchemy import delete, func, insert, select, update
+
+from database import engine
+from db.result_cache import normalize_text
+from models import CompletionCache
+from service.cache import LRUCache
+from service.tracing import span
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+COMPLETION_CACHE_TTL = float(os.getenv("COMPLETION_CACHE_TTL", str(30 * 24 * 3600)))
+COMPLETION_CACHE_MAX_ENTRIES = int(os.getenv("COMPLETION_CACHE_MAX_ENTRIES", "50000"))
+COMPLETION_CACHE_MAX_MB = float(os.getenv("COMPLETION_CACHE_MAX_MB", "256"))
+COMPLETION_CACHE_MEMORY_SIZE = int(os.getenv("COMPLETION_CACHE_MEMORY_SIZE", "2000"))
+# Bias levels are rounded before keying so tiny score jitter still hits
+COMPLETION_BIAS_PRECISION = int(os.getenv("COMPLETION_BIAS_PRECISION", "2"))
+# Size limits are enforced every this many writes rather than on each one
+EVICT_EVERY = 100
+
+# USD per 1K (prompt, completion) tokens, used to estimate spend and savings
+PRICES_PER_1K = {
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+    "gpt-4": (0.03, 0.06),
+    "gpt-4-turbo": (0.01, 0.03),
+}
+
+
+class CompletionTally:
+    """How the completions of one request were answered: produced upstream or reused from the cache."""
+
+    __slots__ = ("produced", "reused")
+
+    def __init__(self):
+        self.produced = 0
+        self.reused = 0
+
+
+_current_tally = contextvars.ContextVar("completion_tally", default=None)
+
+def track_completions():
+    """Count the completions of the current request from here on; returns its CompletionTally."""
+    tally = CompletionTally()
+    _current_tally.set(tally)
+    return tally
+
+def current_completions():
+    """The current request's CompletionTally, or None when it is not tracked."""
+    return _current_tally.get()
+
+def _count(produced):
+    tally = _current_tally.get()
+    if tally is not None:
+        if produced:
+            tally.produced += 1
+        else:
+            tally.reused += 1
+
+
+def completion_key(model, template_version, text, bias_level=None, image_hash=None):
+    """Key a completion on everything that changes its output."""
+    rounded = None
+    if bias_level:
+        rounded = {k: round(float(v), COMPLETION_BIAS_PRECISION) for k, v in sorted(bias_level.items())}
+    text_hash = hashlib.sha256(normalize_text(text).encode()).hexdigest()
+    material = json.dumps([model, template_version, text_hash, rounded, image_hash])
+    return hashlib.sha256(material.encode()).hexdigest()
+
+def estimate_cost(model, usage):
+    if usage is None:
+        return 0.0
+    prompt_price, completion_price = PRICES_PER_1K.get(model, (0.0, 0.0))
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+
+
+class CompletionStore:
+    """
+    Persistent cache of OpenAI completions with single-flight.
+
+    `get_or_create` returns a cached value when one exists. Otherwise the first
+    caller for a key runs `producer` and every concurrent caller for the same
+    key awaits that one upstream call. Entries expire after COMPLETION_CACHE_TTL
+    and the least recently used rows are evicted once the table exceeds
+    COMPLETION_CACHE_MAX_ENTRIES rows or COMPLETION_CACHE_MAX_MB. Every answer
+    is counted in the request's CompletionTally as produced or reused.
+    """
+
+    def __init__(self, ttl=COMPLETION_CACHE_TTL, max_entries=COMPLETION_CACHE_MAX_ENTRIES,
+                 max_bytes=COMPLETION_CACHE_MAX_MB * 2**20, memory_size=COMPLETION_CACHE_MEMORY_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.memory = LRUCache(maxsize=memory_size, ttl=ttl)
+        self._inflight = {}
+        self._writes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.evicted = 0
+        self.saved_latency_ms = 0.0
+        self.saved_cost = 0.0
+        self.spent_cost = 0.0
+
+    def _read(self, key):
+        now = time.time()
+        with engine.begin() as conn:
+            row = conn.execute(
+                select(CompletionCache.c.value, CompletionCache.c.latency_ms,
+                       CompletionCache.c.cost, CompletionCache.c.created_at)
+                .where(CompletionCache.c.key == key)
+            ).fetchone()
+            if row is None:
+                return None
+            if row.created_at + self.ttl < now:
+                conn.execute(delete(CompletionCache).where(CompletionCache.c.key == key))
+                return None
+            conn.execute(update(CompletionCache).where(CompletionCache.c.key == key).values(last_used=now))
+        return {"value": json.loads(row.value), "latency_ms": row.latency_ms, "cost": row.cost}
+
+    def _write(self, key, model, entry):
+        now = time.time()
+        value = json.dumps(entry["value"])
+        values = {"model": model, "value": value, "size": len(value.encode()),
+                  "latency_ms": entry["latency_ms"], "cost": entry["cost"], "created_at": now, "last_used": now}
+        with engine.begin() as conn:
+            updated = conn.execute(update(CompletionCache).where(CompletionCache.c.key == key).values(**values))
+            if updated.rowcount == 0:
+                conn.execute(insert(CompletionCache).values(key=key, **values))
+            self._writes += 1
+            if self._writes % EVICT_EVERY == 0:
+                self._evict(conn)
+
+    def _evict(self, conn):
+        count, total = conn.execute(
+            select(func.count(), func.coalesce(func.sum(CompletionCache.c.size), 0))
+        ).one()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        # Walk from least recently used until both limits hold again
+        doomed = []
+        for key, size in conn.execute(
+            select(CompletionCache.c.key, CompletionCache.c.size).order_by(CompletionCache.c.last_used)
+        ):
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            doomed.append(key)
+            count -= 1
+            total -= size or 0
+        if doomed:
+            conn.execute(delete(CompletionCache).where(CompletionCache.c.key.in_(doomed)))
+            self.evicted += len(doomed)
+
+    async def _lookup(self, key):
+        entry = self.memory.get(key)
+        if entry is not None:
+            return entry
+        try:
+            with span("completion_cache_read"):
+                entry = await asyncio.to_thread(self._read, key)
+        except Exception as e:
+            self.errors += 1
+            logger.warning("Completion cache read failed: %s", e)
+            return None
+        if entry is not None:
+            self.memory.set(key, entry)
+        return entry
+
+    async def get_or_create(self, key, model, producer, cacheable=None):
+        """
+        Return the cached value for `key`, or produce it with a single upstream call.
+
+        Parameters:
+        key (str): Result of completion_key().
+        model (str): OpenAI model name, used for spend accounting.
+        producer (async callable): Returns (value, usage) where value is JSON serializable
+            and usage is the OpenAI usage object (or None).
+        cacheable (callable): Optional check on a produced value; values it rejects
+            (e.g. answers built on a failed step) are returned but not stored.
+        """
+        entry = await self._lookup(key)
+        if entry is not None:
+            self.hits += 1
+            self.saved_latency_ms += entry["latency_ms"] or 0.0
+            self.saved_cost += entry["cost"] or 0.0
+            _count(produced=False)
+            return entry["value"]
+
+        # Another request is already producing this key: wait for it
+        pending = self._inflight.get(key)
+        if pending is not None:
+            try:
+                entry = await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+                # The leader was cancelled (e.g. its client disconnected), not us:
+                # try again, and one of the waiting requests becomes the new leader
+                return await self.get_or_create(key, model, producer, cacheable)
+            self.coalesced += 1
+            self.saved_latency_ms += entry["latency_ms"]
+            self.saved_cost += entry["cost"]
+            _count(produced=False)
+            return entry["value"]
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            start = time.perf_counter()
+            value, usage = await producer()
+            _count(produced=True)
+            entry = {
+                "value": value,
+                "latency_ms": (time.perf_counter() - start) * 1000,
+                "cost": estimate_cost(model, usage),
+            }
+            self.spent_cost += entry["cost"]
+            store = cacheable is None or cacheable(value)
+            if store:
+                self.memory.set(key, entry)
+            future.set_result(entry)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+        if store:
+            await self._persist(key, model, entry)
+        return value
+
+    async def get(self, key):
+        """Cached value for `key`, or None. For callers that produce the value themselves, e.g. streams."""
+        entry = await self._lookup(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.saved_latency_ms += entry["latency_ms"] or 0.0
+        self.saved_cost += entry["cost"] or 0.0
+        _count(produced=False)
+        return entry["value"]
+
+    async def put(self, key, model, value, latency_ms, usage=None, store=True):
+        """Record a value produced outside get_or_create, and cache it unless `store` is false."""
+        entry = {"value": value, "latency_ms": latency_ms, "cost": estimate_cost(model, usage)}
+        self.spent_cost += entry["cost"]
+        _count(produced=True)
+        if store:
+            self.memory.set(key, entry)
+            await self._persist(key, model, entry)
+
+    async def _persist(self, key, model, entry):
+        try:
+            with span("completion_cache_write"):
+                await asyncio.to_thread(self._write, key, model, entry)
+        except Exception as e:
+            self.errors += 1
+            logger.warning("Completion cache write failed: %s", e)
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+            "errors": self.errors,
+            "evicted": self.evicted,
+            "memory": self.memory.stats(),
+            "saved_latency_seconds": round(self.saved_latency_ms / 1000, 3),
+            "saved_cost_usd": round(self.saved_cost, 4),
+            "spent_cost_usd": round(self.spent_cost, 4),
+        }
+
+
+completion_cache = CompletionStore()
@@ -1,18 +1,209 @@
-import sqlalchemy as _sql
-import sqlalchemy.orm as _orm
+import asyncio
+import contextvars
+import logging
+import os
+import time
+from collections import defaultdict
+
+from dotenv import load_dotenv
 from fastapi import APIRouter, Depends
-from pydantic import BaseModel
-from sqlalchemy import Table, Column, Text, MetaData, select
-from sqlalchemy.orm import sessionmaker
-from database import conn, engine, SessionLocal
+from sqlalchemy import bindparam, select, update
+
+from database import engine
+from models import Credits
+from schemas import User
+from service.oauth import get_current_user
+
+load_dotenv()
 
-metadata = MetaData()
+logger = logging.getLogger(__name__)
+
+# Credits a user starts with when they first call a GPT endpoint
+DEFAULT_CREDITS = int(os.getenv("DEFAULT_CREDITS", "1000"))
+# Spent credits are written to the Credits table in one batch this often,
+# or as soon as this many credits are waiting to be written
+CREDIT_FLUSH_SECONDS = float(os.getenv("CREDIT_FLUSH_SECONDS", "5"))
+CREDIT_FLUSH_THRESHOLD = int(os.getenv("CREDIT_FLUSH_THRESHOLD", "500"))
+# Cached balances are re-read after this many seconds, so deductions by other
+# workers and top-ups are picked up
+CREDIT_BALANCE_TTL = float(os.getenv("CREDIT_BALANCE_TTL", "5"))
 
 credit = APIRouter()
 
-# Define the credits table
-credits = Table(
-    "Credits", metadata,
-    Column("user", Text, primary_key=True, unique=True, nullable=False), 
-    Column("credit", int, nullable=False),
-)
+
+class InsufficientCredits(Exception):
+    pass
+
+
+# The reservation made for the current request, if it charged credits
+_current_reservation = contextvars.ContextVar("credit_reservation", default=None)
+
+
+class CreditReservation:
+    """Credits charged for one request, given back with release() if it did not use them."""
+
+    __slots__ = ("ledger", "user", "amount", "released")
+
+    def __init__(self, ledger, user, amount):
+        self.ledger = ledger
+        self.user = user
+        self.amount = amount
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.ledger.refund(self.user, self.amount)
+
+
+class CreditLedger:
+    """
+    Per-worker view of the Credits table that batches deductions.
+
+    Balances are cached per user for `balance_ttl` seconds and charges are
+    checked against them in memory. Spent credits are applied with a single
+    `credit = credit - n` UPDATE per user in one transaction, so concurrent
+    workers never overwrite each other's deductions. A worker only sees other
+    workers' charges once they have flushed them and its cached balance has
+    expired, so a user can overspend by at most what the other workers charged
+    them in the last `flush_seconds + balance_ttl` seconds (or
+    `flush_threshold` credits per worker, if that is reached first).
+    """
+
+    def __init__(self, default_credits=DEFAULT_CREDITS, flush_seconds=CREDIT_FLUSH_SECONDS,
+                 flush_threshold=CREDIT_FLUSH_THRESHOLD, balance_ttl=CREDIT_BALANCE_TTL):
+        self.default_credits = default_credits
+        self.flush_seconds = flush_seconds
+        self.flush_threshold = flush_threshold
+        self.balance_ttl = balance_ttl
+        self.balances = {}
+        self.loaded_at = {}
+        self.pending = defaultdict(int)
+        self.flushing = {}
+        self._lock = None
+        self.flushes = 0
+        self.errors = 0
+        self.refunded = 0
+
+    def _load(self, user):
+        with engine.begin() as conn:
+            balance = conn.execute(select(Credits.c.credit).where(Credits.c.user == user)).scalar()
+            if balance is not None:
+                return balance
+            # ON CONFLICT DO NOTHING instead of catching IntegrityError: on
+            # Postgres a failed INSERT aborts the transaction the SELECT needs
+            insert = _dialect_insert(conn.dialect.name)
+            conn.execute(insert(Credits).values(user=user, credit=self.default_credits).on_conflict_do_nothing())
+            # Another worker may have created the row first
+            return conn.execute(select(Credits.c.credit).where(Credits.c.user == user)).scalar()
+
+    def _write(self, spent):
+        with engine.begin() as conn:
+            conn.execute(
+                update(Credits).where(Credits.c.user == bindparam("u")).values(credit=Credits.c.credit - bindparam("amount")),
+                [{"u": user, "amount": amount} for user, amount in spent.items()],
+            )
+            rows = conn.execute(select(Credits.c.user, Credits.c.credit).where(Credits.c.user.in_(list(spent)))).fetchall()
+        return {user: balance for user, balance in rows}
+
+    def available(self, user):
+        return self.balances.get(user, 0) - self.pending.get(user, 0) - self.flushing.get(user, 0)
+
+    def _set_balances(self, balances):
+        now = time.monotonic()
+        self.balances.update(balances)
+        self.loaded_at.update(dict.fromkeys(balances, now))
+
+    async def balance(self, user):
+        loaded_at = self.loaded_at.get(user)
+        if loaded_at is None or time.monotonic() - loaded_at > self.balance_ttl:
+            flushes = self.flushes
+            balance = await asyncio.to_thread(self._load, user)
+            # A flush that finished meanwhile set a newer balance; keep that one
+            if self.flushes == flushes or user not in self.balances:
+                self._set_balances({user: balance})
+        return self.available(user)
+
+    async def charge(self, user, amount):
+        """Reserve `amount` credits for `user`; raises InsufficientCredits when the balance is too low."""
+        if await self.balance(user) < amount:
+            raise InsufficientCredits(f"Not enough credits: {self.available(user)} left, {amount} needed")
+        self.pending[user] += amount
+        if sum(self.pending.values()) >= self.flush_threshold:
+            await self.flush()
+
+    async def reserve(self, user, amount):
+        """charge(), remembered for the current request so release_reserved_credits() can undo it."""
+        await self.charge(user, amount)
+        reservation = CreditReservation(self, user, amount)
+        _current_reservation.set(reservation)
+        return reservation
+
+    def refund(self, user, amount):
+        """Give back charged credits; if they were already flushed, the next flush adds them back."""
+        self.pending[user] -= amount
+        if not self.pending[user]:
+            del self.pending[user]
+        self.refunded += amount
+
+    async def flush(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not self.pending:
+                return
+            # Charges made while writing land in a fresh `pending`
+            self.flushing, self.pending = self.pending, defaultdict(int)
+            try:
+                self._set_balances(await asyncio.to_thread(self._write, self.flushing))
+                self.flushes += 1
+            except Exception as e:
+                self.errors += 1
+                logger.warning("Credit flush failed, will retry: %s", e)
+                for user, amount in self.flushing.items():
+                    self.pending[user] += amount
+            finally:
+                self.flushing = {}
+
+    async def run(self):
+        """Background task: flush every CREDIT_FLUSH_SECONDS, and once more on shutdown."""
+        try:
+            while True:
+                await asyncio.sleep(self.flush_seconds)
+                await self.flush()
+        finally:
+            await self.flush()
+
+    def stats(self):
+        return {
+            "users": len(self.balances),
+            "pending_credits": sum(self.pending.values()),
+            "refunded_credits": self.refunded,
+            "flushes": self.flushes,
+            "errors": self.errors,
+        }
+
+
+def _dialect_insert(dialect):
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+credit_ledger = CreditLedger()
+
+def release_reserved_credits():
+    """
+    Give back the credits reserved for the current request, e.g. because its
+    answer came from the completion cache or the upstream call failed.
+    Does nothing outside a request that charged credits, or the second time.
+    """
+    reservation = _current_reservation.get()
+    if reservation is not None:
+        reservation.release()
+
+@credit.get("/credits")
+async def remaining_credits(current_user: User = Depends(get_current_user)):
+    return {"user": current_user.username, "credits": await credit_ledger.balance(current_user.username)}
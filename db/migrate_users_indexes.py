@@ -0,0 +1,80 @@
+"""
+Add the username unique index and the email blind index to an existing Users table.
+
+    python -m db.migrate_users_indexes            # add the column, backfill, create the indexes
+    python -m db.migrate_users_indexes --rebuild  # also recompute every email_index (after changing EMAIL_INDEX_KEY)
+
+Safe to run more than once. Duplicate usernames or emails are listed and the
+corresponding unique index is not created until they are resolved.
+"""
+import argparse
+import sys
+from collections import defaultdict
+
+from sqlalchemy import inspect, select, text, update
+
+from CRUD.authen import decrypt_email, email_blind_index
+from database import engine
+from models import Users
+
+BATCH_SIZE = 500
+
+
+def add_column(conn):
+    columns = {column["name"] for column in inspect(conn).get_columns("Users")}
+    if "email_index" not in columns:
+        conn.execute(text('ALTER TABLE "Users" ADD COLUMN email_index VARCHAR'))
+        print("Added Users.email_index")
+
+def backfill(conn, rebuild=False):
+    query = select(Users.c.id, Users.c.email)
+    if not rebuild:
+        query = query.where(Users.c.email_index.is_(None))
+    rows = conn.execute(query).fetchall()
+    failed = []
+    for start in range(0, len(rows), BATCH_SIZE):
+        for row in rows[start:start + BATCH_SIZE]:
+            try:
+                email_index = email_blind_index(decrypt_email(row.email)) if row.email else None
+            except Exception:
+                failed.append(row.id)
+                continue
+            conn.execute(update(Users).where(Users.c.id == row.id).values(email_index=email_index))
+    print(f"Backfilled email_index for {len(rows) - len(failed)} users")
+    if failed:
+        print(f"Could not decrypt the email of users {failed}; their email_index is left empty")
+
+def duplicates(conn, column):
+    groups = defaultdict(list)
+    for row_id, value in conn.execute(select(Users.c.id, column).where(column.is_not(None))):
+        groups[value].append(row_id)
+    return {value: ids for value, ids in groups.items() if len(ids) > 1}
+
+def create_indexes(conn):
+    ok = True
+    for index in Users.indexes:
+        column = list(index.columns)[0]
+        dupes = duplicates(conn, column) if index.unique else {}
+        if dupes:
+            ok = False
+            print(f"Not creating {index.name}: duplicate {column.name} values for user ids {list(dupes.values())}")
+            continue
+        index.create(conn, checkfirst=True)
+        print(f"Index {index.name} is in place")
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rebuild", action="store_true", help="Recompute email_index for every user")
+    args = parser.parse_args()
+
+    with engine.begin() as conn:
+        add_column(conn)
+        backfill(conn, rebuild=args.rebuild)
+        ok = create_indexes(conn)
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
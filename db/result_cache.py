@@ -0,0 +1,227 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+import unicodedata
+
+from dotenv import load_dotenv
+from sqlalchemy import delete, insert, select, update
+
+from database import engine
+from models import ResultCache
+from service.cache import LRUCache
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "10000"))
+RESULT_CACHE_MEMORY_TTL = float(os.getenv("RESULT_CACHE_MEMORY_TTL", "3600"))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", str(7 * 24 * 3600)))
+# Expired rows of a namespace are deleted every this many writes to it
+SWEEP_EVERY = 100
+
+
+def normalize_text(text: str) -> str:
+    """Normalize unicode and whitespace so trivially different copies share a key."""
+    text = unicodedata.normalize("NFKC", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+def text_key(text: str, *parts) -> str:
+    """Hash of the normalized text plus anything else the result depends on (model name/version)."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode())
+        digest.update(b"\0")
+    digest.update(normalize_text(text).encode())
+    return digest.hexdigest()
+
+
+class TwoTierCache:
+    """
+    In-process LRU with TTL in front of the ResultCache table.
+
+    Values must be JSON serializable. Lookups that miss memory fall through to
+    the database and are promoted back into memory on a hit; writes go to both.
+    Every statement is scoped to the namespace, so one namespace never reads,
+    overwrites or deletes another's rows. Expired rows are swept every
+    SWEEP_EVERY writes.
+
+    Parameters:
+    namespace (str): Separates unrelated results stored in the same table.
+    maxsize (int): Entries kept in memory.
+    memory_ttl (float): Seconds an entry stays in memory.
+    ttl (float): Seconds an entry stays valid in the database.
+    """
+
+    def __init__(self, namespace, maxsize=RESULT_CACHE_SIZE, memory_ttl=RESULT_CACHE_MEMORY_TTL, ttl=RESULT_CACHE_TTL):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.memory = LRUCache(maxsize=maxsize, ttl=memory_ttl)
+        self._writes = 0
+        self.swept = 0
+        self.db_hits = 0
+        self.db_misses = 0
+        self.db_errors = 0
+
+    # The database tier is best effort: a locked or unavailable database
+    # degrades to a miss instead of failing the request.
+    def _db_get(self, key):
+        try:
+            return self._db_read(key)
+        except Exception as e:
+            self.db_errors += 1
+            self.db_misses += 1
+            logger.warning("Result cache read failed: %s", e)
+            return None
+
+    def _db_set(self, key, value):
+        try:
+            self._db_write(key, value)
+        except Exception as e:
+            self.db_errors += 1
+            logger.warning("Result cache write failed: %s", e)
+
+    def _db_read(self, key):
+        with engine.begin() as conn:
+            row = conn.execute(
+                select(ResultCache.c.value, ResultCache.c.created_at)
+                .where(ResultCache.c.key == key, ResultCache.c.namespace == self.namespace)
+            ).fetchone()
+            if row and row.created_at + self.ttl < time.time():
+                conn.execute(delete(ResultCache).where(ResultCache.c.key == key,
+                                                       ResultCache.c.namespace == self.namespace))
+                row = None
+        if row is None:
+            self.db_misses += 1
+            return None
+        self.db_hits += 1
+        return json.loads(row.value)
+
+    def _db_write(self, key, value):
+        values = {"namespace": self.namespace, "value": json.dumps(value), "created_at": time.time()}
+        with engine.begin() as conn:
+            updated = conn.execute(update(ResultCache)
+                                   .where(ResultCache.c.key == key, ResultCache.c.namespace == self.namespace)
+                                   .values(**values))
+            if updated.rowcount == 0:
+                conn.execute(insert(ResultCache).values(key=key, **values))
+            self._count_writes(conn, 1)
+
+    def _count_writes(self, conn, count):
+        before, self._writes = self._writes, self._writes + count
+        if before // SWEEP_EVERY != self._writes // SWEEP_EVERY:
+            self._sweep(conn)
+
+    def _sweep(self, conn):
+        deleted = conn.execute(delete(ResultCache).where(ResultCache.c.namespace == self.namespace,
+                                                         ResultCache.c.created_at < time.time() - self.ttl))
+        self.swept += deleted.rowcount
+
+    def _db_get_many(self, keys):
+        found = {}
+        try:
+            with engine.begin() as conn:
+                # Stay well below SQLite's bound parameter limit
+                for i in range(0, len(keys), 500):
+                    rows = conn.execute(
+                        select(ResultCache.c.key, ResultCache.c.value, ResultCache.c.created_at)
+                        .where(ResultCache.c.key.in_(keys[i:i + 500]), ResultCache.c.namespace == self.namespace)
+                    ).fetchall()
+                    now = time.time()
+                    found.update({row.key: json.loads(row.value) for row in rows if row.created_at + self.ttl >= now})
+        except Exception as e:
+            self.db_errors += 1
+            logger.warning("Result cache read failed: %s", e)
+        self.db_hits += len(found)
+        self.db_misses += len(keys) - len(found)
+        return found
+
+    def _db_set_many(self, items):
+        try:
+            now = time.time()
+            with engine.begin() as conn:
+                keys = list(items)
+                for i in range(0, len(keys), 500):
+                    conn.execute(delete(ResultCache).where(ResultCache.c.key.in_(keys[i:i + 500]),
+                                                           ResultCache.c.namespace == self.namespace))
+                conn.execute(insert(ResultCache), [
+                    {"key": key, "namespace": self.namespace, "value": json.dumps(value), "created_at": now}
+                    for key, value in items.items()
+                ])
+                self._count_writes(conn, len(items))
+        except Exception as e:
+            self.db_errors += 1
+            logger.warning("Result cache write failed: %s", e)
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is not None:
+            return value
+        value = self._db_get(key)
+        if value is not None:
+            self.memory.set(key, value)
+        return value
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        self._db_set(key, value)
+
+    # Async wrappers keep the database round trip off the event loop
+    async def aget(self, key):
+        value = self.memory.get(key)
+        if value is not None:
+            return value
+        value = await asyncio.to_thread(self._db_get, key)
+        if value is not None:
+            self.memory.set(key, value)
+        return value
+
+    async def aset(self, key, value):
+        self.memory.set(key, value)
+        await asyncio.to_thread(self._db_set, key, value)
+
+    async def aget_many(self, keys):
+        """Look up many keys at once; returns {key: value} for the hits only."""
+        found = {}
+        missing = []
+        for key in keys:
+            value = self.memory.get(key)
+            if value is None:
+                missing.append(key)
+            else:
+                found[key] = value
+        if missing:
+            from_db = await asyncio.to_thread(self._db_get_many, missing)
+            for key, value in from_db.items():
+                self.memory.set(key, value)
+            found.update(from_db)
+        return found
+
+    async def aset_many(self, items):
+        for key, value in items.items():
+            self.memory.set(key, value)
+        if items:
+            await asyncio.to_thread(self._db_set_many, items)
+
+    def stats(self):
+        hits = self.memory.hits + self.db_hits
+        lookups = hits + self.db_misses
+        return {
+            "namespace": self.namespace,
+            "hits": hits,
+            "misses": self.db_misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "memory": self.memory.stats(),
+            "db_hits": self.db_hits,
+            "db_misses": self.db_misses,
+            "db_errors": self.db_errors,
+            "swept": self.swept,
+        }
+
+
+# Bias scores of the political bias classifier
+bias_cache = TwoTierCache("bias")
@@ -1,15 +1,19 @@
 from sqlalchemy import Table, Column , MetaData
-from sqlalchemy.sql.sqltypes import Boolean, Integer, String, Float
+from sqlalchemy.sql.sqltypes import Boolean, Integer, String, Float, Text
 from database import engine
 
 meta = MetaData()
 
 Users = Table('Users', meta,
     Column('id', Integer, unique=True, primary_key=True),
-    Column('username',String),
+    Column('username',String, unique=True, index=True),
     Column('email', String),
     Column('is_superuser',Boolean),
     Column('password', String),
+    # HMAC of the normalized email (see CRUD/authen.py), for lookups and
+    # uniqueness while `email` stays Fernet-encrypted. Existing databases:
+    # python -m db.migrate_users_indexes
+    Column('email_index', String, unique=True, index=True),
 )
 
 Cache = Table('cache', meta,
@@ -19,4 +23,40 @@ Cache = Table('cache', meta,
     Column("right", Float),
 )
 
+# GPT credit balance per username, charged by service/ratelimit.py through db/credit_check.py
+Credits = Table('Credits', meta,
+    Column("user", Text, primary_key=True, unique=True, nullable=False),
+    Column("credit", Integer, nullable=False),
+)
+
+# Persistent tier of db/result_cache.py, keyed on a hash of the normalized input
+ResultCache = Table('ResultCache', meta,
+    Column("key", String, primary_key=True),
+    Column("namespace", String, index=True),
+    Column("value", Text),
+    Column("created_at", Float),
+)
+
+# Persistent OpenAI completions, see db/completion_cache.py
+CompletionCache = Table('CompletionCache', meta,
+    Column("key", String, primary_key=True),
+    Column("model", String),
+    Column("value", Text),
+    Column("size", Integer),
+    Column("latency_ms", Float),
+    Column("cost", Float),
+    Column("created_at", Float),
+    Column("last_used", Float, index=True),
+)
+
+# Durable queue of labelled feedback for the bias classifier trainer
+FeedbackQueue = Table('FeedbackQueue', meta,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("text", Text, nullable=False),
+    Column("label", String, nullable=False),
+    Column("status", String, index=True),  # pending, training, trained or holdout
+    Column("created_at", Float),
+    Column("trained_at", Float),
+)
+
 meta.create_all(engine)
\ No newline at end of file
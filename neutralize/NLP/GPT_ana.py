@@ -1,26 +1,26 @@
-from openai import OpenAI
 
 import os
 from dotenv import load_dotenv
 import json
 
+from db.completion_cache import completion_cache, completion_key
+from service.executor import run_blocking
+from service.tracing import span
+from .openai_client import client, async_client
+from .prompting import fit_prompt, prompt_usage, prompt_version
+
 load_dotenv()
 # OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
-# Function to analyze text bias
-def GPT_ana(text, bias_level):
-    """
-    Analyze the text and determine why it is biased.
-
-    Parameters:
-    text (str): The chunk of text to analyze.
-    bias_level (dict): A dictionary with keys 'Left', 'Middle', 'Right' and values between 0 and 1.
+SYSTEM_PROMPT = "You are a political bias detection expert."
+# Bump whenever build_prompt changes so cached completions are not reused
+PROMPT_VERSION = "gpt_ana-v1"
+MODEL = "gpt-3.5-turbo"
+# The JSON answer is short; the output budget only bounds runaway explanations
+MAX_TOKENS = 200
 
-    Returns:
-    - dict: {"bias": "Left/Middle/Right", "explanation": "reasoning"}
-    """
-    prompt = f"""
+def build_prompt(text, bias_level):
+    return f"""
     Analyze the following text and determine its political bias. Choose from:
     - Left
     - Middle
@@ -42,18 +42,59 @@ def GPT_ana(text, bias_level):
     }}
     """
 
-    response = client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=[{"role": "system", "content": "You are a political bias detection expert."},
-                  {"role": "user", "content": prompt}],
-        max_tokens=200
-    )
-
-    # Extract JSON response
-    gpt_output = response.choices[0].message.content.strip()
+def parse_output(gpt_output):
     try:
         gpt_data = json.loads(gpt_output)
         # return {"bias": gpt_data["bias"], "explanation": gpt_data["explanation"]}
         return gpt_data["explanation"]
     except json.JSONDecodeError:
         return {"bias": "Unknown", "explanation": "GPT response not in JSON format."}
+
+def parsable(gpt_output):
+    """Whether parse_output can read the answer; answers it cannot are not cached."""
+    try:
+        return "explanation" in json.loads(gpt_output)
+    except (json.JSONDecodeError, TypeError):
+        return False
+
+# Function to analyze text bias
+def GPT_ana(text, bias_level):
+    """
+    Analyze the text and determine why it is biased.
+
+    Parameters:
+    text (str): The chunk of text to analyze.
+    bias_level (dict): A dictionary with keys 'Left', 'Middle', 'Right' and values between 0 and 1.
+
+    Returns:
+    - dict: {"bias": "Left/Middle/Right", "explanation": "reasoning"}
+    """
+    prompt = fit_prompt(build_prompt, text, MODEL, SYSTEM_PROMPT, bias_level)
+    with span("openai"):
+        response = client.chat.completions.create(
+            model=MODEL,
+            messages=[{"role": "system", "content": SYSTEM_PROMPT},
+                      {"role": "user", "content": prompt.text}],
+            max_tokens=MAX_TOKENS
+        )
+    prompt_usage.record(prompt, response.usage)
+
+    # Extract JSON response
+    return parse_output(response.choices[0].message.content.strip())
+
+async def GPT_ana_async(text, bias_level):
+    """Same as GPT_ana, but awaits the completion and reuses cached answers for identical requests."""
+    async def produce():
+        prompt = await run_blocking(fit_prompt, build_prompt, text, MODEL, SYSTEM_PROMPT, bias_level)
+        with span("openai"):
+            response = await async_client.chat.completions.create(
+                model=MODEL,
+                messages=[{"role": "system", "content": SYSTEM_PROMPT},
+                          {"role": "user", "content": prompt.text}],
+                max_tokens=MAX_TOKENS
+            )
+        prompt_usage.record(prompt, response.usage)
+        return response.choices[0].message.content.strip(), response.usage
+
+    key = completion_key(MODEL, prompt_version(PROMPT_VERSION, MODEL, MAX_TOKENS), text, bias_level)
+    return parse_output(await completion_cache.get_or_create(key, MODEL, produce, parsable))
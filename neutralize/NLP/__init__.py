@@ -1,5 +1,12 @@
-from .GPT_ana import GPT_ana
+from .GPT_ana import GPT_ana, GPT_ana_async
 from .multimo import multimodal_reasoning, reduce_bias, multicon_GPT_ana
-from .multimo import NLP_ana
+from .multimo import reduce_bias_async, multicon_GPT_ana_async
+from .multimo import reduce_bias_stream, multicon_GPT_ana_stream
+from .prompting import fit_prompt, model_budget
+from .routing import choose_model
+# The shared bias classifier, kept importable from here for older callers
+from neutralize.reinforced import NLP_ana
 
-__all__ = ["GPT_ana", "multimodal_reasoning", "reduce_bias", "multicon_GPT_ana", "NLP_ana"]
\ No newline at end of file
+__all__ = ["GPT_ana", "GPT_ana_async", "multimodal_reasoning", "reduce_bias", "multicon_GPT_ana",
+           "reduce_bias_async", "multicon_GPT_ana_async", "reduce_bias_stream", "multicon_GPT_ana_stream",
+           "fit_prompt", "model_budget", "choose_model", "NLP_ana"]
\ No newline at end of file
@@ -0,0 +1,78 @@
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+from PIL import Image
+
+from db.result_cache import RESULT_CACHE_TTL, TwoTierCache, text_key
+
+load_dotenv()
+
+# Multimodal contexts kept in memory; the ResultCache table holds them for IMAGE_CONTEXT_TTL seconds
+IMAGE_CONTEXT_CACHE_SIZE = int(os.getenv("IMAGE_CONTEXT_CACHE_SIZE", "2048"))
+IMAGE_CONTEXT_TTL = float(os.getenv("IMAGE_CONTEXT_TTL", str(RESULT_CACHE_TTL)))
+# Side of the dHash grid: 8 gives a 64-bit hash
+DHASH_SIZE = 8
+
+
+def dhash(image, size=DHASH_SIZE):
+    """
+    Difference hash of an image as a hex string.
+
+    The image is shrunk to a (size + 1) x size grayscale grid and each bit
+    records whether a pixel is brighter than its right neighbour, so resized
+    or re-encoded copies of the same picture get the same hash.
+    """
+    pixels = list(image.convert("L").resize((size + 1, size), Image.Resampling.LANCZOS).getdata())
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            bits = (bits << 1) | (left > pixels[row * (size + 1) + col + 1])
+    return f"{bits:0{size * size // 4}x}"
+
+
+class ImageContextCache:
+    """
+    Generated image descriptions, keyed on the image's dHash.
+
+    Parameters:
+    parts (tuple): Everything else the description depends on (models, generation
+        settings), part of every key so changing them does not reuse old entries.
+    """
+
+    def __init__(self, parts, maxsize=IMAGE_CONTEXT_CACHE_SIZE, ttl=IMAGE_CONTEXT_TTL):
+        self.parts = parts
+        self.cache = TwoTierCache("image_context", maxsize=maxsize, memory_ttl=ttl, ttl=ttl)
+        self._lock = threading.Lock()
+        self.generated = 0
+        self.generate_ms = 0.0
+        self.max_generate_ms = 0.0
+
+    def key(self, image):
+        return text_key(dhash(image), *self.parts)
+
+    def get_or_create(self, image, describe):
+        """Return the cached description of `image`, or run `describe(image)` and cache it."""
+        key = self.key(image)
+        context = self.cache.get(key)
+        if context is not None:
+            return context
+        start = time.perf_counter()
+        context = describe(image)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.generated += 1
+            self.generate_ms += elapsed_ms
+            self.max_generate_ms = max(self.max_generate_ms, elapsed_ms)
+        self.cache.set(key, context)
+        return context
+
+    def stats(self):
+        return {
+            **self.cache.stats(),
+            "generated": self.generated,
+            "avg_generate_ms": round(self.generate_ms / self.generated, 1) if self.generated else 0.0,
+            "max_generate_ms": round(self.max_generate_ms, 1),
+        }
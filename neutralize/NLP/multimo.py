@@ -1,103 +1,141 @@
-from openai import OpenAI
+import hashlib
 import os
+import time
 from dotenv import load_dotenv
 import torch
-from transformers import AutoTokenizer, AutoModelForSequenceClassification, CLIPProcessor, CLIPModel
-from transformers import GPT2Tokenizer, GPT2LMHeadModel
+from transformers import CLIPProcessor, CLIPModel
+from transformers import GPT2LMHeadModel
 from PIL import Image
 
+from db.completion_cache import completion_cache, completion_key
+from neutralize.registry import registry, device
+from neutralize.tokenization import load_fast_tokenizer
+from .image_context import ImageContextCache
+from .openai_client import client, async_client
+from .prompting import fit_prompt, prompt_usage, prompt_version
+from .prompt_bank import PROMPT_BANK_PATH, PromptBank, load_prompts
+from service.executor import run_blocking
+from service.tracing import span
+
 load_dotenv()
 
-# Determine available device: cuda > mps > cpu
-device = torch.device("cuda" if torch.cuda.is_available() 
-                      else "mps" if torch.backends.mps.is_available() 
-                      else "cpu")
-print(f"Using device: {device.type.upper()} ({torch.cuda.get_device_name(device) if device.type == 'cuda' else 'N/A'})")
+# Models are loaded on first use through the shared registry
+CLIP_MODEL_NAME = "openai/clip-vit-large-patch14"
+
+def load_clip():
+    clip_model = CLIPModel.from_pretrained(CLIP_MODEL_NAME)
+    clip_processor = CLIPProcessor.from_pretrained(CLIP_MODEL_NAME)
+    clip_model.to(device)
+    clip_model.eval()
+    return clip_model, clip_processor
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+def load_gpt2():
+    gpt_tokenizer = load_fast_tokenizer("gpt2")
+    gpt_model = GPT2LMHeadModel.from_pretrained("gpt2")
+    gpt_model.to(device)
+    gpt_model.eval()
+    return gpt_tokenizer, gpt_model
 
-# Load bias analysis model and move to device
-tokenizer = AutoTokenizer.from_pretrained("textattack/bert-base-uncased-yelp-polarity")
-model = AutoModelForSequenceClassification.from_pretrained("textattack/bert-base-uncased-yelp-polarity")
-model.to(device)
+def encode_clip_text(prompts):
+    clip_model, clip_processor = registry.get("clip")
+    text_inputs = clip_processor(text=prompts, return_tensors="pt", padding=True)
+    text_inputs = {k: v.to(device) for k, v in text_inputs.items()}
+    with torch.no_grad():
+        return clip_model.get_text_features(**text_inputs)
+
+def encode_clip_image(image):
+    """Normalized CLIP embedding ([1, dim]) of a RGB image."""
+    clip_model, clip_processor = registry.get("clip")
+    inputs = clip_processor(images=image, return_tensors="pt")
+    inputs = {k: v.to(device) for k, v in inputs.items()}
+    with torch.no_grad():
+        image_features = clip_model.get_image_features(**inputs)
+    return image_features / image_features.norm(dim=-1, keepdim=True)
 
-# Load CLIP model and processor, then move model to device
-clip_model = CLIPModel.from_pretrained("openai/clip-vit-large-patch14")
-clip_processor = CLIPProcessor.from_pretrained("openai/clip-vit-large-patch14")
-clip_model.to(device)
+def load_clip_prompts():
+    # Encoded once per prompt list and model, then read back from disk on restart
+    return PromptBank.build(load_prompts(), encode_clip_text, CLIP_MODEL_NAME, device)
 
-# Load GPT-2 model and tokenizer for text generation, then move model to device
-gpt_tokenizer = GPT2Tokenizer.from_pretrained("gpt2")
-gpt_model = GPT2LMHeadModel.from_pretrained("gpt2")
-gpt_model.to(device)
+registry.register("clip", load_clip)
+registry.register("clip_prompts", load_clip_prompts)
+registry.register("gpt2", load_gpt2)
 
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
-def NLP_ana(text):
-    inputs = tokenizer(text, return_tensors="pt", truncation=True, max_length=512)
-    # Move inputs to device
-    inputs = {k: v.to(device) for k, v in inputs.items()}
-    with torch.no_grad():
-        logits = model(**inputs).logits
-        probabilities = logits.softmax(dim=-1)[0].tolist()
-    
-    categories = ["Left", "Middle", "Right"]
-    bias_result = {categories[i]: probabilities[i] for i in range(len(categories))}
-    
-    return bias_result
+# Bounded GPT-2 captioning. Greedy decoding makes a description depend only on
+# the image, so it can be cached; set CAPTION_SAMPLE=true for sampled text
+CAPTION_MAX_NEW_TOKENS = int(os.getenv("CAPTION_MAX_NEW_TOKENS", "60"))
+CAPTION_SAMPLE = os.getenv("CAPTION_SAMPLE", "false").lower() == "true"
+CAPTION_TEMPERATURE = float(os.getenv("CAPTION_TEMPERATURE", "0.7"))
+# Bump when the captioning pipeline changes so cached descriptions are not reused
+CAPTION_VERSION = "caption-v1"
 
-def multimodal_reasoning(image_path=None):
-    if not image_path:
-        return "No image provided."
-    
-    try:
-        # Load and preprocess the image using CLIP
-        image = Image.open(image_path).convert("RGB")
-        inputs = clip_processor(images=image, return_tensors="pt")
-        inputs = {k: v.to(device) for k, v in inputs.items()}
-        with torch.no_grad():
-            image_features = clip_model.get_image_features(**inputs)
-        image_features /= image_features.norm(dim=-1, keepdim=True)
-        
-        # Define a few base descriptive prompts
-        base_prompts = [
-            "An intricate scene with a vibrant composition, capturing a moment full of depth and detail.",
-            "A richly detailed image that tells a complex story with subtle nuances and vivid colors.",
-            "A dynamic portrayal that combines textures, light, and shadow to reveal a captivating narrative.",
-            "A visually striking scene that blends emotion and detail in a sophisticated manner."
-        ]
-        
-        # Use CLIP to determine which base prompt best aligns with the image
-        text_inputs = clip_processor(text=base_prompts, return_tensors="pt", padding=True)
-        text_inputs = {k: v.to(device) for k, v in text_inputs.items()}
-        with torch.no_grad():
-            text_features = clip_model.get_text_features(**text_inputs)
-        text_features /= text_features.norm(dim=-1, keepdim=True)
-        
-        similarity = (image_features @ text_features.T).squeeze(0)
-        best_prompt_idx = similarity.argmax().item()
-        selected_prompt = base_prompts[best_prompt_idx]
-        
-        # Use the selected prompt to generate a detailed description with GPT-2
-        prompt = f"Describe the image in detail: {selected_prompt}"
-        input_ids = gpt_tokenizer.encode(prompt, return_tensors="pt").to(device)
+image_contexts = ImageContextCache((
+    CAPTION_VERSION, CLIP_MODEL_NAME, "gpt2", PROMPT_BANK_PATH,
+    CAPTION_MAX_NEW_TOKENS, CAPTION_SAMPLE, CAPTION_TEMPERATURE,
+))
+
+def describe_image(image):
+    """Match a RGB image against the CLIP prompt bank and expand the best prompt with GPT-2."""
+    gpt_tokenizer, gpt_model = registry.get("gpt2")
+    with span("clip"):
+        image_features = encode_clip_image(image)
+        # Pick the prompt from the precomputed bank that best aligns with the image
+        _, selected_prompt, _ = registry.get("clip_prompts").best_match(image_features)
+
+    # Use the selected prompt to generate a detailed description with GPT-2
+    prompt = f"Describe the image in detail: {selected_prompt}"
+    input_ids = gpt_tokenizer.encode(prompt, return_tensors="pt").to(device)
+    sampling = {"do_sample": True, "temperature": CAPTION_TEMPERATURE} if CAPTION_SAMPLE else {"do_sample": False}
+    with span("caption"), torch.no_grad():
         output_ids = gpt_model.generate(
-            input_ids, 
-            max_length=150, 
-            num_return_sequences=1, 
-            do_sample=True, 
-            temperature=0.7,
-            pad_token_id=gpt_tokenizer.eos_token_id
+            input_ids,
+            attention_mask=torch.ones_like(input_ids),
+            max_new_tokens=CAPTION_MAX_NEW_TOKENS,
+            num_return_sequences=1,
+            use_cache=True,
+            pad_token_id=gpt_tokenizer.eos_token_id,
+            **sampling
         )
-        detailed_description = gpt_tokenizer.decode(output_ids[0], skip_special_tokens=True)
-        return detailed_description
+    return gpt_tokenizer.decode(output_ids[0], skip_special_tokens=True)
+
+def image_context(image=None):
+    """
+    Describe an image for use as extra prompt context. Returns (context, ok).
+
+    Descriptions are cached under the image's perceptual hash, so resized or
+    re-encoded copies of a picture skip CLIP and GPT-2. When describing fails,
+    context is the error and ok is False, so completions built on it are not cached.
+
+    Parameters:
+    image (PIL.Image.Image | str | None): A decoded image, or a path to one.
+    """
+    if image is None or (isinstance(image, str) and not image):
+        return "No image provided.", True
+    
+    try:
+        if isinstance(image, str):
+            image = Image.open(image)
+        with span("image_context"):
+            return image_contexts.get_or_create(image.convert("RGB"), describe_image), True
 
     except Exception as e:
-        return f"Error processing image: {str(e)}"
+        return f"Error processing image: {str(e)}", False
+
+def multimodal_reasoning(image=None):
+    """The image description from image_context(), or the error it ran into."""
+    return image_context(image)[0]
+
+def image_context_stats():
+    return image_contexts.stats()
+
+SYSTEM_PROMPT = "You are an AI that neutralizes bias in text with advanced multimodal reasoning."
+# Bump whenever a prompt template changes so cached completions are not reused
+REDUCE_BIAS_PROMPT_VERSION = "reduce_bias-v1"
+MULTICON_PROMPT_VERSION = "multicon-v1"
 
-def reduce_bias(text, bias_level, image_path=None, model="gpt-3.5-turbo"):
-    multimodal_context = multimodal_reasoning(image_path)
-    prompt = f"""
+def reduce_bias_prompt(text, bias_level, multimodal_context):
+    return f"""
     The following text may have bias based on the given bias level ({bias_level}). 
     Please rewrite it in a more neutral and objective manner while keeping the meaning intact:
     
@@ -109,22 +147,9 @@ def reduce_bias(text, bias_level, image_path=None, model="gpt-3.5-turbo"):
     
     Neutral Rewrite:
     """
-    try:
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": "You are an AI that neutralizes bias in text with advanced multimodal reasoning."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.5
-        )
-        return response.choices[0].message.content.strip(), multimodal_context
-    except Exception as e:
-        return str(e), multimodal_context
 
-def multicon_GPT_ana(text, bias_level, image_path=None, model="gpt-3.5-turbo"):
-    multimodal_context = multimodal_reasoning(image_path)
-    prompt = f"""
+def multicon_prompt(text, bias_level, multimodal_context):
+    return f"""
     The following text may have bias based on the given bias level ({bias_level}). 
     Please explain why the text is biased, in markdown, and also analyze how to correctly interpret it:
     
@@ -136,15 +161,152 @@ def multicon_GPT_ana(text, bias_level, image_path=None, model="gpt-3.5-turbo"):
     
     Neutral Rewrite:
     """
-    try:
+
+def chat_completion(prompt, model, max_tokens=None):
+    with span("openai"):
         response = client.chat.completions.create(
             model=model,
             messages=[
-                {"role": "system", "content": "You are an AI that neutralizes bias in text with advanced multimodal reasoning."},
+                {"role": "system", "content": SYSTEM_PROMPT},
                 {"role": "user", "content": prompt}
             ],
-            temperature=0.5
+            temperature=0.5,
+            max_tokens=max_tokens
         )
-        return response.choices[0].message.content.strip(), multimodal_context
+    return response.choices[0].message.content.strip(), response.usage
+
+async def chat_completion_async(prompt, model, max_tokens=None):
+    with span("openai"):
+        response = await async_client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.5,
+            max_tokens=max_tokens
+        )
+    return response.choices[0].message.content.strip(), response.usage
+
+async def chat_completion_stream(prompt, model, max_tokens=None):
+    """Yield (text_delta, usage) as the completion streams in; usage is only set on the last chunk."""
+    # The span covers the whole stream, not just the time to the first chunk
+    with span("openai"):
+        stream = await async_client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.5,
+            max_tokens=max_tokens,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        async for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta or chunk.usage:
+                yield delta or "", chunk.usage
+
+def fitted_completion(build_prompt, text, bias_level, multimodal_context, model):
+    """
+    Chat completion for a prompt trimmed to the model's input budget, with
+    max_tokens set to its output budget. Returns (content, usage).
+    """
+    prompt = fit_prompt(build_prompt, text, model, SYSTEM_PROMPT, bias_level, multimodal_context)
+    content, usage = chat_completion(prompt.text, model, prompt.max_tokens)
+    prompt_usage.record(prompt, usage)
+    return content, usage
+
+def image_digest(image):
+    """Stable hash of an image (decoded, or a path to one), used in cache keys."""
+    if image is None or (isinstance(image, str) and not image):
+        return None
+    if isinstance(image, str):
+        with open(image, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    digest = hashlib.sha256(f"{image.mode}:{image.size}".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+async def cached_multimodal_completion(build_prompt, template_version, text, bias_level, image, model):
+    """
+    Multimodal context plus chat completion, memoized in the completion cache.
+
+    A hit skips both CLIP/GPT-2 and the OpenAI call. Returns (content, multimodal_context).
+    """
+    context = {}
+
+    async def produce():
+        context["mulcont"], context["ok"] = await run_blocking(image_context, image)
+        prompt = await run_blocking(fit_prompt, build_prompt, text, model, SYSTEM_PROMPT, bias_level, context["mulcont"])
+        content, usage = await chat_completion_async(prompt.text, model, prompt.max_tokens)
+        prompt_usage.record(prompt, usage)
+        return {"content": content, "mulcont": context["mulcont"]}, usage
+
+    key = completion_key(model, prompt_version(template_version, model), text, bias_level, image_digest(image))
+    try:
+        result = await completion_cache.get_or_create(key, model, produce, lambda value: context["ok"])
+        return result["content"], result["mulcont"]
+    except Exception as e:
+        # The error is returned as the answer; nothing was produced, so rate_limit refunds it
+        return str(e), context.get("mulcont", "")
+
+async def stream_multimodal_completion(build_prompt, template_version, text, bias_level, image, model):
+    """
+    Streaming counterpart of cached_multimodal_completion.
+
+    Yields ("mulcont", context) once, then ("token", text) pieces of the completion as
+    OpenAI sends them. A cached answer is replayed as a single token. The full
+    completion is cached once the stream finishes, so later requests can reuse it,
+    unless the image could not be described.
+    """
+    key = completion_key(model, prompt_version(template_version, model), text, bias_level, image_digest(image))
+    cached = await completion_cache.get(key)
+    if cached is not None:
+        yield "mulcont", cached["mulcont"]
+        yield "token", cached["content"]
+        return
+
+    mulcont, ok = await run_blocking(image_context, image)
+    yield "mulcont", mulcont
+
+    prompt = await run_blocking(fit_prompt, build_prompt, text, model, SYSTEM_PROMPT, bias_level, mulcont)
+    start = time.perf_counter()
+    parts, usage = [], None
+    async for delta, chunk_usage in chat_completion_stream(prompt.text, model, prompt.max_tokens):
+        if delta:
+            parts.append(delta)
+            yield "token", delta
+        usage = chunk_usage or usage
+    prompt_usage.record(prompt, usage)
+    await completion_cache.put(key, model, {"content": "".join(parts).strip(), "mulcont": mulcont},
+                               (time.perf_counter() - start) * 1000, usage, store=ok)
+
+def reduce_bias(text, bias_level, image=None, model="gpt-3.5-turbo"):
+    multimodal_context = multimodal_reasoning(image)
+    try:
+        return fitted_completion(reduce_bias_prompt, text, bias_level, multimodal_context, model)[0], multimodal_context
+    except Exception as e:
+        return str(e), multimodal_context
+
+def multicon_GPT_ana(text, bias_level, image=None, model="gpt-3.5-turbo"):
+    multimodal_context = multimodal_reasoning(image)
+    try:
+        return fitted_completion(multicon_prompt, text, bias_level, multimodal_context, model)[0], multimodal_context
     except Exception as e:
         return str(e), multimodal_context
+
+# Async variants used by the API: CLIP/GPT-2 run in the model pool, the
+# OpenAI call is awaited and identical requests are served from the cache.
+async def reduce_bias_async(text, bias_level, image=None, model="gpt-3.5-turbo"):
+    return await cached_multimodal_completion(reduce_bias_prompt, REDUCE_BIAS_PROMPT_VERSION, text, bias_level, image, model)
+
+async def multicon_GPT_ana_async(text, bias_level, image=None, model="gpt-3.5-turbo"):
+    return await cached_multimodal_completion(multicon_prompt, MULTICON_PROMPT_VERSION, text, bias_level, image, model)
+
+def reduce_bias_stream(text, bias_level, image=None, model="gpt-3.5-turbo"):
+    return stream_multimodal_completion(reduce_bias_prompt, REDUCE_BIAS_PROMPT_VERSION, text, bias_level, image, model)
+
+def multicon_GPT_ana_stream(text, bias_level, image=None, model="gpt-3.5-turbo"):
+    return stream_multimodal_completion(multicon_prompt, MULTICON_PROMPT_VERSION, text, bias_level, image, model)
@@ -0,0 +1,18 @@
+from openai import OpenAI, AsyncOpenAI
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Point the clients at another OpenAI-compatible server, e.g. the stand-in in
+# benchmarks/fake_openai.py for load tests. Unset means api.openai.com.
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+# Seconds before a request is abandoned, and retries on connection errors, 429 and 5xx
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "600"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+
+# Shared by GPT_ana.py and multimo.py, so both reuse one connection pool
+client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=OPENAI_BASE_URL,
+                timeout=OPENAI_TIMEOUT, max_retries=OPENAI_MAX_RETRIES)
+async_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=OPENAI_BASE_URL,
+                           timeout=OPENAI_TIMEOUT, max_retries=OPENAI_MAX_RETRIES)
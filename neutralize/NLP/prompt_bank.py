@@ -0,0 +1,89 @@
+import hashlib
+import json
+import os
+
+import torch
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Optional prompt file: a JSON list of strings, or one prompt per line ('#' starts a comment)
+PROMPT_BANK_PATH = os.getenv("PROMPT_BANK_PATH")
+# Where encoded prompt banks are stored so restarts do not re-encode them
+PROMPT_BANK_CACHE_DIR = os.getenv("PROMPT_BANK_CACHE_DIR", ".cache/prompt_bank")
+PROMPT_BANK_BATCH_SIZE = int(os.getenv("PROMPT_BANK_BATCH_SIZE", "64"))
+
+# Base descriptive prompts, used when no prompt file is configured
+DEFAULT_PROMPTS = [
+    "An intricate scene with a vibrant composition, capturing a moment full of depth and detail.",
+    "A richly detailed image that tells a complex story with subtle nuances and vivid colors.",
+    "A dynamic portrayal that combines textures, light, and shadow to reveal a captivating narrative.",
+    "A visually striking scene that blends emotion and detail in a sophisticated manner."
+]
+
+
+def load_prompts(path=PROMPT_BANK_PATH):
+    if not path:
+        return list(DEFAULT_PROMPTS)
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".json"):
+            prompts = [str(p).strip() for p in json.load(f)]
+        else:
+            prompts = [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+    if not prompts:
+        raise ValueError(f"Prompt bank {path} is empty")
+    return prompts
+
+
+class PromptBank:
+    """
+    L2-normalized CLIP text embeddings for a fixed list of prompts.
+
+    Matching an image is a single matrix multiply of its normalized
+    embedding against `embeddings` ([num_prompts, dim]).
+    """
+
+    def __init__(self, prompts, embeddings):
+        self.prompts = prompts
+        self.embeddings = embeddings
+
+    @classmethod
+    def build(cls, prompts, encode, model_name, device, cache_dir=PROMPT_BANK_CACHE_DIR, batch_size=PROMPT_BANK_BATCH_SIZE):
+        """
+        Load the encoded bank from disk, or encode it and store it there.
+
+        Parameters:
+        prompts (list[str]): Prompts to index.
+        encode (callable): Maps a list of prompts to a [n, dim] tensor of CLIP text features.
+        model_name (str): Encoder name, part of the on-disk key so a model change re-encodes.
+        device (torch.device): Device the embeddings are kept on.
+        """
+        digest = hashlib.sha256(json.dumps([model_name, prompts]).encode()).hexdigest()[:16]
+        path = os.path.join(cache_dir, f"{digest}.pt")
+
+        if os.path.exists(path):
+            embeddings = torch.load(path, map_location="cpu", weights_only=True)["embeddings"]
+        else:
+            with torch.no_grad():
+                embeddings = torch.cat([
+                    encode(prompts[i:i + batch_size]).float().cpu()
+                    for i in range(0, len(prompts), batch_size)
+                ])
+            embeddings = embeddings / embeddings.norm(dim=-1, keepdim=True)
+            os.makedirs(cache_dir, exist_ok=True)
+            # Write then rename so a crash never leaves a truncated file behind
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            torch.save({"prompts": prompts, "embeddings": embeddings}, tmp_path)
+            os.replace(tmp_path, path)
+
+        return cls(prompts, embeddings.to(device))
+
+    @property
+    def nbytes(self):
+        return self.embeddings.numel() * self.embeddings.element_size()
+
+    def best_match(self, image_features):
+        """Return (index, prompt, similarity) of the prompt closest to a normalized image embedding."""
+        similarity = (image_features.to(self.embeddings.dtype) @ self.embeddings.T).squeeze(0)
+        idx = similarity.argmax().item()
+        return idx, self.prompts[idx], similarity[idx].item()
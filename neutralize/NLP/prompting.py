@@ -0,0 +1,265 @@
+import logging
+import math
+import os
+import re
+import threading
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# How prompt tokens are counted locally: "tiktoken" (exact for OpenAI models,
+# optional: pip install tiktoken), "gpt2" (GPT-2 BPE, close for English text),
+# "chars" (4 characters per token), or "auto" for the first one available
+PROMPT_TOKEN_COUNTER = os.getenv("PROMPT_TOKEN_COUNTER", "auto")
+
+# (input, output) token budgets per model. The input budget covers the system
+# prompt, the template and the article; the output budget is sent as max_tokens.
+# Override with MODEL_INPUT_TOKENS_<MODEL> / MODEL_OUTPUT_TOKENS_<MODEL>,
+# e.g. MODEL_INPUT_TOKENS_GPT_4=3000
+MODEL_BUDGETS = {
+    "gpt-3.5-turbo": (8000, 2000),
+    "gpt-4": (4000, 2000),
+    "gpt-4-turbo": (12000, 2000),
+}
+DEFAULT_BUDGET = (4000, 1000)
+# Chat format overhead: per message, plus the primer for the reply
+TOKENS_PER_MESSAGE = 3
+REPLY_TOKENS = 3
+# Put where paragraphs were left out of the article
+OMISSION_MARKER = "[...]"
+
+STOPWORDS = frozenset("""
+a an and are as at be but by for from had has have he her his i in is it its of on or our she so that the
+their them they this to was we were which who will with would you your not no than then there these those
+""".split())
+
+
+class TokenCounter:
+    """Counts and truncates text in the tokens of one tokenizer."""
+
+    def __init__(self, kind, model=None):
+        self.kind = kind
+        if kind == "tiktoken":
+            import tiktoken
+            try:
+                self.encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                self.encoding = tiktoken.get_encoding("cl100k_base")
+        elif kind == "gpt2":
+            from neutralize.tokenization import load_fast_tokenizer
+            # The Rust tokenizer directly: no special tokens, no max length warnings
+            self.encoding = load_fast_tokenizer("gpt2").backend_tokenizer
+        elif kind != "chars":
+            raise ValueError(f"Unknown PROMPT_TOKEN_COUNTER '{kind}', expected auto, tiktoken, gpt2 or chars")
+
+    def encode(self, text):
+        if self.kind == "tiktoken":
+            return self.encoding.encode_ordinary(text)
+        return self.encoding.encode(text, add_special_tokens=False).ids
+
+    def count(self, text):
+        if self.kind == "chars":
+            return math.ceil(len(text) / 4)
+        return len(self.encode(text))
+
+    def truncate(self, text, max_tokens):
+        if self.kind == "chars":
+            return text[:max_tokens * 4]
+        return self.encoding.decode(self.encode(text)[:max_tokens])
+
+
+_counters = {}
+_counters_lock = threading.Lock()
+
+def _load_counter(model):
+    if PROMPT_TOKEN_COUNTER != "auto":
+        return TokenCounter(PROMPT_TOKEN_COUNTER, model)
+    for kind in ("tiktoken", "gpt2"):
+        try:
+            return TokenCounter(kind, model)
+        except Exception as e:
+            logger.info("Prompt token counter %s unavailable: %s", kind, e)
+    logger.warning("Counting prompt tokens as 4 characters each; install tiktoken for exact budgets")
+    return TokenCounter("chars")
+
+def token_counter(model):
+    counter = _counters.get(model)
+    if counter is None:
+        with _counters_lock:
+            counter = _counters.get(model) or _load_counter(model)
+            _counters[model] = counter
+    return counter
+
+
+def _env_name(model):
+    return re.sub(r"[^A-Z0-9]+", "_", model.upper()).strip("_")
+
+def model_budget(model):
+    """(input_tokens, output_tokens) allowed for one request to `model`."""
+    input_tokens, output_tokens = MODEL_BUDGETS.get(model, DEFAULT_BUDGET)
+    name = _env_name(model)
+    return (int(os.getenv(f"MODEL_INPUT_TOKENS_{name}", input_tokens)),
+            int(os.getenv(f"MODEL_OUTPUT_TOKENS_{name}", output_tokens)))
+
+
+def split_units(text):
+    """Paragraphs of the text, or its sentences when it is a single paragraph."""
+    paragraphs = [p.strip() for p in re.split(r"\n\s*\n|\r\n\s*\r\n", text) if p.strip()]
+    if len(paragraphs) > 1:
+        return paragraphs, "\n\n"
+    return [s for s in re.split(r"(?<=[.!?])\s+", text.strip()) if s], " "
+
+def informativeness(units):
+    """
+    Score each unit by its content words, weighting words that occur in few
+    units higher (they carry what is specific to that paragraph). The lead
+    unit gets a bonus since articles front-load their main claim.
+    """
+    words = [{w for w in re.findall(r"[a-z0-9']+", unit.lower()) if w not in STOPWORDS and len(w) > 2}
+             for unit in units]
+    frequency = {}
+    for unit_words in words:
+        for w in unit_words:
+            frequency[w] = frequency.get(w, 0) + 1
+    scores = [sum(math.log(1 + len(units) / frequency[w]) for w in unit_words) for unit_words in words]
+    if scores:
+        scores[0] *= 1.5
+    return scores
+
+def fit_text(text, max_tokens, counter):
+    """
+    Trim `text` to at most `max_tokens`, keeping its most informative paragraphs.
+
+    Paragraphs are picked greedily by informativeness per token and put back
+    in their original order, with OMISSION_MARKER where some were left out.
+    Returns (text, tokens).
+    """
+    tokens = counter.count(text)
+    if tokens <= max_tokens:
+        return text, tokens
+    if max_tokens <= 0:
+        return "", 0
+
+    units, separator = split_units(text)
+    counts = [counter.count(unit) for unit in units]
+    scores = informativeness(units)
+    marker_tokens = counter.count(separator + OMISSION_MARKER + separator)
+    order = sorted(range(len(units)), key=lambda i: (-scores[i] / max(counts[i], 1), i))
+
+    kept, used = set(), 0
+    for i in order:
+        # Leave room for an omission marker next to every kept unit
+        if used + counts[i] + marker_tokens <= max_tokens:
+            kept.add(i)
+            used += counts[i] + marker_tokens
+    if not kept:
+        # Not even one paragraph fits: cut the best one, marked as cut when there is room
+        best = order[0]
+        suffix = " " + OMISSION_MARKER
+        suffix_tokens = counter.count(suffix)
+        if suffix_tokens < max_tokens:
+            fitted = counter.truncate(units[best], max_tokens - suffix_tokens) + suffix
+        else:
+            fitted = counter.truncate(units[best], max_tokens)
+        tokens = counter.count(fitted)
+        if tokens > max_tokens:
+            # BPE merges across the join can add a token
+            fitted = counter.truncate(fitted, max_tokens)
+            tokens = counter.count(fitted)
+        return fitted, tokens
+
+    parts = []
+    for i, unit in enumerate(units):
+        if i in kept:
+            parts.append(unit)
+        elif not parts or parts[-1] != OMISSION_MARKER:
+            parts.append(OMISSION_MARKER)
+    fitted = separator.join(parts)
+    return fitted, counter.count(fitted)
+
+
+class FittedPrompt:
+    """A prompt built within a model's budget, with what was projected for it."""
+
+    __slots__ = ("text", "model", "projected_tokens", "article_tokens", "kept_tokens", "max_tokens")
+
+    def __init__(self, text, model, projected_tokens, article_tokens, kept_tokens, max_tokens):
+        self.text = text
+        self.model = model
+        self.projected_tokens = projected_tokens
+        self.article_tokens = article_tokens
+        self.kept_tokens = kept_tokens
+        self.max_tokens = max_tokens
+
+    @property
+    def trimmed(self):
+        return self.kept_tokens < self.article_tokens
+
+
+def fit_prompt(template, text, model, system_prompt, *args):
+    """
+    Build `template(text, *args)` so the whole request fits the model's input budget.
+
+    Only the article (`text`) is trimmed; the system prompt, the template and
+    the other arguments (bias levels, image context) are always kept.
+    """
+    input_budget, output_budget = model_budget(model)
+    counter = token_counter(model)
+    overhead = (counter.count(system_prompt) + counter.count(template("", *args))
+                + 2 * TOKENS_PER_MESSAGE + REPLY_TOKENS)
+    article_tokens = counter.count(text)
+    fitted, kept_tokens = fit_text(text, input_budget - overhead, counter)
+    return FittedPrompt(template(fitted, *args), model, overhead + kept_tokens, article_tokens, kept_tokens,
+                        output_budget)
+
+def prompt_version(template_version, model, max_tokens=None):
+    """
+    Completion cache version: budget changes alter the prompt or the length of
+    the answer, so they must not reuse old answers. `max_tokens` is the output
+    limit actually sent, when it is not the model's output budget.
+    """
+    input_budget, output_budget = model_budget(model)
+    return f"{template_version}|in{input_budget}|out{max_tokens or output_budget}"
+
+
+class PromptUsage:
+    """Projected against actual prompt tokens per model, as reported by OpenAI."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models = {}
+
+    def record(self, prompt, usage):
+        actual = getattr(usage, "prompt_tokens", None)
+        logger.info("%s prompt tokens: projected %d, actual %s, article %d -> %d",
+                    prompt.model, prompt.projected_tokens, actual, prompt.article_tokens, prompt.kept_tokens)
+        with self._lock:
+            stats = self._models.setdefault(prompt.model, {
+                "requests": 0, "trimmed": 0, "projected_tokens": 0, "actual_tokens": 0, "measured": 0, "abs_error": 0,
+            })
+            stats["requests"] += 1
+            stats["trimmed"] += prompt.trimmed
+            stats["projected_tokens"] += prompt.projected_tokens
+            if actual is not None:
+                stats["measured"] += 1
+                stats["actual_tokens"] += actual
+                stats["abs_error"] += abs(actual - prompt.projected_tokens)
+
+    def stats(self):
+        with self._lock:
+            return {
+                model: {
+                    "requests": s["requests"],
+                    "trimmed": s["trimmed"],
+                    "projected_tokens": s["projected_tokens"],
+                    "actual_tokens": s["actual_tokens"],
+                    "mean_abs_error": round(s["abs_error"] / s["measured"], 1) if s["measured"] else None,
+                }
+                for model, s in self._models.items()
+            }
+
+
+prompt_usage = PromptUsage()
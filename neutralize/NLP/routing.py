@@ -0,0 +1,97 @@
+import logging
+import os
+import threading
+from collections import Counter
+
+from dotenv import load_dotenv
+
+from .prompting import MODEL_BUDGETS, model_budget, token_counter
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Which OpenAI model rewrites/explains a text:
+#   cost   - mixed texts go to the strong model unless the article is longer than
+#            the caller's tier allows for it (default)
+#   legacy - mixed texts go to the strong model whatever their length
+#   cheap / strong - always that model
+ROUTING_POLICY = os.getenv("ROUTING_POLICY", "cost")
+ROUTING_CHEAP_MODEL = os.getenv("ROUTING_CHEAP_MODEL", "gpt-3.5-turbo")
+ROUTING_STRONG_MODEL = os.getenv("ROUTING_STRONG_MODEL", "gpt-4")
+# A text is "mixed" when the classifier gives Middle at least this probability.
+# Clearly one-sided texts are easy to neutralize; mixed ones need more nuance.
+ROUTING_MIDDLE_THRESHOLD = float(os.getenv("ROUTING_MIDDLE_THRESHOLD", "0.3"))
+# Longest article (in tokens) sent to the strong model, per user tier. Capped
+# at the strong model's input budget less ROUTING_PROMPT_RESERVE, the tokens
+# kept for the system prompt, the template, the bias levels and the image context,
+# so an article routed to the strong model is never trimmed there.
+ROUTING_STRONG_MAX_TOKENS = {
+    "standard": int(os.getenv("ROUTING_STRONG_MAX_TOKENS_STANDARD", "1500")),
+    "premium": int(os.getenv("ROUTING_STRONG_MAX_TOKENS_PREMIUM", "3500")),
+}
+ROUTING_PROMPT_RESERVE = int(os.getenv("ROUTING_PROMPT_RESERVE", "500"))
+# Users on the premium tier, besides superusers (comma separated usernames)
+PREMIUM_USERS = {u.strip() for u in os.getenv("PREMIUM_USERS", "").split(",") if u.strip()}
+
+_routes = Counter()
+_routes_lock = threading.Lock()
+
+
+def preload_token_counters():
+    """Build the token counters for every budgeted and routed model, so no request loads a tokenizer."""
+    for model in {*MODEL_BUDGETS, ROUTING_CHEAP_MODEL, ROUTING_STRONG_MODEL}:
+        token_counter(model)
+    room = strong_article_room()
+    for tier, limit in ROUTING_STRONG_MAX_TOKENS.items():
+        if limit > room:
+            logger.warning("ROUTING_STRONG_MAX_TOKENS_%s (%d) exceeds the %d article tokens %s has room for; "
+                           "using %d", tier.upper(), limit, room, ROUTING_STRONG_MODEL, room)
+
+def strong_article_room():
+    """Article tokens the strong model takes without trimming: its input budget less the prompt reserve."""
+    return max(0, model_budget(ROUTING_STRONG_MODEL)[0] - ROUTING_PROMPT_RESERVE)
+
+def strong_max_tokens(tier):
+    return min(ROUTING_STRONG_MAX_TOKENS[tier], strong_article_room())
+
+def user_tier(user):
+    if user is not None and (user.is_superuser or user.username in PREMIUM_USERS):
+        return "premium"
+    return "standard"
+
+def route(text, bias_level, user=None):
+    """
+    Pick the model for a completion. Returns (model, reason).
+
+    Parameters:
+    text (str): The article that will be sent.
+    bias_level (dict): Classifier probabilities for 'Left', 'Middle' and 'Right'.
+    user (TokenData): The caller, whose tier bounds how much strong-model text they get.
+    """
+    if ROUTING_POLICY in ("cheap", "strong"):
+        return (ROUTING_CHEAP_MODEL if ROUTING_POLICY == "cheap" else ROUTING_STRONG_MODEL), "policy"
+    if bias_level["Middle"] < ROUTING_MIDDLE_THRESHOLD:
+        return ROUTING_CHEAP_MODEL, "one_sided"
+    if ROUTING_POLICY == "legacy":
+        return ROUTING_STRONG_MODEL, "mixed"
+    if token_counter(ROUTING_STRONG_MODEL).count(text) > strong_max_tokens(user_tier(user)):
+        return ROUTING_CHEAP_MODEL, "too_long_for_tier"
+    return ROUTING_STRONG_MODEL, "mixed"
+
+def choose_model(text, bias_level, user=None):
+    """
+    route() plus a count of the decision for /api/stats/routing. Tokenizes the
+    text, so async callers run it through run_blocking.
+    """
+    model, reason = route(text, bias_level, user)
+    with _routes_lock:
+        _routes[(user_tier(user), model, reason)] += 1
+    return model
+
+def routing_stats():
+    with _routes_lock:
+        routes = [{"tier": tier, "model": model, "reason": reason, "requests": count}
+                  for (tier, model, reason), count in sorted(_routes.items())]
+    return {"policy": ROUTING_POLICY, "strong_max_tokens": {tier: strong_max_tokens(tier) for tier in ROUTING_STRONG_MAX_TOKENS},
+            "routes": routes}
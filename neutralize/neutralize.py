@@ -1,90 +1,135 @@
-from fastapi import HTTPException, Depends, File, UploadFile, Form
-from fastapi.responses import JSONResponse
+from fastapi import HTTPException, Depends, File, UploadFile, Form, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi import APIRouter
 
-import io, os
+import json, math, os
 
-from neutralize.NLP import reduce_bias, multicon_GPT_ana, GPT_ana
-from neutralize.reinforced import NLP_ana
+from neutralize.NLP import reduce_bias_async, multicon_GPT_ana_async, GPT_ana_async
+from neutralize.NLP import reduce_bias_stream, multicon_GPT_ana_stream
+from neutralize.NLP.routing import choose_model
+from neutralize.reinforced import NLP_ana_cached, NLP_ana_long, NLP_ana_many, TextTooLong, reinforce_learning
+from neutralize.reinforced.nlp_model import BATCH_CHUNK_SIZE
+from neutralize.streaming import stream_completion
+from neutralize.uploads import read_image_upload
 
-from schemas import BiasRequest, TextRequest, NeuReason, User, UserResponse
+from schemas import BiasRequest, TextRequest, LongTextRequest, FeedbackRequest, NeuReason, TokenData, User, UserResponse
 from service.jwttoken import create_access_token
 from service.oauth import get_current_user
 from service.hashing import Hash
-from database import conn
-from models import Users
+from service.executor import concurrency_limit, endpoint_limiter, run_blocking
+from service.ratelimit import charge, rate_limit
+from service.tracing import span
 
 # Create API router for neutral endpoints and enforce authorization
 neu = APIRouter()
 
-@neu.post("/gpt_analyze/", dependencies=[Depends(get_current_user)])
+@neu.post("/gpt_analyze/", dependencies=[Depends(get_current_user), Depends(rate_limit("gpt_analyze")), Depends(concurrency_limit("gpt_analyze"))])
 async def analyze_bias_endpoint(request: BiasRequest):
     try:
-        explanation = GPT_ana(request.text, request.bias_level)
+        explanation = await GPT_ana_async(request.text, request.bias_level)
         return {"explanation": explanation}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@neu.post("/analyze/", dependencies=[Depends(get_current_user)])
+@neu.post("/analyze/", dependencies=[Depends(get_current_user), Depends(rate_limit("analyze")), Depends(concurrency_limit("analyze"))])
 async def analyze_bias(request: TextRequest):
     try:
-        bias_result = NLP_ana(request.text)
+        bias_result = await NLP_ana_cached(request.text)
         return {"bias_analysis": bias_result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@neu.post("/analyze_mult/", dependencies=[Depends(get_current_user)])
+ANALYZE_BATCH_MAX_ITEMS = int(os.getenv("ANALYZE_BATCH_MAX_ITEMS", "10000"))
+
+def parse_batch_body(body: bytes, content_type: str):
+    """Texts from a JSON body ({"texts": [...]} or a bare list) or NDJSON (one string or {"text": ...} per line)."""
+    if "ndjson" in content_type or "jsonl" in content_type:
+        items = [json.loads(line) for line in body.splitlines() if line.strip()]
+    else:
+        items = json.loads(body)
+        if isinstance(items, dict):
+            items = items.get("texts")
+    if not isinstance(items, list):
+        raise ValueError("Expected a list of texts")
+    texts = [item.get("text") if isinstance(item, dict) else item for item in items]
+    if not all(isinstance(text, str) for text in texts):
+        raise ValueError("Every item must be a string or an object with a 'text' string")
+    return texts
+
+@neu.post("/analyze_batch", dependencies=[Depends(get_current_user), Depends(rate_limit("analyze_batch"))])
+async def analyze_bias_batch(request: Request, current_user: TokenData = Depends(get_current_user)):
+    try:
+        texts = parse_batch_body(await request.body(), request.headers.get("content-type", ""))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if len(texts) > ANALYZE_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {ANALYZE_BATCH_MAX_ITEMS} texts per batch")
+    # rate_limit charged the first chunk; the rest are charged now that the size is known
+    extra_chunks = math.ceil(len(texts) / BATCH_CHUNK_SIZE) - 1
+    if extra_chunks > 0:
+        charge(current_user.username, "analyze_batch", extra_chunks)
+
+    async def results():
+        # The limiter is held while streaming, not just until the handler returns
+        async with endpoint_limiter("analyze_batch"):
+            try:
+                async for index, bias_result in NLP_ana_many(texts):
+                    yield json.dumps({"index": index, "bias_analysis": bias_result}) + "\n"
+            except Exception as e:
+                yield json.dumps({"error": str(e)}) + "\n"
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+@neu.post("/analyze_long/", dependencies=[Depends(get_current_user), Depends(rate_limit("analyze_long")), Depends(concurrency_limit("analyze_long"))])
+async def analyze_bias_long(request: LongTextRequest):
+    try:
+        # Score the whole article with overlapping windows instead of truncating it
+        return await run_blocking(NLP_ana_long, request.text, request.strategy, request.return_chunks)
+    except TextTooLong as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@neu.post("/feedback", dependencies=[Depends(get_current_user), Depends(rate_limit("feedback"))])
+async def submit_feedback(request: FeedbackRequest):
+    try:
+        # Only queued here; the background trainer does the fine-tuning
+        return await run_blocking(reinforce_learning, request.text, request.label)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@neu.post("/analyze_mult/", dependencies=[Depends(get_current_user), Depends(rate_limit("analyze_mult")), Depends(concurrency_limit("analyze_mult"))])
 async def analyze_bias_mult(request: TextRequest):
     try:
-        # Analyze bias using NLP_ana
-        bias_result = NLP_ana(request.text)
+        # Analyze bias using NLP_ana (cached, micro-batched)
+        bias_result = await NLP_ana_cached(request.text)
 
         # Analyze text bias using GPT
-        explanation = GPT_ana(request.text, bias_result)
+        explanation = await GPT_ana_async(request.text, bias_result)
         return {"bias_analysis": bias_result, "explanation": explanation}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-UPLOAD_DIR = "uploaded_images"
-os.makedirs(UPLOAD_DIR, exist_ok=True)  # Create directory if it doesn't exist
-
-@neu.post("/reduce_bias", dependencies=[Depends(get_current_user)])
+@neu.post("/reduce_bias", dependencies=[Depends(get_current_user), Depends(rate_limit("reduce_bias")), Depends(concurrency_limit("reduce_bias"))])
 async def reduce_bias_endpoint(
-    text: str = Form(...), image: UploadFile = File(None)
+    text: str = Form(...), image: UploadFile = File(None), current_user: TokenData = Depends(get_current_user)
 ):
     try:
         # Analyze bias from the text
-        bias_level = NLP_ana(text)
-
-        image_path = None
-        if image:
-            allowed_extensions = {".jpg", ".jpeg", ".png", ".webp"}
-            ext = os.path.splitext(image.filename)[-1].lower()
-            if ext not in allowed_extensions:
-                raise HTTPException(status_code=400, detail=f"Invalid image format: {ext}")
-
-            image_bytes = await image.read()  # Read image as binary
-            image_path = os.path.join(UPLOAD_DIR, image.filename)
-
-            # Save the image to disk
-            with open(image_path, "wb") as f:
-                f.write(image_bytes)
+        bias_level = await NLP_ana_cached(text)
 
-            if not os.path.exists(image_path):
-                raise HTTPException(status_code=500, detail=f"Failed to save image: {image.filename}")
+        # Decode the upload in memory; nothing is written to disk
+        with span("upload"):
+            pil_image = await read_image_upload(image) if image else None
 
-        # Choose model based on bias level
-        model = "gpt-3.5-turbo" if bias_level["Middle"] < 0.3 else "gpt-4"
+        # Choose model based on bias level, article length and the caller's tier
+        model = await run_blocking(choose_model, text, bias_level, current_user)
 
         try:
             # Process the image and text for bias reduction
-            neutral_text, mulcont = reduce_bias(text, bias_level, image_path, model)
+            neutral_text, mulcont = await reduce_bias_async(text, bias_level, pil_image, model)
         except Exception as processing_error:
             raise HTTPException(status_code=500, detail=f"Error processing bias reduction: {str(processing_error)}")
-        finally:
-            # Delete the image file after processing (if it exists)
-            if image_path and os.path.exists(image_path):
-                os.remove(image_path)
 
         return JSONResponse(
             content={
@@ -95,60 +140,44 @@ async def reduce_bias_endpoint(
             }
         )
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@neu.post("/reduce_bias_txt", dependencies=[Depends(get_current_user)])
-async def reduce_bias_only_txt_endpoint(request: TextRequest):
+@neu.post("/reduce_bias_txt", dependencies=[Depends(get_current_user), Depends(rate_limit("reduce_bias_txt")), Depends(concurrency_limit("reduce_bias_txt"))])
+async def reduce_bias_only_txt_endpoint(request: TextRequest, current_user: TokenData = Depends(get_current_user)):
     try:
         text = request.text
-        bias_level = NLP_ana(text)
-        model = "gpt-3.5-turbo" if bias_level['Middle'] < 0.3 else "gpt-4"
-        image_path = None
+        bias_level = await NLP_ana_cached(text)
+        model = await run_blocking(choose_model, text, bias_level, current_user)
         
-        neutral_text = reduce_bias(text, bias_level, image_path, model)
+        neutral_text, _ = await reduce_bias_async(text, bias_level, None, model)
         return {"original_text": text, "bias_analysis": bias_level, "neutral_text": neutral_text}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@neu.post("/multicon_bias_ana", dependencies=[Depends(get_current_user)])
+@neu.post("/multicon_bias_ana", dependencies=[Depends(get_current_user), Depends(rate_limit("multicon_bias_ana")), Depends(concurrency_limit("multicon_bias_ana"))])
 async def reduce_bias_endpoint(
-    text: str = Form(...), image: UploadFile = File(None)
+    text: str = Form(...), image: UploadFile = File(None), current_user: TokenData = Depends(get_current_user)
 ):
     try:
         # Analyze bias from the text
-        bias_level = NLP_ana(text)
+        bias_level = await NLP_ana_cached(text)
 
-        image_path = None
-        if image:
-            allowed_extensions = {".jpg", ".jpeg", ".png", ".webp"}
-            ext = os.path.splitext(image.filename)[-1].lower()
-            if ext not in allowed_extensions:
-                raise HTTPException(status_code=400, detail=f"Invalid image format: {ext}")
+        # Decode the upload in memory; nothing is written to disk
+        with span("upload"):
+            pil_image = await read_image_upload(image) if image else None
 
-            image_bytes = await image.read()  # Read image as binary
-            image_path = os.path.join(UPLOAD_DIR, image.filename)
-
-            # Save the image to disk
-            with open(image_path, "wb") as f:
-                f.write(image_bytes)
-
-            if not os.path.exists(image_path):
-                raise HTTPException(status_code=500, detail=f"Failed to save image: {image.filename}")
-
-        # Choose model based on bias level
-        model = "gpt-3.5-turbo" if bias_level["Middle"] < 0.3 else "gpt-4"
+        # Choose model based on bias level, article length and the caller's tier
+        model = await run_blocking(choose_model, text, bias_level, current_user)
 
         try:
             # Process the image and text for bias reduction
-            neutral_text, mulcont = multicon_GPT_ana(text, bias_level, image_path, model)
+            neutral_text, mulcont = await multicon_GPT_ana_async(text, bias_level, pil_image, model)
         except Exception as processing_error:
             raise HTTPException(status_code=500, detail=f"Error processing bias reduction: {str(processing_error)}")
-        finally:
-            # Delete the image file after processing (if it exists)
-            if image_path and os.path.exists(image_path):
-                os.remove(image_path)
 
         return JSONResponse(
             content={
@@ -159,5 +188,47 @@ async def reduce_bias_endpoint(
             }
         )
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+# Server-sent event variants: the bias scores are sent as soon as they are
+# computed, then the completion token by token (see neutralize/streaming.py)
+@neu.post("/reduce_bias_txt/stream", dependencies=[Depends(get_current_user), Depends(rate_limit("reduce_bias_txt", stream=True))])
+async def reduce_bias_txt_stream(request: TextRequest, current_user: TokenData = Depends(get_current_user)):
+    async def complete(bias_level):
+        model = await run_blocking(choose_model, request.text, bias_level, current_user)
+        async for item in reduce_bias_stream(request.text, bias_level, None, model):
+            yield item
+
+    return stream_completion("reduce_bias_txt", request.text, NLP_ana_cached, complete)
+
+@neu.post("/reduce_bias/stream", dependencies=[Depends(get_current_user), Depends(rate_limit("reduce_bias", stream=True))])
+async def reduce_bias_stream_endpoint(
+    text: str = Form(...), image: UploadFile = File(None), current_user: TokenData = Depends(get_current_user)
+):
+    # The upload is decoded before streaming starts so a bad image is still a 400/413
+    with span("upload"):
+        pil_image = await read_image_upload(image) if image else None
+
+    async def complete(bias_level):
+        model = await run_blocking(choose_model, text, bias_level, current_user)
+        async for item in reduce_bias_stream(text, bias_level, pil_image, model):
+            yield item
+
+    return stream_completion("reduce_bias", text, NLP_ana_cached, complete)
+
+@neu.post("/multicon_bias_ana/stream", dependencies=[Depends(get_current_user), Depends(rate_limit("multicon_bias_ana", stream=True))])
+async def multicon_bias_ana_stream(
+    text: str = Form(...), image: UploadFile = File(None), current_user: TokenData = Depends(get_current_user)
+):
+    with span("upload"):
+        pil_image = await read_image_upload(image) if image else None
+
+    async def complete(bias_level):
+        model = await run_blocking(choose_model, text, bias_level, current_user)
+        async for item in multicon_GPT_ana_stream(text, bias_level, pil_image, model):
+            yield item
+
+    return stream_completion("multicon_bias_ana", text, NLP_ana_cached, complete)
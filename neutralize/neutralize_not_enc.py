@@ -11,7 +11,7 @@ from pydantic import BaseModel
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
 import torch
 from neutralize.NLP.GPT_ana import GPT_ana
-from neutralize.NLP.nlp_model import NLP_ana
+from neutralize.reinforced import NLP_ana
 from neutralize.NLP.multimo import reduce_bias, multicon_GPT_ana
 
 from schemas import BiasRequest, TextRequest, NeuReason
@@ -0,0 +1,101 @@
+import os
+import threading
+import time
+
+import torch
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Determine available device: cuda > mps > cpu
+device = torch.device("cuda" if torch.cuda.is_available()
+                      else "mps" if hasattr(torch.backends, "mps") and torch.backends.mps.is_available()
+                      else "cpu")
+print(f"Using device: {device.type.upper()} ({torch.cuda.get_device_name(device) if device.type == 'cuda' else 'N/A'})")
+
+# Comma separated model names to load at startup, "*" for all of them.
+# Anything not listed is loaded the first time a request needs it.
+PRELOAD_MODELS = [name.strip() for name in os.getenv("PRELOAD_MODELS", "").split(",") if name.strip()]
+
+
+def _module_bytes(obj):
+    """Parameter and buffer bytes of every torch module or tensor in `obj` (a single item or a tuple)."""
+    items = obj if isinstance(obj, (tuple, list)) else (obj,)
+    total = 0
+    for item in items:
+        if isinstance(item, torch.nn.Module):
+            total += sum(p.numel() * p.element_size() for p in item.parameters())
+            total += sum(b.numel() * b.element_size() for b in item.buffers())
+        elif isinstance(item, torch.Tensor):
+            total += item.numel() * item.element_size()
+        elif hasattr(item, "nbytes"):
+            total += item.nbytes
+    return total
+
+
+class ModelRegistry:
+    """
+    Lazily loaded, process-wide model instances.
+
+    Modules register a loader under a name at import time, which is cheap.
+    The loader only runs on the first `get(name)`, and every caller after that
+    shares the same instance.
+    """
+
+    def __init__(self):
+        self._loaders = {}
+        self._instances = {}
+        self._locks = {}
+        self._stats = {}
+
+    def register(self, name, loader):
+        self._loaders[name] = loader
+        self._locks.setdefault(name, threading.Lock())
+
+    def names(self):
+        return list(self._loaders)
+
+    def is_loaded(self, name):
+        return name in self._instances
+
+    def get(self, name):
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+        if name not in self._loaders:
+            raise KeyError(f"No model registered under '{name}'")
+        with self._locks[name]:
+            # Another thread may have finished loading while we waited
+            if name not in self._instances:
+                start = time.perf_counter()
+                instance = self._loaders[name]()
+                self._stats[name] = {
+                    "load_seconds": round(time.perf_counter() - start, 3),
+                    "memory_mb": round(_module_bytes(instance) / 2**20, 1),
+                }
+                self._instances[name] = instance
+        return self._instances[name]
+
+    def swap(self, name, instance):
+        """Atomically replace a loaded instance; callers already holding the old one finish with it."""
+        with self._locks[name]:
+            self._instances[name] = instance
+            stats = self._stats.setdefault(name, {})
+            stats["memory_mb"] = round(_module_bytes(instance) / 2**20, 1)
+            stats["swaps"] = stats.get("swaps", 0) + 1
+
+    def preload(self, names=None):
+        names = PRELOAD_MODELS if names is None else names
+        if "*" in names:
+            names = self.names()
+        for name in names:
+            self.get(name)
+
+    def stats(self):
+        return {
+            name: {"loaded": self.is_loaded(name), **self._stats.get(name, {})}
+            for name in self._loaders
+        }
+
+
+registry = ModelRegistry()
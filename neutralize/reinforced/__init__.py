@@ -1,3 +1,5 @@
-from .nlp_model import NLP_ana
+from .nlp_model import NLP_ana, NLP_ana_batch, NLP_ana_long, NLP_ana_cached, NLP_ana_many, bias_batcher
+from .nlp_model import reinforce_learning, watch_checkpoints, TextTooLong
 
-__all__ = ["NLP_ana"]
\ No newline at end of file
+__all__ = ["NLP_ana", "NLP_ana_batch", "NLP_ana_long", "NLP_ana_cached", "NLP_ana_many", "bias_batcher",
+           "reinforce_learning", "watch_checkpoints", "TextTooLong"]
\ No newline at end of file
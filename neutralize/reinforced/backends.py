@@ -0,0 +1,172 @@
+import copy
+import hashlib
+import inspect
+import os
+
+import torch
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Inference backend for the bias classifier: "torch" (fp32 eager), "int8"
+# (dynamically quantized Linear layers) or "onnx" (ONNX Runtime, needs the
+# optional onnxruntime package). int8 and onnx always run on the CPU.
+BIAS_BACKEND = os.getenv("BIAS_BACKEND", "torch")
+# ONNX Runtime threads per worker process; 0 lets ONNX Runtime decide
+ORT_INTRA_OP_THREADS = int(os.getenv("ORT_INTRA_OP_THREADS", "0"))
+ORT_INTER_OP_THREADS = int(os.getenv("ORT_INTER_OP_THREADS", "0"))
+ONNX_CACHE_DIR = os.getenv("ONNX_CACHE_DIR", ".cache/onnx")
+ONNX_OPSET = 17
+# Largest allowed difference in any Left/Middle/Right probability against the
+# fp32 model before a backend is rejected and fp32 is used instead
+BIAS_PARITY_TOLERANCE = float(os.getenv("BIAS_PARITY_TOLERANCE", "0.05"))
+
+PARITY_TEXTS = [
+    "The government should raise taxes on the wealthy to fund universal healthcare.",
+    "Lower taxes and less regulation are the best way to grow the economy.",
+    "The city council met on Tuesday to discuss the new budget.",
+    "Border security must come first before any immigration reform is considered.",
+    "Climate change demands immediate action and a rapid move away from fossil fuels.",
+    "Both parties claimed victory after the election results were announced.",
+]
+
+
+class TorchBackend:
+    """Eager PyTorch model; `backend(inputs)` returns the logits for a tokenizer batch."""
+
+    name = "torch"
+
+    def __init__(self, model, device):
+        self.model = model.to(device).eval()
+        self.device = device
+
+    def __call__(self, inputs):
+        inputs = {k: v.to(self.device) for k, v in inputs.items()}
+        with torch.no_grad():
+            return self.model(**inputs).logits
+
+    @property
+    def nbytes(self):
+        return sum(p.numel() * p.element_size() for p in self.model.parameters())
+
+
+class Int8Backend(TorchBackend):
+    """Linear layers quantized to int8 with per-batch activation scales, CPU only."""
+
+    name = "int8"
+
+    def __init__(self, model):
+        model = copy.deepcopy(model).cpu().eval()
+        super().__init__(torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8),
+                         torch.device("cpu"))
+
+    @property
+    def nbytes(self):
+        # Packed int8 weights live in the state dict, not in parameters()
+        total = 0
+        for value in self.model.state_dict().values():
+            for tensor in value if isinstance(value, tuple) else (value,):
+                if isinstance(tensor, torch.Tensor):
+                    total += tensor.numel() * tensor.element_size()
+        return total
+
+
+class OnnxBackend:
+    """
+    The model exported to ONNX and run by ONNX Runtime on the CPU.
+
+    The export is cached under ONNX_CACHE_DIR, keyed by `source`, so only
+    the first worker to load a given set of weights pays for it.
+    """
+
+    name = "onnx"
+
+    def __init__(self, model, tokenizer, source, cache_dir=ONNX_CACHE_DIR,
+                 intra_op_threads=ORT_INTRA_OP_THREADS, inter_op_threads=ORT_INTER_OP_THREADS):
+        try:
+            import onnxruntime
+        except ImportError:
+            raise RuntimeError("BIAS_BACKEND=onnx needs onnxruntime: pip install onnxruntime")
+
+        self.path = self.export(model, tokenizer, source, cache_dir)
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(self.path, options, providers=["CPUExecutionProvider"])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    @staticmethod
+    def export(model, tokenizer, source, cache_dir=ONNX_CACHE_DIR):
+        digest = hashlib.sha256(f"{source}|{ONNX_OPSET}".encode()).hexdigest()[:16]
+        path = os.path.join(cache_dir, f"{digest}.onnx")
+        if os.path.exists(path):
+            return path
+
+        model = copy.deepcopy(model).cpu().eval()
+        sample = tokenizer(["sample text", "a second, longer sample text"], return_tensors="pt", padding=True)
+        # Positional inputs in forward() order, so graph input names match what they carry
+        names = [name for name in inspect.signature(model.forward).parameters if name in sample]
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write then rename so a crash or a concurrent worker never sees a partial file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with torch.no_grad():
+            torch.onnx.export(
+                model, tuple(sample[name] for name in names), tmp_path,
+                input_names=names, output_names=["logits"],
+                dynamic_axes={**{name: {0: "batch", 1: "sequence"} for name in names}, "logits": {0: "batch"}},
+                opset_version=ONNX_OPSET, dynamo=False,
+            )
+        os.replace(tmp_path, path)
+        return path
+
+    def __call__(self, inputs):
+        feed = {name: inputs[name].cpu().numpy() for name in self.input_names}
+        return torch.from_numpy(self.session.run(["logits"], feed)[0])
+
+    @property
+    def nbytes(self):
+        return os.path.getsize(self.path)
+
+
+BACKENDS = ("torch", "int8", "onnx")
+
+def create_backend(name, model, tokenizer, source, device):
+    if name == "torch":
+        return TorchBackend(model, device)
+    if name == "int8":
+        return Int8Backend(model)
+    if name == "onnx":
+        return OnnxBackend(model, tokenizer, source)
+    raise ValueError(f"Unknown bias backend '{name}', expected one of {BACKENDS}")
+
+
+def probabilities(backend, tokenizer, texts):
+    inputs = tokenizer(list(texts), return_tensors="pt", padding=True, truncation=True, max_length=512)
+    return backend(dict(inputs)).float().softmax(dim=-1).cpu()
+
+def parity_report(reference, candidate):
+    """Compare [n, 3] probability tensors of the fp32 model and another backend."""
+    return {
+        "max_abs_diff": round((reference - candidate).abs().max().item(), 6),
+        "label_agreement": (reference.argmax(dim=-1) == candidate.argmax(dim=-1)).float().mean().item(),
+    }
+
+def build_backend(name, model, tokenizer, source, device, texts=PARITY_TEXTS, tolerance=BIAS_PARITY_TOLERANCE):
+    """
+    Wrap an fp32 model in the requested backend after checking its outputs against fp32.
+
+    If the backend's probabilities differ by more than `tolerance` on `texts`,
+    the fp32 model is served instead. The report is kept on `backend.parity`.
+    """
+    if name == "torch":
+        return TorchBackend(model, device)
+
+    reference = probabilities(TorchBackend(model, torch.device("cpu")), tokenizer, texts)
+    backend = create_backend(name, model, tokenizer, source, device)
+    backend.parity = parity_report(reference, probabilities(backend, tokenizer, texts))
+    print(f"Bias classifier {name} backend parity: {backend.parity}")
+    if backend.parity["max_abs_diff"] > tolerance:
+        print(f"Bias classifier {name} backend exceeds BIAS_PARITY_TOLERANCE={tolerance}, using torch instead")
+        return TorchBackend(model, device)
+    return backend
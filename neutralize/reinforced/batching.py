@@ -0,0 +1,120 @@
+import asyncio
+import os
+from collections import Counter
+
+from dotenv import load_dotenv
+
+from service.executor import model_pool
+
+load_dotenv()
+
+MAX_BATCH_SIZE = int(os.getenv("NLP_MAX_BATCH_SIZE", "16"))
+MAX_WAIT_MS = float(os.getenv("NLP_MAX_WAIT_MS", "5"))
+
+
+class BatchEngine:
+    """
+    Collect concurrent inference requests into padded batches.
+
+    Callers await `submit(text)`. A single worker task pulls the first queued
+    request, keeps collecting for up to `max_wait_ms` (or until `max_batch_size`
+    requests are gathered) and hands the whole batch to `infer_fn`, which must
+    take a list of texts and return one result per text in the same order.
+
+    Parameters:
+    infer_fn (callable): Batched inference function, list[str] -> list[result].
+    max_batch_size (int): Upper bound on the number of texts per forward pass.
+    max_wait_ms (float): How long the first request in a batch waits for company.
+    """
+
+    def __init__(self, infer_fn, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS):
+        self.infer_fn = infer_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait_ms = max(0.0, float(max_wait_ms))
+
+        self._loop = None
+        self._queue = None
+        self._worker = None
+
+        # Exposed through stats()
+        self.batch_sizes = Counter()
+        self.queue_depths = Counter()
+        self.requests = 0
+        self.batches = 0
+        self.errors = 0
+
+    def _ensure_worker(self):
+        loop = asyncio.get_running_loop()
+        # The queue is bound to the loop that created it, so rebuild it if we
+        # are now running under a different one (e.g. a fresh test client).
+        if self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = None
+        if self._worker is None or self._worker.done():
+            self._worker = loop.create_task(self._run())
+
+    async def submit(self, text):
+        """Queue a single text and wait for its result."""
+        self._ensure_worker()
+        future = self._loop.create_future()
+        self.requests += 1
+        await self._queue.put((text, future))
+        return await future
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        deadline = self._loop.time() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            # Anything already waiting is taken without further delay
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - self._loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            self.queue_depths[self._queue.qsize()] += 1
+
+            # Drop callers that went away while waiting (client disconnects)
+            batch = [(text, future) for text, future in batch if not future.cancelled()]
+            if not batch:
+                continue
+
+            self.batches += 1
+            self.batch_sizes[len(batch)] += 1
+            texts = [text for text, _ in batch]
+            try:
+                results = await self._loop.run_in_executor(model_pool, self.infer_fn, texts)
+            except Exception as e:
+                self.errors += 1
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def stats(self):
+        """Return counters plus queue depth and batch size histograms."""
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "requests": self.requests,
+            "batches": self.batches,
+            "errors": self.errors,
+            "avg_batch_size": (sum(k * v for k, v in self.batch_sizes.items()) / self.batches) if self.batches else 0.0,
+            "batch_size_histogram": dict(sorted(self.batch_sizes.items())),
+            "queue_depth_histogram": dict(sorted(self.queue_depths.items())),
+        }
@@ -0,0 +1,66 @@
+import logging
+import os
+import re
+import shutil
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Fine-tuned bias classifier checkpoints published by the trainer
+RL_CHECKPOINT_DIR = os.getenv("RL_CHECKPOINT_DIR", ".cache/checkpoints")
+# Published versions kept on disk; older ones are deleted after each publish.
+# More than one, so workers still loading the previous version can finish.
+RL_KEEP_CHECKPOINTS = max(1, int(os.getenv("RL_KEEP_CHECKPOINTS", "3")))
+LATEST_FILE = "LATEST"
+VERSION_PATTERN = re.compile(r"^\d{8}-\d{6}-\d{3}$")
+
+
+def latest_checkpoint(checkpoint_dir=RL_CHECKPOINT_DIR):
+    """Return (version, path) of the most recently published checkpoint, or None."""
+    try:
+        with open(os.path.join(checkpoint_dir, LATEST_FILE)) as f:
+            version = f.read().strip()
+    except FileNotFoundError:
+        return None
+    path = os.path.join(checkpoint_dir, version)
+    if not version or not os.path.isdir(path):
+        return None
+    return version, path
+
+def publish_checkpoint(model, tokenizer, checkpoint_dir=RL_CHECKPOINT_DIR):
+    """
+    Save a model and make it the latest checkpoint.
+
+    The weights are fully written before LATEST is replaced, so readers
+    never see a partially saved checkpoint.
+    """
+    now = time.time()
+    version = time.strftime("%Y%m%d-%H%M%S", time.gmtime(now)) + f"-{int(now * 1000) % 1000:03d}"
+    path = os.path.join(checkpoint_dir, version)
+    model.save_pretrained(path)
+    tokenizer.save_pretrained(path)
+
+    tmp_path = os.path.join(checkpoint_dir, f"{LATEST_FILE}.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as f:
+        f.write(version)
+    os.replace(tmp_path, os.path.join(checkpoint_dir, LATEST_FILE))
+    prune_checkpoints(checkpoint_dir)
+    return version
+
+def prune_checkpoints(checkpoint_dir=RL_CHECKPOINT_DIR, keep=RL_KEEP_CHECKPOINTS):
+    """Delete all but the newest `keep` checkpoint versions, never the one named in LATEST."""
+    latest = latest_checkpoint(checkpoint_dir)
+    versions = sorted((name for name in os.listdir(checkpoint_dir)
+                       if VERSION_PATTERN.match(name) and os.path.isdir(os.path.join(checkpoint_dir, name))),
+                      reverse=True)
+    for version in versions[keep:]:
+        if latest is not None and version == latest[0]:
+            continue
+        try:
+            shutil.rmtree(os.path.join(checkpoint_dir, version))
+        except OSError as e:
+            logger.warning("Could not delete checkpoint %s: %s", version, e)
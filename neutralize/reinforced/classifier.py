@@ -0,0 +1,27 @@
+import os
+
+from dotenv import load_dotenv
+from transformers import AutoModelForSequenceClassification
+
+load_dotenv()
+
+# The one bias classifier used by every route, the multimodal helpers and the
+# trainer. Any sequence classifier with three outputs in this order works.
+MODEL_NAME = os.getenv("BIAS_MODEL_NAME", "bucketresearch/politicalBiasBERT")
+TOKENIZER_NAME = os.getenv("BIAS_TOKENIZER_NAME", "bert-base-cased")
+
+LABELS = ["Left", "Middle", "Right"]
+
+
+def load_classifier_model(source=MODEL_NAME):
+    """
+    Load fp32 weights from a hub name or checkpoint directory.
+
+    Raises RuntimeError when the model's output size does not match LABELS,
+    so a wrong BIAS_MODEL_NAME fails at startup instead of mislabelling scores.
+    """
+    model = AutoModelForSequenceClassification.from_pretrained(source)
+    if model.config.num_labels != len(LABELS):
+        raise RuntimeError(f"Bias classifier {source} has {model.config.num_labels} labels, "
+                           f"expected {len(LABELS)} ({', '.join(LABELS)})")
+    return model.eval()
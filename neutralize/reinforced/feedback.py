@@ -0,0 +1,69 @@
+import os
+import random
+import time
+
+from dotenv import load_dotenv
+from sqlalchemy import func, insert, select, update
+
+from database import engine
+from models import FeedbackQueue
+from .classifier import LABELS
+
+load_dotenv()
+
+# Share of feedback kept out of training and used by the evaluation gate
+RL_HOLDOUT_FRACTION = float(os.getenv("RL_HOLDOUT_FRACTION", "0.1"))
+
+
+def enqueue_feedback(text, label):
+    """Durably queue one labelled sample for the background trainer."""
+    if label not in LABELS:
+        raise ValueError(f"Label must be one of {LABELS}")
+    status = "holdout" if random.random() < RL_HOLDOUT_FRACTION else "pending"
+    with engine.begin() as conn:
+        conn.execute(insert(FeedbackQueue).values(text=text, label=label, status=status, created_at=time.time()))
+    return status
+
+def claim_pending(limit):
+    """Mark up to `limit` of the oldest pending samples as in training and return them."""
+    with engine.begin() as conn:
+        rows = conn.execute(
+            select(FeedbackQueue.c.id, FeedbackQueue.c.text, FeedbackQueue.c.label)
+            .where(FeedbackQueue.c.status == "pending")
+            .order_by(FeedbackQueue.c.id)
+            .limit(limit)
+        ).fetchall()
+        if rows:
+            conn.execute(
+                update(FeedbackQueue)
+                .where(FeedbackQueue.c.id.in_([row.id for row in rows]))
+                .values(status="training")
+            )
+    return rows
+
+def mark_trained(ids):
+    with engine.begin() as conn:
+        conn.execute(
+            update(FeedbackQueue).where(FeedbackQueue.c.id.in_(ids)).values(status="trained", trained_at=time.time())
+        )
+
+def release_claimed():
+    """Return samples left in training by a crashed trainer to the queue."""
+    with engine.begin() as conn:
+        conn.execute(update(FeedbackQueue).where(FeedbackQueue.c.status == "training").values(status="pending"))
+
+def holdout_samples(limit):
+    with engine.begin() as conn:
+        return conn.execute(
+            select(FeedbackQueue.c.text, FeedbackQueue.c.label)
+            .where(FeedbackQueue.c.status == "holdout")
+            .order_by(FeedbackQueue.c.id.desc())
+            .limit(limit)
+        ).fetchall()
+
+def queue_counts():
+    with engine.begin() as conn:
+        rows = conn.execute(
+            select(FeedbackQueue.c.status, func.count()).group_by(FeedbackQueue.c.status)
+        ).fetchall()
+    return {status: count for status, count in rows}
@@ -1,136 +1,222 @@
-from fastapi import FastAPI, HTTPException, Depends
-from pydantic import BaseModel
-from transformers import AutoTokenizer, AutoModelForSequenceClassification, AdamW
+import asyncio
+import os
 import torch
-from db.url_cache import get_db, website_cache
-from sqlalchemy.orm import Session
-from sqlalchemy import select, insert
-
-# Setup device: CUDA > MPS > CPU
-if torch.cuda.is_available():
-    device = torch.device("cuda")
-elif hasattr(torch.backends, "mps") and torch.backends.mps.is_available():
-    device = torch.device("mps")
-else:
-    device = torch.device("cpu")
-print(f"Using device: {device}")
-
-# Initialize FastAPI app
-app = FastAPI()
-
-# Load PoliticalBiasBERT model
-MODEL_NAME = "bucketresearch/politicalBiasBERT"
-tokenizer = AutoTokenizer.from_pretrained("bert-base-cased")
-model = AutoModelForSequenceClassification.from_pretrained(MODEL_NAME).to(device)
-
-# Define input structure
-class TextRequest(BaseModel):
-    url: str
-    title: str
-    text: str
+from dotenv import load_dotenv
+from db.result_cache import bias_cache, text_key
+from neutralize.registry import registry, device
+from neutralize.tokenization import CachedTokenizer, load_fast_tokenizer
+from service.executor import run_blocking
+from service.tracing import span
+from .backends import BIAS_BACKEND, build_backend
+from .batching import MAX_BATCH_SIZE, BatchEngine
+from .classifier import LABELS, MODEL_NAME, TOKENIZER_NAME, load_classifier_model
+from .checkpoints import latest_checkpoint
+from .feedback import enqueue_feedback
+
+load_dotenv()
+
+# The classifier (see classifier.py) is loaded on first use through the shared registry
+# Bump when the weights change so cached results are not reused across versions
+MODEL_VERSION = os.getenv("BIAS_MODEL_VERSION", "1")
+
+# How often serving workers look for a newer checkpoint from the trainer
+RL_RELOAD_SECONDS = float(os.getenv("RL_RELOAD_SECONDS", "60"))
+
+# Version of the fine-tuned checkpoint being served, None for the base weights
+checkpoint_version = None
+
+def load_backend(source, tokenizer):
+    """Load fp32 weights from `source` and wrap them in the BIAS_BACKEND inference backend."""
+    model = load_classifier_model(source)
+    return build_backend(BIAS_BACKEND, model, tokenizer, f"{source}|{MODEL_VERSION}", device)
+
+def load_bias_classifier():
+    global checkpoint_version
+    tokenizer = load_fast_tokenizer(TOKENIZER_NAME)
+    # Start from the trainer's latest published weights when there are any
+    latest = latest_checkpoint()
+    backend = load_backend(latest[1] if latest else MODEL_NAME, tokenizer)
+    checkpoint_version = latest[0] if latest else None
+    return CachedTokenizer(tokenizer, TOKENIZER_NAME), backend
+
+registry.register("bias_classifier", load_bias_classifier)
+
+def current_model_version():
+    """Version string used in cache keys; changes whenever new weights are swapped in."""
+    return f"{MODEL_VERSION}+{checkpoint_version}" if checkpoint_version else MODEL_VERSION
+
+def reload_if_updated():
+    """Hot-swap the serving model when the trainer has published a newer checkpoint."""
+    global checkpoint_version
+    latest = latest_checkpoint()
+    if latest is None or latest[0] == checkpoint_version or not registry.is_loaded("bias_classifier"):
+        return False
+    tokenizer, _ = registry.get("bias_classifier")
+    registry.swap("bias_classifier", (tokenizer, load_backend(latest[1], tokenizer.tokenizer)))
+    checkpoint_version = latest[0]
+    return True
+
+async def watch_checkpoints():
+    """Background task: load new checkpoints in the model pool and swap them in."""
+    while True:
+        await asyncio.sleep(RL_RELOAD_SECONDS)
+        try:
+            if await run_blocking(reload_if_updated):
+                print(f"Bias classifier updated to checkpoint {checkpoint_version}")
+        except Exception as e:
+            print(f"Checkpoint reload failed: {e}")
+
+categories = LABELS
 
 # NLP function
 def NLP_ana(text):
-    inputs = tokenizer(text, return_tensors="pt", truncation=True, max_length=512)
-    # Move input tensors to the selected device
-    inputs = {k: v.to(device) for k, v in inputs.items()}
-    with torch.no_grad():
-        logits = model(**inputs).logits
-        probabilities = logits.softmax(dim=-1)[0].tolist()
+    return NLP_ana_batch([text])[0]
 
-    categories = ["Left", "Middle", "Right"]
-    return {categories[i]: float(probabilities[i]) for i in range(len(categories))}
+def NLP_ana_batch(texts):
+    """
+    Score several texts with one padded forward pass.
+
+    Parameters:
+    - texts (list[str]): The texts to analyze.
+
+    Returns:
+    - list[dict]: One {"Left", "Middle", "Right"} probability dict per text, in input order.
+    """
+    if not texts:
+        return []
+    tokenizer, backend = registry.get("bias_classifier")
+    # Only texts missing from the tokenizer cache are tokenized
+    inputs = tokenizer.encode_batch(texts)
+    # The backend moves the inputs to wherever it runs
+    probabilities = backend(inputs).float().softmax(dim=-1).tolist()
+
+    return [{categories[i]: float(row[i]) for i in range(len(categories))} for row in probabilities]
+
+# Long-document mode: overlapping 512-token windows scored in batches of MAX_BATCH_SIZE
+WINDOW_STRIDE = int(os.getenv("NLP_WINDOW_STRIDE", "128"))  # tokens shared by neighbouring windows
+AGGREGATION_STRATEGIES = ("mean", "length_weighted", "max_confidence")
+# Longest article accepted, checked before tokenizing, and most windows scored for one article
+NLP_MAX_CHARS = int(os.getenv("NLP_MAX_CHARS", "100000"))
+NLP_MAX_WINDOWS = int(os.getenv("NLP_MAX_WINDOWS", "64"))
+
+class TextTooLong(ValueError):
+    pass
+
+def NLP_ana_long(text, strategy="mean", return_chunks=False):
+    """
+    Score a text of any length with overlapping windows instead of truncating at 512 tokens.
+
+    Parameters:
+    - text (str): The article to analyze.
+    - strategy (str): How per-window probabilities are combined: "mean", "length_weighted"
+      (weighted by real tokens per window) or "max_confidence" (the most confident window wins).
+    - return_chunks (bool): Also return the per-window scores with character offsets.
+
+    Returns:
+    - dict: {"bias_analysis": {...}, "num_chunks": int} plus "chunks" when requested.
+    """
+    if strategy not in AGGREGATION_STRATEGIES:
+        raise ValueError(f"Unknown aggregation strategy: {strategy}")
+    if len(text) > NLP_MAX_CHARS:
+        raise TextTooLong(f"Text longer than {NLP_MAX_CHARS} characters")
+
+    tokenizer, backend = registry.get("bias_classifier")
+    with span("tokenize"):
+        inputs = tokenizer.encode_windows(text, WINDOW_STRIDE)
+    offsets = inputs.pop("offset_mapping")
+    num_windows = offsets.shape[0]
+    if num_windows > NLP_MAX_WINDOWS:
+        raise TextTooLong(f"Text needs {num_windows} windows, at most {NLP_MAX_WINDOWS} are scored")
+    # Sub-batches bound the activation memory of a single forward pass
+    with span("bias_forward"):
+        probabilities = torch.cat([
+            backend({name: tensor[i:i + MAX_BATCH_SIZE] for name, tensor in inputs.items()}).float().softmax(dim=-1).cpu()
+            for i in range(0, num_windows, MAX_BATCH_SIZE)
+        ])
+
+    lengths = inputs["attention_mask"].sum(dim=1).float()
+    if strategy == "mean":
+        combined = probabilities.mean(dim=0)
+    elif strategy == "length_weighted":
+        combined = (probabilities * lengths.unsqueeze(1)).sum(dim=0) / lengths.sum()
+    else:
+        combined = probabilities[probabilities.max(dim=1).values.argmax()]
+
+    result = {
+        "bias_analysis": {categories[i]: float(combined[i]) for i in range(len(categories))},
+        "num_chunks": probabilities.shape[0],
+    }
+    if return_chunks:
+        chunks = []
+        for window, row in zip(offsets, probabilities):
+            # Special and padding tokens have (0, 0) offsets
+            spans = [(int(a), int(b)) for a, b in window.tolist() if b > a]
+            start, end = (spans[0][0], spans[-1][1]) if spans else (0, 0)
+            chunks.append({
+                "start": start,
+                "end": end,
+                "bias_analysis": {categories[i]: float(row[i]) for i in range(len(categories))},
+            })
+        result["chunks"] = chunks
+    return result
+
+# Micro-batching front end shared by all routes
+bias_batcher = BatchEngine(NLP_ana_batch)
+
+async def NLP_ana_cached(text):
+    """Bias scores for `text`, served from the result cache when this model version has seen it before."""
+    key = text_key(text, MODEL_NAME, current_model_version())
+    with span("bias"):
+        bias_result = await bias_cache.aget(key)
+        if bias_result is None:
+            bias_result = await bias_batcher.submit(text)
+            await bias_cache.aset(key, bias_result)
+    return bias_result
 
 # Reinforcement Learning Function
 def reinforce_learning(text, correct_label):
     """
-    Fine-tune PoliticalBiasBERT model using GPT-4’s classification.
+    Queue GPT-4's classification of `text` as feedback for PoliticalBiasBERT.
+
+    Training no longer happens inside the request: the sample is stored in the
+    FeedbackQueue table and picked up by the background trainer
+    (python -m neutralize.reinforced.trainer).
 
     Parameters:
     - text (str): The text used for reinforcement learning.
     - correct_label (str): The bias classification from GPT-4 ('Left', 'Middle', 'Right').
     """
-    inputs = tokenizer(text, return_tensors="pt", truncation=True, max_length=512)
-    # Move input tensors to device
-    inputs = {k: v.to(device) for k, v in inputs.items()}
-
-    labels = torch.tensor([[0, 0, 0]]).to(device)  # One-hot encoding on the device
-
-    if correct_label == "Left":
-        labels[0][0] = 1
-    elif correct_label == "Middle":
-        labels[0][1] = 1
-    elif correct_label == "Right":
-        labels[0][2] = 1
-
-    model.train()
-    optimizer = AdamW(model.parameters(), lr=5e-5)
-    loss_fn = torch.nn.CrossEntropyLoss()
-
-    outputs = model(**inputs)
-    loss = loss_fn(outputs.logits, labels)
-
-    loss.backward()
-    optimizer.step()
-
-    return {"message": "Model fine-tuned based on GPT feedback"}
-
-# Define endpoint
-@app.post("/analyze/")
-async def analyze_bias(request: TextRequest, db: Session = Depends(get_db)):
-    try:
-        # Check if the URL is already in the cache
-        existing_entry = db.execute(
-            select(website_cache.c.left, website_cache.c.center, website_cache.c.right)
-            .where(website_cache.c.url == request.url)
-        ).fetchone()
-
-        if existing_entry:
-            return {
-                "message": "Data retrieved from cache",
-                "bias_analysis": {
-                    "Left": existing_entry[0],
-                    "Middle": existing_entry[1],
-                    "Right": existing_entry[2]
-                }
-            }
-
-        # If URL is not in cache, run NLP analysis
-        bias_result = NLP_ana(request.text)
-
-        # Placeholder variables for GPT feedback (ensure these are defined or passed in your actual implementation)
-        gpt_bias = "Middle"        # Example default value; replace with actual GPT feedback
-        gpt_explanation = "N/A"      # Example default explanation
-
-        # Compare results and reinforce learning if needed
-        model_prediction = max(bias_result, key=bias_result.get)  # Get highest probability category
-        gpt_correction = 0  # Default no correction
-
-        if model_prediction != gpt_bias and gpt_bias in ["Left", "Middle", "Right"]:
-            reinforce_learning(request.text, gpt_bias)  # Fine-tune model
-            gpt_correction = 1  # Mark as corrected by GPT
-
-        # Store results in database
-        db.execute(
-            insert(website_cache).values(
-                url=request.url,
-                title=request.title,
-                text=request.text,
-                left=bias_result["Left"],
-                center=bias_result["Middle"],
-                right=bias_result["Right"],
-                gpt_bias=gpt_bias,
-                gpt_explanation=gpt_explanation,
-                gpt_correction=gpt_correction
-            )
-        )
-        db.commit()
-
-        return {"message": "NLP analysis performed", "bias_analysis": bias_result}
-
-    except Exception as e:
-        db.rollback()  # Rollback in case of an error
-        raise HTTPException(status_code=500, detail=str(e))
-
-    finally:
-        db.close()  # Ensure the database session is properly closed
+    enqueue_feedback(text, correct_label)
+    return {"message": "Feedback queued for training"}
+
+# Bulk scoring for the batch endpoint
+BATCH_CHUNK_SIZE = int(os.getenv("NLP_BATCH_CHUNK_SIZE", "32"))
+
+async def NLP_ana_many(texts, chunk_size=BATCH_CHUNK_SIZE):
+    """
+    Score many texts, yielding (index, bias_result) in input order as results become available.
+
+    Identical inputs are scored once and cached results are reused. Everything else
+    goes through NLP_ana_batch in padded chunks of `chunk_size`, run in the model pool.
+    """
+    keys = [text_key(text, MODEL_NAME, current_model_version()) for text in texts]
+    unique = list(dict.fromkeys(keys))
+    results = await bias_cache.aget_many(unique)
+
+    first_text = {}
+    for key, text in zip(keys, texts):
+        first_text.setdefault(key, text)
+    pending = [key for key in unique if key not in results]
+
+    next_index = 0
+    for start in range(0, len(pending) + 1, chunk_size):
+        chunk = pending[start:start + chunk_size]
+        if chunk:
+            scores = await run_blocking(NLP_ana_batch, [first_text[key] for key in chunk])
+            scored = dict(zip(chunk, scores))
+            results.update(scored)
+            await bias_cache.aset_many(scored)
+        # Flush every result whose predecessors are all known
+        while next_index < len(keys) and keys[next_index] in results:
+            yield next_index, results[keys[next_index]]
+            next_index += 1
@@ -0,0 +1,139 @@
+"""
+Background trainer for the bias classifier.
+
+Run it as its own process, next to the API workers:
+
+    python -m neutralize.reinforced.trainer
+
+It drains the FeedbackQueue in mini-batches, fine-tunes a shadow copy of the
+model and publishes a checkpoint only when the copy does at least as well as
+the last published model on the holdout samples. API workers pick up new
+checkpoints on their own (see watch_checkpoints in nlp_model).
+"""
+import copy
+import os
+import time
+
+import torch
+from dotenv import load_dotenv
+
+from neutralize.registry import device
+from neutralize.tokenization import CachedTokenizer, load_fast_tokenizer
+from .checkpoints import latest_checkpoint, publish_checkpoint
+from .classifier import LABELS, MODEL_NAME, TOKENIZER_NAME, load_classifier_model
+from .feedback import claim_pending, holdout_samples, mark_trained, release_claimed
+
+load_dotenv()
+
+RL_BATCH_SIZE = int(os.getenv("RL_BATCH_SIZE", "8"))
+# Mini-batches accumulated per optimizer step, and so per training round
+RL_ACCUM_STEPS = int(os.getenv("RL_ACCUM_STEPS", "4"))
+RL_LEARNING_RATE = float(os.getenv("RL_LEARNING_RATE", "1e-5"))
+RL_MAX_LENGTH = int(os.getenv("RL_MAX_LENGTH", "512"))
+RL_POLL_SECONDS = float(os.getenv("RL_POLL_SECONDS", "30"))
+# Evaluation gate: at least this many holdout samples, and the candidate may
+# not lose more than RL_EVAL_TOLERANCE accuracy against the published model
+RL_MIN_HOLDOUT = int(os.getenv("RL_MIN_HOLDOUT", "20"))
+RL_MAX_HOLDOUT = int(os.getenv("RL_MAX_HOLDOUT", "500"))
+RL_EVAL_TOLERANCE = float(os.getenv("RL_EVAL_TOLERANCE", "0.0"))
+# Keep the trainer off the cores serving requests
+RL_TRAIN_THREADS = int(os.getenv("RL_TRAIN_THREADS", "1"))
+RL_NICE = int(os.getenv("RL_NICE", "10"))
+
+
+class Trainer:
+    def __init__(self, device):
+        self.device = device
+        latest = latest_checkpoint()
+        # Holdout samples are evaluated every round, so their encodings are cached
+        self.tokenizer = CachedTokenizer(load_fast_tokenizer(TOKENIZER_NAME), TOKENIZER_NAME, max_length=RL_MAX_LENGTH)
+        # `baseline` is what the API serves, `shadow` is the copy being trained
+        self.baseline = load_classifier_model(latest[1] if latest else MODEL_NAME).to(device)
+        self.baseline.eval()
+        self.version = latest[0] if latest else None
+        self.shadow = copy.deepcopy(self.baseline)
+        self.optimizer = torch.optim.AdamW(self.shadow.parameters(), lr=RL_LEARNING_RATE)
+        self.loss_fn = torch.nn.CrossEntropyLoss()
+
+    def _encode(self, rows):
+        inputs = {k: v.to(self.device) for k, v in self.tokenizer.encode_batch([row.text for row in rows]).items()}
+        labels = torch.tensor([LABELS.index(row.label) for row in rows], device=self.device)
+        return inputs, labels
+
+    def train_round(self, rows):
+        """One optimizer step over `rows`, accumulating gradients across mini-batches."""
+        self.shadow.train()
+        self.optimizer.zero_grad()
+        for i in range(0, len(rows), RL_BATCH_SIZE):
+            batch = rows[i:i + RL_BATCH_SIZE]
+            inputs, labels = self._encode(batch)
+            loss = self.loss_fn(self.shadow(**inputs).logits, labels)
+            # Weight by batch share so a short last batch does not count double
+            (loss * len(batch) / len(rows)).backward()
+        self.optimizer.step()
+        self.shadow.eval()
+
+    @torch.no_grad()
+    def evaluate(self, model, rows):
+        """Return (accuracy, mean loss) of `model` on `rows`."""
+        correct, total_loss = 0, 0.0
+        for i in range(0, len(rows), RL_BATCH_SIZE):
+            inputs, labels = self._encode(rows[i:i + RL_BATCH_SIZE])
+            logits = model(**inputs).logits
+            total_loss += self.loss_fn(logits, labels).item() * len(labels)
+            correct += (logits.argmax(dim=-1) == labels).sum().item()
+        return correct / len(rows), total_loss / len(rows)
+
+    def gate(self):
+        """Publish the shadow model if it passes the holdout evaluation, otherwise roll it back."""
+        holdout = holdout_samples(RL_MAX_HOLDOUT)
+        if len(holdout) < RL_MIN_HOLDOUT:
+            print(f"Trainer: {len(holdout)} holdout samples, need {RL_MIN_HOLDOUT} before publishing")
+            return False
+
+        base_acc, base_loss = self.evaluate(self.baseline, holdout)
+        new_acc, new_loss = self.evaluate(self.shadow, holdout)
+        print(f"Trainer: holdout accuracy {base_acc:.3f} -> {new_acc:.3f}, loss {base_loss:.4f} -> {new_loss:.4f}")
+        if new_acc + RL_EVAL_TOLERANCE < base_acc or (new_acc == base_acc and new_loss > base_loss):
+            # Regression: discard the update and start again from the published weights
+            self.shadow = copy.deepcopy(self.baseline)
+            self.optimizer = torch.optim.AdamW(self.shadow.parameters(), lr=RL_LEARNING_RATE)
+            return False
+
+        self.version = publish_checkpoint(self.shadow, self.tokenizer.tokenizer)
+        self.baseline = copy.deepcopy(self.shadow)
+        print(f"Trainer: published checkpoint {self.version}")
+        return True
+
+    def step(self):
+        """Train and gate one round of queued feedback. Returns the number of samples used."""
+        rows = claim_pending(RL_BATCH_SIZE * RL_ACCUM_STEPS)
+        if not rows:
+            return 0
+        try:
+            self.train_round(rows)
+        except Exception:
+            release_claimed()
+            raise
+        mark_trained([row.id for row in rows])
+        self.gate()
+        return len(rows)
+
+    def run_forever(self):
+        while True:
+            if not self.step():
+                time.sleep(RL_POLL_SECONDS)
+
+
+def main():
+    if RL_NICE and hasattr(os, "nice"):
+        os.nice(RL_NICE)
+    torch.set_num_threads(RL_TRAIN_THREADS)
+    # Samples claimed by a trainer that died mid-round go back to the queue
+    release_claimed()
+
+    Trainer(device).run_forever()
+
+
+if __name__ == "__main__":
+    main()
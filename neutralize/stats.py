@@ -0,0 +1,74 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+
+from CRUD.authen import superuser_required
+from db.result_cache import bias_cache
+from db.completion_cache import completion_cache
+from neutralize.NLP.multimo import image_context_stats
+from neutralize.NLP.prompting import prompt_usage
+from neutralize.NLP.routing import routing_stats
+from neutralize.reinforced import bias_batcher
+from neutralize.reinforced import nlp_model
+from neutralize.reinforced.feedback import queue_counts
+from neutralize.registry import registry
+from neutralize.streaming import stream_timings
+from neutralize.tokenization import tokenizer_stats
+from service.executor import executor_stats, run_blocking
+from service.hashing import hashing_stats
+from service.jwttoken import token_cache_stats
+from service.ratelimit import ratelimit_stats
+from service.tracing import render_metrics
+
+# Operational statistics, restricted to superusers
+stats = APIRouter(dependencies=[Depends(superuser_required)])
+
+@stats.get("/batching")
+async def batching_stats():
+    return bias_batcher.stats()
+
+@stats.get("/executor")
+async def executor_pool_stats():
+    return executor_stats()
+
+@stats.get("/models")
+async def model_stats():
+    return registry.stats()
+
+@stats.get("/cache")
+async def cache_stats():
+    return {
+        "bias": bias_cache.stats(),
+        "completions": completion_cache.stats(),
+        "tokenizers": tokenizer_stats(),
+        "image_context": image_context_stats(),
+    }
+
+@stats.get("/training")
+async def training_stats():
+    return {"queue": await run_blocking(queue_counts), "serving_checkpoint": nlp_model.checkpoint_version}
+
+@stats.get("/streaming")
+async def streaming_stats():
+    return stream_timings.stats()
+
+@stats.get("/hashing")
+async def password_hashing_stats():
+    return hashing_stats()
+
+@stats.get("/auth")
+async def auth_stats():
+    return token_cache_stats()
+
+@stats.get("/ratelimit")
+async def rate_limit_stats():
+    return ratelimit_stats()
+
+@stats.get("/routing")
+async def model_routing_stats():
+    # Which model each tier was routed to and why, and projected vs actual prompt tokens per model
+    return {**routing_stats(), "prompts": prompt_usage.stats()}
+
+@stats.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    # Prometheus text exposition format; scrape with the superuser token as a bearer token
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
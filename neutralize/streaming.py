@@ -0,0 +1,101 @@
+import json
+import threading
+import time
+from collections import deque
+
+from fastapi.responses import StreamingResponse
+
+from service.executor import endpoint_limiter
+from service.ratelimit import settle_credits
+
+# Timings kept per endpoint for the percentiles in /api/stats/streaming
+TIMING_WINDOW = 1000
+
+
+def sse_event(event, data):
+    """One server-sent event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class StreamTimings:
+    """
+    Recent timings of streaming responses, per endpoint.
+
+    ttfb is request start to the first event (the bias scores), first_token is
+    request start to the first piece of generated text, total is the whole stream.
+    """
+
+    def __init__(self, window=TIMING_WINDOW):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, **timings):
+        with self._lock:
+            samples = self._samples.setdefault(name, {})
+            for metric, value in timings.items():
+                if value is not None:
+                    samples.setdefault(metric, deque(maxlen=self.window)).append(value)
+
+    def stats(self):
+        with self._lock:
+            result = {}
+            for name, samples in self._samples.items():
+                result[name] = {}
+                for metric, values in samples.items():
+                    ordered = sorted(values)
+                    result[name][metric] = {
+                        "count": len(ordered),
+                        "p50": round(ordered[len(ordered) // 2], 1),
+                        "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 1),
+                    }
+            return result
+
+
+stream_timings = StreamTimings()
+
+
+def stream_completion(name, text, analyze, complete):
+    """
+    SSE response: a "bias" event as soon as the scores are computed, a "context"
+    event with the image context, "token" events as the completion streams in,
+    and a final "done" event with the timings (or "error").
+
+    Parameters:
+    name (str): Endpoint name, for the concurrency limiter and the timing stats.
+    text (str): The text to analyze.
+    analyze (async callable): Returns the bias scores for `text`.
+    complete (callable): Takes the bias scores and returns an async iterator of
+        ("mulcont", context) and ("token", text) pairs.
+    """
+    start = time.perf_counter()
+
+    async def events():
+        ttfb = first_token = None
+        # The limiter is held while streaming, not just until the handler returns
+        async with endpoint_limiter(name):
+            try:
+                bias_level = await analyze(text)
+                yield sse_event("bias", {"bias_analysis": bias_level})
+                ttfb = (time.perf_counter() - start) * 1000
+
+                async for kind, value in complete(bias_level):
+                    if kind == "mulcont":
+                        yield sse_event("context", {"mulcont": value})
+                    else:
+                        if first_token is None:
+                            first_token = (time.perf_counter() - start) * 1000
+                        yield sse_event("token", {"text": value})
+
+                total = (time.perf_counter() - start) * 1000
+                stream_timings.record(name, ttfb_ms=ttfb, first_token_ms=first_token, total_ms=total)
+                settle_credits()
+                yield sse_event("done", {"ttfb_ms": round(ttfb, 1), "first_token_ms": first_token and round(first_token, 1),
+                                         "total_ms": round(total, 1)})
+            except Exception as e:
+                settle_credits()
+                yield sse_event("error", {"detail": str(e)})
+
+    # Disable proxy buffering so events reach the client as they are sent
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -0,0 +1,109 @@
+import hashlib
+import os
+import threading
+
+import torch
+from dotenv import load_dotenv
+from transformers import AutoTokenizer
+
+from service.cache import LRUCache
+
+load_dotenv()
+
+# Encodings kept per tokenizer, keyed on a hash of the text
+TOKENIZER_CACHE_SIZE = int(os.getenv("TOKENIZER_CACHE_SIZE", "4096"))
+# Long-text windows are several max_length tensors per text, so they get their
+# own cache bounded by memory rather than by entry count
+TOKENIZER_WINDOW_CACHE_MB = float(os.getenv("TOKENIZER_WINDOW_CACHE_MB", "64"))
+
+_tokenizers = {}
+
+
+def load_fast_tokenizer(name):
+    """Load the Rust-backed tokenizer for `name`; refuses the slow Python fallback."""
+    tokenizer = AutoTokenizer.from_pretrained(name, use_fast=True)
+    if not tokenizer.is_fast:
+        raise RuntimeError(f"No fast tokenizer available for {name}; install the `tokenizers` package")
+    return tokenizer
+
+
+class CachedTokenizer:
+    """
+    A fast tokenizer with an LRU of per-text encodings.
+
+    Texts are encoded unpadded and cached as 1-D tensors, so a batch is only
+    the cache misses tokenized in one call plus padding. Calls into the Rust
+    tokenizer are serialized: it raises "Already borrowed" when threads use
+    it concurrently with different truncation settings.
+
+    Parameters:
+    tokenizer: A fast tokenizer, see load_fast_tokenizer.
+    name (str): Cache namespace, usually the tokenizer's hub name.
+    max_length (int): Texts are truncated to this many tokens.
+    """
+
+    def __init__(self, tokenizer, name, max_length=512, cache_size=TOKENIZER_CACHE_SIZE,
+                 window_cache_mb=TOKENIZER_WINDOW_CACHE_MB):
+        self.tokenizer = tokenizer
+        self.name = name
+        self.max_length = max_length
+        self.cache = LRUCache(maxsize=cache_size)
+        self.windows = LRUCache(maxsize=cache_size, maxbytes=int(window_cache_mb * 2**20), sizeof=tensors_nbytes)
+        self._lock = threading.Lock()
+        _tokenizers[name] = self
+
+    def _key(self, text, *parts):
+        return hashlib.sha256(f"{self.max_length}|{parts}|{text}".encode()).hexdigest()
+
+    def encode(self, texts):
+        """Unpadded encodings ({name: 1-D tensor}) for each text, in order."""
+        keys = [self._key(text) for text in texts]
+        encodings = [self.cache.get(key) for key in keys]
+        missing = {}
+        for i, encoding in enumerate(encodings):
+            if encoding is None:
+                missing.setdefault(keys[i], texts[i])
+        if missing:
+            with self._lock:
+                batch = self.tokenizer(list(missing.values()), truncation=True, max_length=self.max_length)
+            for j, key in enumerate(missing):
+                encoding = {name: torch.tensor(values[j]) for name, values in batch.items()}
+                self.cache.set(key, encoding)
+                missing[key] = encoding
+            encodings = [encoding if encoding is not None else missing[key] for key, encoding in zip(keys, encodings)]
+        return encodings
+
+    def encode_batch(self, texts):
+        """Right-padded tensors for a batch of texts, as a tokenizer call with padding=True would return."""
+        encodings = self.encode(list(texts))
+        pad_values = {"input_ids": self.tokenizer.pad_token_id or 0}
+        return {
+            name: torch.nn.utils.rnn.pad_sequence([encoding[name] for encoding in encodings], batch_first=True,
+                                                  padding_value=pad_values.get(name, 0))
+            for name in encodings[0]
+        }
+
+    def encode_windows(self, text, stride):
+        """
+        Overlapping max_length windows over the whole text, with character offsets.
+        The result is cached; callers get their own copy of the dict.
+        """
+        key = self._key(text, "windows", stride)
+        inputs = self.windows.get(key)
+        if inputs is None:
+            with self._lock:
+                inputs = dict(self.tokenizer(
+                    text, return_tensors="pt", padding=True, truncation=True, max_length=self.max_length,
+                    stride=stride, return_overflowing_tokens=True, return_offsets_mapping=True,
+                ))
+            inputs.pop("overflow_to_sample_mapping", None)
+            self.windows.set(key, inputs)
+        return dict(inputs)
+
+
+def tensors_nbytes(tensors):
+    return sum(t.element_size() * t.nelement() for t in tensors.values())
+
+def tokenizer_stats():
+    return {name: {**tokenizer.cache.stats(), "windows": tokenizer.windows.stats()}
+            for name, tokenizer in _tokenizers.items()}
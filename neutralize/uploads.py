@@ -0,0 +1,130 @@
+import io
+import os
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, UploadFile
+from PIL import Image
+
+from service.executor import run_blocking
+
+load_dotenv()
+
+ALLOWED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp"}
+ALLOWED_FORMATS = {"JPEG", "PNG", "WEBP"}
+
+MAX_IMAGE_BYTES = int(os.getenv("MAX_IMAGE_BYTES", str(10 * 2**20)))
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", "40000000"))
+# Whole request body limit for image endpoints: the image plus the form text
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(MAX_IMAGE_BYTES + 2**20)))
+# Images are downscaled while decoding so the shorter side is about this many
+# pixels (CLIP works at 224). 0 keeps full resolution.
+IMAGE_DECODE_SIDE = int(os.getenv("IMAGE_DECODE_SIDE", "224"))
+
+CHUNK_SIZE = 64 * 1024
+
+
+def decode_image(data, max_pixels=MAX_IMAGE_PIXELS, decode_side=IMAGE_DECODE_SIDE):
+    """
+    Decode image bytes into an RGB PIL image without touching the disk.
+
+    The header is checked against `max_pixels` before any pixel data is decoded.
+    JPEGs are scaled down inside the decoder (draft mode), other formats right after.
+    """
+    image = Image.open(io.BytesIO(data))
+    if image.format not in ALLOWED_FORMATS:
+        raise ValueError(f"Unsupported image format: {image.format}")
+    width, height = image.size
+    if width * height > max_pixels:
+        raise OverflowError(f"Image has {width * height} pixels, the limit is {max_pixels}")
+
+    if decode_side and min(width, height) > decode_side:
+        scale = decode_side / min(width, height)
+        target = (max(1, round(width * scale)), max(1, round(height * scale)))
+        image.draft("RGB", target)
+        image = image.convert("RGB")
+        if image.size != target:
+            image = image.resize(target, Image.BICUBIC)
+        return image
+    return image.convert("RGB")
+
+async def read_image_upload(upload: UploadFile, max_bytes=MAX_IMAGE_BYTES):
+    """
+    Read and decode an uploaded image in memory.
+
+    Raises HTTPException 400 for a bad extension or undecodable data and 413
+    when the upload exceeds MAX_IMAGE_BYTES or MAX_IMAGE_PIXELS.
+    """
+    ext = os.path.splitext(upload.filename or "")[-1].lower()
+    if ext not in ALLOWED_EXTENSIONS:
+        raise HTTPException(status_code=400, detail=f"Invalid image format: {ext}")
+    if upload.size is not None and upload.size > max_bytes:
+        raise HTTPException(status_code=413, detail=f"Image larger than {max_bytes} bytes")
+
+    buffer = bytearray()
+    while chunk := await upload.read(CHUNK_SIZE):
+        buffer += chunk
+        if len(buffer) > max_bytes:
+            raise HTTPException(status_code=413, detail=f"Image larger than {max_bytes} bytes")
+
+    try:
+        return await run_blocking(decode_image, bytes(buffer))
+    except OverflowError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Could not decode image: {e}")
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Reject oversized request bodies on the given paths before they are read.
+
+    A declared Content-Length over the limit is refused immediately. Chunked
+    bodies are counted as they stream in and cut off once they pass the limit.
+    """
+
+    def __init__(self, app, paths, max_bytes=MAX_UPLOAD_BYTES):
+        self.app = app
+        self.paths = set(paths)
+        self.max_bytes = max_bytes
+
+    async def _reject(self, send):
+        body = b'{"detail":"Request body too large"}'
+        await send({"type": "http.response.start", "status": 413,
+                    "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope["headers"])
+        length = headers.get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > self.max_bytes:
+            return await self._reject(send)
+
+        received = 0
+        started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # Raised inside the route's body parsing, where FastAPI
+                    # lets HTTPException through to the exception handlers
+                    raise HTTPException(status_code=413, detail="Request body too large")
+            return message
+
+        async def tracking_send(message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except HTTPException as e:
+            if e.status_code != 413 or started:
+                raise
+            await self._reject(send)
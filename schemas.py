@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, Literal
 
 class User(BaseModel):
     username: str
@@ -13,6 +13,11 @@ class UserResponse(BaseModel):
     email: str
     is_superuser: bool
     
+class UserPage(BaseModel):
+    items: list[dict]
+    # Pass as after_id to get the next page; None on the last page
+    next_after_id: Optional[int] = None
+
 class Login(BaseModel):
 	username: str
 	password: str
@@ -33,6 +38,15 @@ class BiasRequest(BaseModel):
 class TextRequest(BaseModel):
     text: str
 
+class LongTextRequest(BaseModel):
+    text: str
+    strategy: Literal["mean", "length_weighted", "max_confidence"] = "mean"
+    return_chunks: bool = False
+
+class FeedbackRequest(BaseModel):
+    text: str
+    label: Literal["Left", "Middle", "Right"]
+
 class NeuReason(BaseModel):
     text: str
     image_path: str
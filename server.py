@@ -1,9 +1,18 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from CRUD.authen import auth
 import uvicorn
 import colorama
 from neutralize.neutralize import neu
+from neutralize.stats import stats
+from neutralize.registry import registry
+from neutralize.NLP.routing import preload_token_counters
+from neutralize.reinforced import watch_checkpoints
+from db.credit_check import credit, credit_ledger
+from neutralize.uploads import UploadSizeLimitMiddleware
+from service.tracing import TracingMiddleware
 # from database import cache
 # from db.url_cache import cache
 
@@ -13,7 +22,26 @@ origins = [
     "http://localhost:8080",
 ]
 
-app = FastAPI(docs_url="/api/docs", openapi_url="/api")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the models listed in PRELOAD_MODELS before serving; others load on first use
+    registry.preload()
+    # Prompt token counters load a tokenizer; do it now rather than in a request
+    preload_token_counters()
+    # Swap in checkpoints published by the background trainer
+    watcher = asyncio.create_task(watch_checkpoints())
+    # Writes spent GPT credits to the Credits table in batches
+    credit_flusher = asyncio.create_task(credit_ledger.run())
+    yield
+    watcher.cancel()
+    credit_flusher.cancel()
+    await asyncio.gather(credit_flusher, return_exceptions=True)
+
+app = FastAPI(docs_url="/api/docs", openapi_url="/api", lifespan=lifespan)
+
+# Refuse oversized image uploads before the multipart body is read
+app.add_middleware(UploadSizeLimitMiddleware, paths=["/api/reduce_bias", "/api/multicon_bias_ana",
+                                                     "/api/reduce_bias/stream", "/api/multicon_bias_ana/stream"])
 
 app.add_middleware(
     CORSMiddleware,
@@ -22,10 +50,17 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Let browser clients read the per-stage timings
+    expose_headers=["Server-Timing"],
 )
 
+# Outermost, so the Server-Timing header and the metrics cover every other layer
+app.add_middleware(TracingMiddleware)
+
 app.include_router(auth, prefix="/api")
 app.include_router(neu, prefix="/api")
+app.include_router(credit, prefix="/api")
+app.include_router(stats, prefix="/api/stats")
 # app.include_router(cache, prefix="/api") # cache is currently under work
 # app.include_router(neu_encrypted, prefix="/api/encrypted")
 
@@ -0,0 +1,95 @@
+import asyncio
+import contextvars
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Bounded pool for CPU-bound model inference (BERT, CLIP, GPT-2).
+# torch releases the GIL inside its kernels, so threads are enough here.
+MODEL_POOL_WORKERS = int(os.getenv("MODEL_POOL_WORKERS", "4"))
+model_pool = ThreadPoolExecutor(max_workers=MODEL_POOL_WORKERS, thread_name_prefix="model")
+
+# Default number of requests per endpoint allowed in flight at once.
+# Override per endpoint with CONCURRENCY_<NAME>, e.g. CONCURRENCY_REDUCE_BIAS=2
+DEFAULT_ENDPOINT_CONCURRENCY = int(os.getenv("ENDPOINT_CONCURRENCY", "8"))
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """Run a blocking callable in the model pool without stalling the event loop."""
+    loop = asyncio.get_running_loop()
+    # Carry context variables (request-scoped state) into the worker thread
+    ctx = contextvars.copy_context()
+    call = functools.partial(ctx.run, fn, *args, **kwargs)
+    return await loop.run_in_executor(model_pool, call)
+
+
+class EndpointLimiter:
+    """
+    Per-endpoint concurrency limit.
+
+    Each named endpoint gets its own semaphore so that a burst on one
+    endpoint queues behind its own limit instead of taking every worker.
+    """
+
+    def __init__(self, name, limit):
+        self.name = name
+        self.limit = limit
+        self.in_flight = 0
+        self.waiting = 0
+        self._loop = None
+        self._semaphore = None
+
+    def _get_semaphore(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.limit)
+        return self._semaphore
+
+    async def __aenter__(self):
+        semaphore = self._get_semaphore()
+        self.waiting += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    def stats(self):
+        return {"limit": self.limit, "in_flight": self.in_flight, "waiting": self.waiting}
+
+
+_limiters = {}
+
+def endpoint_limiter(name):
+    """Return the shared limiter for an endpoint, creating it on first use."""
+    if name not in _limiters:
+        limit = int(os.getenv(f"CONCURRENCY_{name.upper()}", DEFAULT_ENDPOINT_CONCURRENCY))
+        _limiters[name] = EndpointLimiter(name, max(1, limit))
+    return _limiters[name]
+
+def concurrency_limit(name):
+    """FastAPI dependency that holds a slot of the endpoint's limiter for the request."""
+    limiter = endpoint_limiter(name)
+
+    async def dependency():
+        async with limiter:
+            yield
+
+    return dependency
+
+def executor_stats():
+    return {
+        "model_pool_workers": MODEL_POOL_WORKERS,
+        "model_pool_queue": model_pool._work_queue.qsize(),
+        "endpoints": {name: limiter.stats() for name, limiter in _limiters.items()},
+    }
@@ -1,10 +1,131 @@
+import asyncio
+import hashlib
+import hmac
+import os
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
 
+from dotenv import load_dotenv
+from fastapi import HTTPException, status
 from passlib.context import CryptContext
 
-pwd_cxt = CryptContext(schemes =["bcrypt"],deprecated="auto")
+from service.cache import LRUCache
+
+load_dotenv()
+
+# bcrypt cost factor. Hashes with any other cost are re-hashed on the next
+# successful login (needs_update), so it can be tuned without password resets.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Dedicated threads for hashing, and how many hash jobs may wait for them
+# before new ones are refused with 503
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", "2"))
+HASH_MAX_PENDING = int(os.getenv("HASH_MAX_PENDING", "32"))
+# Successful logins are remembered this many seconds so a client logging in
+# again with the same password skips bcrypt. 0 disables the cache.
+LOGIN_CACHE_TTL = float(os.getenv("LOGIN_CACHE_TTL", "300"))
+LOGIN_CACHE_SIZE = int(os.getenv("LOGIN_CACHE_SIZE", "10000"))
+
+pwd_cxt = CryptContext(schemes =["bcrypt"],deprecated="auto",
+                       bcrypt__default_rounds=BCRYPT_ROUNDS, bcrypt__min_rounds=BCRYPT_ROUNDS,
+                       bcrypt__max_rounds=BCRYPT_ROUNDS)
 
 class Hash():
 	def bcrypt(password:str):
 		return pwd_cxt.hash(password)
 	def verify(hashed,normal):
-		return pwd_cxt.verify(normal,hashed)
\ No newline at end of file
+		return pwd_cxt.verify(normal,hashed)
+
+
+class HashExecutor:
+    """
+    Bounded thread pool for password hashing, separate from FastAPI's threadpool
+    and the model pool, so a burst of logins cannot starve either of them.
+    """
+
+    def __init__(self, workers=HASH_WORKERS, max_pending=HASH_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hash")
+        # Only touched from the event loop, so no lock is needed
+        self.pending = 0
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.queue_seconds = 0.0
+        self.hash_seconds = 0.0
+
+    async def run(self, fn, *args):
+        """Run `fn(*args)` in the pool. Returns (result, {"queue_ms", "hash_ms"})."""
+        if self.pending >= self.workers + self.max_pending:
+            self.rejected += 1
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                detail="Too many login requests, try again shortly", headers={"Retry-After": "1"})
+
+        def timed():
+            start = time.perf_counter()
+            return fn(*args), start, time.perf_counter()
+
+        self.pending += 1
+        self.submitted += 1
+        submitted = time.perf_counter()
+        try:
+            result, start, end = await asyncio.get_running_loop().run_in_executor(self.pool, timed)
+        finally:
+            self.pending -= 1
+        self.completed += 1
+        self.queue_seconds += start - submitted
+        self.hash_seconds += end - start
+        return result, {"queue_ms": (start - submitted) * 1000, "hash_ms": (end - start) * 1000}
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "running": min(self.pending, self.workers),
+            "queued": max(0, self.pending - self.workers),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_queue_ms": round(self.queue_seconds / self.completed * 1000, 2) if self.completed else 0.0,
+            "avg_hash_ms": round(self.hash_seconds / self.completed * 1000, 2) if self.completed else 0.0,
+        }
+
+
+hash_executor = HashExecutor()
+
+# Keys are an HMAC of the stored hash and the password under a per-process
+# secret, so neither is kept in memory and a password change misses the cache
+_login_cache = LRUCache(maxsize=LOGIN_CACHE_SIZE, ttl=LOGIN_CACHE_TTL)
+_login_cache_key = secrets.token_bytes(32)
+
+def _credential_key(hashed, password):
+    return hmac.new(_login_cache_key, f"{hashed}\0{password}".encode(), hashlib.sha256).hexdigest()
+
+def _verify(hashed, password):
+    valid = pwd_cxt.verify(password, hashed)
+    new_hash = pwd_cxt.hash(password) if valid and pwd_cxt.needs_update(hashed) else None
+    return valid, new_hash
+
+async def hash_password(password):
+    """Returns (hash, timing)."""
+    return await hash_executor.run(pwd_cxt.hash, password)
+
+async def verify_password(hashed, password):
+    """
+    Check a password against its stored hash in the hashing pool.
+
+    Returns (valid, new_hash, timing). new_hash is set when the stored hash uses
+    another cost than BCRYPT_ROUNDS and should replace it.
+    """
+    key = _credential_key(hashed, password) if LOGIN_CACHE_TTL > 0 else None
+    if key is not None and _login_cache.get(key):
+        return True, None, {"queue_ms": 0.0, "hash_ms": 0.0}
+
+    (valid, new_hash), timing = await hash_executor.run(_verify, hashed, password)
+    if valid and new_hash is None and key is not None:
+        _login_cache.set(key, True)
+    return valid, new_hash, timing
+
+def hashing_stats():
+    return {**hash_executor.stats(), "login_cache": _login_cache.stats()}
@@ -1,6 +1,9 @@
 from datetime import datetime, timedelta
+import hashlib
+import time
 from schemas import TokenData
 from jose import JWTError, jwt
+from service.cache import LRUCache
 # from main import TokenData
 
 # import SECRET_KEY from .env
@@ -12,22 +15,86 @@ SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Library used to sign and verify tokens: "jose" (python-jose) or "pyjwt",
+# which is faster but optional (pip install pyjwt)
+JWT_BACKEND = os.getenv("JWT_BACKEND", "jose")
+# Verified tokens kept per worker; each entry expires with its token's exp
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+
+
+class InvalidToken(Exception):
+    pass
+
+class JoseBackend:
+    name = "jose"
+
+    def encode(self, claims):
+        return jwt.encode(claims, SECRET_KEY, algorithm=ALGORITHM)
+
+    def decode(self, token):
+        try:
+            return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except JWTError as e:
+            raise InvalidToken(str(e))
+
+class PyJWTBackend:
+    name = "pyjwt"
+
+    def __init__(self):
+        import jwt as pyjwt
+        self.pyjwt = pyjwt
+
+    def encode(self, claims):
+        return self.pyjwt.encode(claims, SECRET_KEY, algorithm=ALGORITHM)
+
+    def decode(self, token):
+        try:
+            return self.pyjwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except self.pyjwt.PyJWTError as e:
+            raise InvalidToken(str(e))
+
+JWT_BACKENDS = {"jose": JoseBackend, "pyjwt": PyJWTBackend}
+
+def load_backend(name=JWT_BACKEND):
+    if name not in JWT_BACKENDS:
+        raise ValueError(f"Unknown JWT_BACKEND '{name}', expected one of {list(JWT_BACKENDS)}")
+    try:
+        return JWT_BACKENDS[name]()
+    except ImportError:
+        raise RuntimeError(f"JWT_BACKEND={name} needs PyJWT: pip install pyjwt")
+
+backend = load_backend()
+
+# Keyed on a hash of the token so the cache never holds bearer tokens themselves
+token_cache = LRUCache(maxsize=TOKEN_CACHE_SIZE)
+
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    encoded_jwt = backend.encode(to_encode)
     return encoded_jwt
 
 def verify_token(token:str,credentials_exception):
+	key = hashlib.sha256(token.encode()).hexdigest()
+	token_data = token_cache.get(key)
+	if token_data is not None:
+		return token_data
 	try:
-		payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+		payload = backend.decode(token)
 		username: str = payload.get("username")
 		email: str = payload.get("email")
 		is_superuser: bool = payload.get("is_superuser")
 		if username is None:
 			raise credentials_exception
 		token_data = TokenData(username=username, email=email, is_superuser=is_superuser)
+		# Only cache until the token expires, so an expired token is decoded (and rejected) again
+		exp = payload.get("exp")
+		if exp is not None:
+			token_cache.set(key, token_data, ttl=exp - time.time())
 		return token_data
-	except JWTError:
-	    raise credentials_exception
\ No newline at end of file
+	except InvalidToken:
+	    raise credentials_exception
+
+def token_cache_stats():
+    return {"backend": backend.name, **token_cache.stats()}
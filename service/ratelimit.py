@@ -0,0 +1,155 @@
+import math
+import os
+import time
+
+from dotenv import load_dotenv
+from fastapi import Depends, HTTPException, status
+
+from db.completion_cache import current_completions, track_completions
+from db.credit_check import InsufficientCredits, credit_ledger, release_reserved_credits
+from service.cache import LRUCache
+from service.oauth import get_current_user
+
+load_dotenv()
+
+# Token bucket per user: up to RATE_LIMIT_BURST tokens, refilled at
+# RATE_LIMIT_PER_SECOND. Each request takes its endpoint's cost.
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "60"))
+RATE_LIMIT_PER_SECOND = float(os.getenv("RATE_LIMIT_PER_SECOND", "1"))
+RATE_LIMIT_MAX_USERS = int(os.getenv("RATE_LIMIT_MAX_USERS", "100000"))
+
+# Rate limit tokens per request. Override with RATE_COST_<NAME>.
+# analyze_batch is charged per chunk of NLP_BATCH_CHUNK_SIZE texts.
+RATE_COSTS = {
+    "analyze": 1,
+    "analyze_batch": 5,
+    "analyze_long": 2,
+    "feedback": 1,
+    "gpt_analyze": 5,
+    "analyze_mult": 5,
+    "reduce_bias_txt": 5,
+    "reduce_bias": 10,
+    "multicon_bias_ana": 10,
+}
+# Credits charged per request on endpoints that call OpenAI. Override with CREDIT_COST_<NAME>.
+CREDIT_COSTS = {
+    "gpt_analyze": 1,
+    "analyze_mult": 1,
+    "reduce_bias_txt": 2,
+    "reduce_bias": 4,
+    "multicon_bias_ana": 4,
+}
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.updated = time.monotonic()
+
+
+class RateLimiter:
+    """
+    Token buckets keyed on the JWT principal.
+
+    Only used from the event loop, so no locking. Buckets of idle users are
+    dropped once there are more than `max_users`; they come back full, which
+    is what they would have refilled to anyway.
+    """
+
+    def __init__(self, burst=RATE_LIMIT_BURST, per_second=RATE_LIMIT_PER_SECOND, max_users=RATE_LIMIT_MAX_USERS):
+        self.burst = burst
+        self.per_second = per_second
+        self.buckets = LRUCache(maxsize=max_users)
+        self.allowed = {}
+        self.limited = {}
+
+    def acquire(self, user, name, cost):
+        """Take `cost` tokens; returns 0 on success or the seconds to wait before retrying."""
+        bucket = self.buckets.get(user)
+        if bucket is None:
+            bucket = TokenBucket(self.burst)
+            self.buckets.set(user, bucket)
+        now = time.monotonic()
+        bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.per_second)
+        bucket.updated = now
+
+        cost = min(cost, self.burst)
+        if bucket.tokens >= cost:
+            bucket.tokens -= cost
+            self.allowed[name] = self.allowed.get(name, 0) + 1
+            return 0
+        self.limited[name] = self.limited.get(name, 0) + 1
+        return (cost - bucket.tokens) / self.per_second
+
+    def stats(self):
+        return {
+            "burst": self.burst,
+            "per_second": self.per_second,
+            "users": self.buckets.stats()["size"],
+            "allowed": self.allowed,
+            "limited": self.limited,
+        }
+
+
+rate_limiter = RateLimiter()
+
+def endpoint_cost(name):
+    rate_cost = float(os.getenv(f"RATE_COST_{name.upper()}", RATE_COSTS.get(name, 1)))
+    credit_cost = int(os.getenv(f"CREDIT_COST_{name.upper()}", CREDIT_COSTS.get(name, 0)))
+    return rate_cost, credit_cost
+
+def charge(user, name, units=1):
+    """Take `units` times the endpoint's rate cost from the user's bucket; raises 429 when it is short."""
+    rate_cost, _ = endpoint_cost(name)
+    retry_after = rate_limiter.acquire(user, name, rate_cost * units)
+    if retry_after:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Rate limit exceeded",
+                            headers={"Retry-After": str(math.ceil(retry_after))})
+
+def settle_credits():
+    """
+    Give back the current request's reserved credits unless one of its
+    completions was produced upstream: answers reused from the completion
+    cache, and upstream calls that failed, are not charged.
+    """
+    tally = current_completions()
+    if tally is not None and not tally.produced:
+        release_reserved_credits()
+
+def rate_limit(name, stream=False):
+    """
+    FastAPI dependency: charge the caller's token bucket and, for GPT endpoints,
+    reserve their credits. Raises 429 with Retry-After when the bucket is empty
+    and 402 when the credits are used up.
+
+    Reserved credits are given back when the request fails with a 5xx, and
+    settled when it returns. Streaming responses outlive the dependency, so
+    with `stream` the stream calls settle_credits() itself once it ends.
+    """
+    _, credit_cost = endpoint_cost(name)
+
+    async def dependency(current_user=Depends(get_current_user)):
+        charge(current_user.username, name)
+        if not credit_cost:
+            yield
+            return
+        try:
+            reservation = await credit_ledger.reserve(current_user.username, credit_cost)
+        except InsufficientCredits as e:
+            raise HTTPException(status_code=status.HTTP_402_PAYMENT_REQUIRED, detail=str(e))
+        track_completions()
+        try:
+            yield
+        except Exception as e:
+            if not isinstance(e, HTTPException) or e.status_code >= 500:
+                reservation.release()
+            raise
+        if not stream:
+            settle_credits()
+
+    return dependency
+
+def ratelimit_stats():
+    return {**rate_limiter.stats(), "credits": credit_ledger.stats()}
@@ -0,0 +1,161 @@
+import contextlib
+import contextvars
+import os
+import time
+
+from dotenv import load_dotenv
+from starlette.datastructures import MutableHeaders
+
+load_dotenv()
+
+# Per-stage spans, the Server-Timing header and /api/stats/metrics. When
+# disabled, span() is a context variable lookup returning a shared no-op.
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+# Histogram bucket upper bounds, in seconds
+TRACING_BUCKETS = tuple(float(b) for b in os.getenv(
+    "TRACING_BUCKETS", "0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10,30,60").split(","))
+
+_current_trace = contextvars.ContextVar("trace", default=None)
+_noop = contextlib.nullcontext()
+
+
+class Trace:
+    """Spans recorded while handling one request; shared with the threads it hands work to."""
+
+    __slots__ = ("start", "spans")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans = []
+
+    def durations(self):
+        """Total milliseconds per stage, in the order the stages first ran."""
+        totals = {}
+        for name, ms in self.spans:
+            totals[name] = totals.get(name, 0.0) + ms
+        return totals
+
+
+class Span:
+    __slots__ = ("trace", "name", "start")
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.trace.spans.append((self.name, (time.perf_counter() - self.start) * 1000))
+
+
+def span(name):
+    """
+    Time a stage of the current request: `with span("clip"): ...`
+
+    Works in async code and in threads started through run_blocking or
+    asyncio.to_thread, which copy the request's context. Outside a request,
+    or with TRACING_ENABLED=false, nothing is recorded.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return _noop
+    return Span(trace, name)
+
+def record(name, ms):
+    """Add a stage whose duration was measured elsewhere (e.g. by the hashing pool)."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.spans.append((name, ms))
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label set, in the Prometheus layout."""
+
+    def __init__(self, name, help, labels, buckets=TRACING_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+
+    def observe(self, label_values, seconds):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+        counts = series[0]
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                counts[i] += 1
+        series[1] += seconds
+        series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_values, (counts, total, count) in sorted(self._series.items()):
+            labels = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.labels, label_values))
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound:g}"}} {bucket_count}')
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total:.6f}")
+            lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return "\n".join(lines)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Only observed from the event loop, in the middleware, so no locking
+request_duration = Histogram("neutralize_request_duration_seconds", "Time to handle a request, including streaming",
+                             ("endpoint", "method", "status"))
+stage_duration = Histogram("neutralize_stage_duration_seconds", "Time spent in each stage of a request",
+                           ("endpoint", "stage"))
+
+def render_metrics():
+    """All histograms in the Prometheus text exposition format."""
+    return "\n".join(metric.render() for metric in (request_duration, stage_duration)) + "\n"
+
+
+class TracingMiddleware:
+    """
+    Starts a Trace for every HTTP request, adds a Server-Timing header with
+    the stages finished before the response starts, and records the request
+    and its stages in the histograms once the body has been sent.
+
+    Endpoints are labelled with their route template (e.g. /api/user/{id}),
+    or "unmatched", so the number of series stays bounded.
+    """
+
+    def __init__(self, app, enabled=TRACING_ENABLED):
+        self.app = app
+        self.enabled = enabled
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace()
+        token = _current_trace.set(trace)
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                timings = [f"{name};dur={ms:.1f}" for name, ms in trace.durations().items()]
+                timings.append(f"total;dur={(time.perf_counter() - trace.start) * 1000:.1f}")
+                MutableHeaders(scope=message).append("Server-Timing", ", ".join(timings))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current_trace.reset(token)
+            route = scope.get("route")
+            endpoint = getattr(route, "path", None) or "unmatched"
+            request_duration.observe((endpoint, scope["method"], str(status)), time.perf_counter() - trace.start)
+            for name, ms in trace.durations().items():
+                stage_duration.observe((endpoint, name), ms / 1000)
@@ -0,0 +1,57 @@
+import asyncio
+import os
+import time
+
+from cryptography.fernet import Fernet
+
+os.environ.setdefault("ENCRYPTION_KEY", Fernet.generate_key().decode())
+os.environ.setdefault("SECRET_KEY", "test")
+
+import httpx
+from fastapi import FastAPI
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine
+
+import CRUD.authen as authen
+import service.hashing as hashing
+from models import Users, meta
+
+POOL_SIZE = 2
+
+
+def test_login_burst_is_shed_not_failed(tmp_path, monkeypatch):
+    # A small database pool that times out fast, and slow password checks
+    url = f"sqlite:///{tmp_path / 'auth.db'}"
+    sync_engine = create_engine(url)
+    meta.create_all(sync_engine)
+    with sync_engine.begin() as conn:
+        conn.execute(Users.insert().values(username="alice", email=authen.encrypt_email("alice@example.com"),
+                                           email_index=authen.email_blind_index("alice@example.com"),
+                                           is_superuser=False, password="hash"))
+    sync_engine.dispose()
+
+    def slow_verify(hashed, password):
+        time.sleep(0.2)
+        return True, None
+
+    monkeypatch.setattr(hashing, "_verify", slow_verify)
+    monkeypatch.setattr(hashing, "LOGIN_CACHE_TTL", 0)
+    monkeypatch.setattr(hashing, "hash_executor", hashing.HashExecutor(workers=1, max_pending=2))
+    app = FastAPI()
+    app.include_router(authen.auth)
+
+    async def burst():
+        engine = create_async_engine(url.replace("sqlite://", "sqlite+aiosqlite://", 1),
+                                     pool_size=POOL_SIZE, max_overflow=0, pool_timeout=0.5)
+        monkeypatch.setattr(authen, "async_engine", engine)
+        try:
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app), base_url="http://test") as client:
+                return await asyncio.gather(*(
+                    client.post("/login", data={"username": "alice", "password": "secret"})
+                    for _ in range(POOL_SIZE * 5)
+                ))
+        finally:
+            await engine.dispose()
+
+    statuses = [response.status_code for response in asyncio.run(burst())]
+    assert set(statuses) == {200, 503}
@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+from neutralize.reinforced.batching import BatchEngine
+
+
+def test_results_go_back_to_their_callers():
+    seen = []
+
+    def infer(texts):
+        seen.append(len(texts))
+        return [text.upper() for text in texts]
+
+    engine = BatchEngine(infer, max_batch_size=8, max_wait_ms=20)
+
+    async def scenario():
+        texts = [f"text {i}" for i in range(40)]
+        return texts, await asyncio.gather(*(engine.submit(text) for text in texts))
+
+    texts, results = asyncio.run(scenario())
+    assert results == [text.upper() for text in texts]
+    assert max(seen) <= 8
+    assert engine.batches == len(seen) < 40
+
+def test_errors_reach_every_caller_of_the_batch():
+    def infer(texts):
+        if "bad" in texts:
+            raise ValueError("cannot score")
+        return [len(text) for text in texts]
+
+    engine = BatchEngine(infer, max_batch_size=4, max_wait_ms=20)
+
+    async def scenario():
+        results = await asyncio.gather(*(engine.submit(text) for text in ("a", "bad", "ccc")), return_exceptions=True)
+        # The worker survives a failed batch
+        return results, await engine.submit("dddd")
+
+    results, after = asyncio.run(scenario())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert after == 4
+    assert engine.errors == 1
+
+def test_cancelled_callers_are_skipped():
+    batches = []
+
+    def infer(texts):
+        batches.append(texts)
+        return texts
+
+    engine = BatchEngine(infer, max_batch_size=4, max_wait_ms=50)
+
+    async def scenario():
+        gone = asyncio.create_task(engine.submit("gone"))
+        kept = asyncio.create_task(engine.submit("kept"))
+        await asyncio.sleep(0.01)
+        gone.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await gone
+        return await kept
+
+    assert asyncio.run(scenario()) == "kept"
+    assert batches == [["kept"]]
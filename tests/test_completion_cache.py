@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine
+
+import db.completion_cache as completion_cache
+from db.completion_cache import CompletionStore, track_completions
+from models import meta
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'completions.db'}")
+    meta.create_all(engine)
+    monkeypatch.setattr(completion_cache, "engine", engine)
+    yield CompletionStore()
+    engine.dispose()
+
+async def until(condition):
+    while not condition():
+        await asyncio.sleep(0.01)
+
+
+def test_concurrent_callers_share_one_call(store):
+    calls = []
+
+    async def produce():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "answer", None
+
+    async def caller():
+        tally = track_completions()
+        value = await store.get_or_create("key", "gpt-4", produce)
+        return value, tally.produced, tally.reused
+
+    async def scenario():
+        return await asyncio.gather(*(caller() for _ in range(5)))
+
+    results = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert all(value == "answer" for value, _, _ in results)
+    assert sorted(produced for _, produced, _ in results) == [0, 0, 0, 0, 1]
+    assert store.coalesced == 4
+
+def test_follower_retries_after_leader_cancelled(store):
+    async def hang():
+        await asyncio.Event().wait()
+
+    async def produce():
+        return "answer", None
+
+    async def miss(key):
+        return None
+
+    async def scenario():
+        # No database round trip, so the follower is waiting on the leader before it is cancelled
+        store._lookup = miss
+        leader = asyncio.create_task(store.get_or_create("key", "gpt-4", hang))
+        await until(lambda: "key" in store._inflight)
+        follower = asyncio.create_task(store.get_or_create("key", "gpt-4", produce))
+        await asyncio.sleep(0.01)
+        assert store.misses == 1
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        # The follower is not cancelled with the leader; it produces the value itself
+        assert await follower == "answer"
+        assert "key" not in store._inflight
+
+    asyncio.run(scenario())
+    assert store.misses == 2
+
+def test_uncacheable_value_is_not_stored(store):
+    async def produce():
+        return "partial", None
+
+    async def scenario():
+        assert await store.get_or_create("key", "gpt-4", produce, lambda value: False) == "partial"
+        assert await store.get("key") is None
+
+    asyncio.run(scenario())
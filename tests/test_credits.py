@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine, select
+
+import db.credit_check as credit_check
+from db.credit_check import CreditLedger, InsufficientCredits
+from models import Credits, meta
+
+
+@pytest.fixture
+def ledger(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'credits.db'}")
+    meta.create_all(engine)
+    monkeypatch.setattr(credit_check, "engine", engine)
+    yield CreditLedger(default_credits=100, flush_threshold=10**6, balance_ttl=60)
+    engine.dispose()
+
+def stored(user):
+    with credit_check.engine.begin() as conn:
+        return conn.execute(select(Credits.c.credit).where(Credits.c.user == user)).scalar()
+
+
+def test_refund_after_flush(ledger):
+    async def scenario():
+        reservation = await ledger.reserve("alice", 10)
+        await ledger.flush()
+        assert stored("alice") == 90
+        # Already written: the refund is a negative pending charge until the next flush
+        reservation.release()
+        assert ledger.pending["alice"] == -10
+        assert ledger.available("alice") == 100
+        await ledger.flush()
+        assert stored("alice") == 100
+        assert ledger.available("alice") == 100
+
+    asyncio.run(scenario())
+
+def test_release_is_idempotent(ledger):
+    async def scenario():
+        reservation = await ledger.reserve("bob", 30)
+        reservation.release()
+        reservation.release()
+        assert ledger.available("bob") == 100
+        assert ledger.refunded == 30
+
+    asyncio.run(scenario())
+
+def test_charge_over_balance(ledger):
+    async def scenario():
+        await ledger.charge("carol", 60)
+        with pytest.raises(InsufficientCredits):
+            await ledger.charge("carol", 60)
+        assert ledger.available("carol") == 40
+
+    asyncio.run(scenario())
@@ -0,0 +1,36 @@
+import os
+
+# Importing neutralize.NLP builds the OpenAI clients, which need a key
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from neutralize.NLP.prompting import OMISSION_MARKER, TokenCounter, fit_text, prompt_version
+
+counter = TokenCounter("chars")
+ARTICLE = "\n\n".join(f"Paragraph {i} on the senate budget vote and tariffs number {i}. " * 5 for i in range(20))
+
+
+def test_fit_text_keeps_short_text():
+    assert fit_text("A short text.", 100, counter) == ("A short text.", 4)
+
+def test_fit_text_drops_paragraphs_to_budget():
+    fitted, tokens = fit_text(ARTICLE, 400, counter)
+    assert tokens <= 400
+    assert tokens == counter.count(fitted)
+    assert OMISSION_MARKER in fitted
+
+def test_fit_text_tiny_budget():
+    # " [...]" is 2 tokens: below 3 the best paragraph is cut without it
+    for budget in (1, 2, 3, 10):
+        fitted, tokens = fit_text(ARTICLE, budget, counter)
+        assert 0 < tokens <= budget
+        assert tokens == counter.count(fitted)
+        assert (OMISSION_MARKER in fitted) == (budget > 2)
+
+def test_fit_text_no_budget():
+    assert fit_text(ARTICLE, 0, counter) == ("", 0)
+
+def test_prompt_version_includes_output_budget(monkeypatch):
+    before = prompt_version("v1", "gpt-4")
+    monkeypatch.setenv("MODEL_OUTPUT_TOKENS_GPT_4", "500")
+    assert prompt_version("v1", "gpt-4") != before
+    assert prompt_version("v1", "gpt-4", 200) != prompt_version("v1", "gpt-4", 300)
@@ -0,0 +1,26 @@
+import os
+
+# Importing neutralize.NLP builds the OpenAI clients, which need a key
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from neutralize.NLP import routing
+from neutralize.NLP.prompting import TokenCounter, model_budget
+
+MIXED = {"Left": 0.3, "Middle": 0.4, "Right": 0.3}
+
+
+def test_tier_limits_fit_strong_model_budget():
+    room = model_budget(routing.ROUTING_STRONG_MODEL)[0] - routing.ROUTING_PROMPT_RESERVE
+    for tier in routing.ROUTING_STRONG_MAX_TOKENS:
+        assert routing.strong_max_tokens(tier) <= room
+
+def test_article_over_strong_budget_goes_to_cheap_model(monkeypatch):
+    monkeypatch.setattr(routing, "ROUTING_POLICY", "cost")
+    monkeypatch.setattr(routing, "token_counter", lambda model: TokenCounter("chars"))
+    monkeypatch.setitem(routing.ROUTING_STRONG_MAX_TOKENS, "standard", 10**6)
+    room = routing.strong_article_room()
+    counter = routing.token_counter(routing.ROUTING_STRONG_MODEL)
+    article = "word " * (room * 2)
+    assert counter.count(article) > room
+    assert routing.route(article, MIXED) == (routing.ROUTING_CHEAP_MODEL, "too_long_for_tier")
+    assert routing.route("A short article.", MIXED) == (routing.ROUTING_STRONG_MODEL, "mixed")